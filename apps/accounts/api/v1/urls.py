@@ -2,16 +2,21 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenBlacklistView
 
-from .views import get_routes, PersonalizationViewSet
+from .views import get_routes, PersonalizationViewSet, SessionView, UserViewSet
 
 router = DefaultRouter()
 router.register(r'personalizations', PersonalizationViewSet, basename='personalization')
 
+# Replaces djoser.urls, so that the user endpoints use our UserViewSet
+auth_router = DefaultRouter()
+auth_router.register(r'users', UserViewSet)
+
 
 urlpatterns = [
-    path('auth/', include('djoser.urls')),
+    path('auth/', include(auth_router.urls)),
     path('auth/', include('djoser.urls.jwt')),
     path('auth/token/blacklist/', TokenBlacklistView.as_view(), name='token_blacklist'),
     path('auth/routes/', get_routes, name='routes'),
+    path('auth/session/', SessionView.as_view(), name='session'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
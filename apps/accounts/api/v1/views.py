@@ -1,8 +1,14 @@
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import viewsets, permissions
-from apps.accounts.models import Personalization
-from .serializers import PersonalizationSerializer
+from rest_framework.generics import get_object_or_404
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from djoser.views import UserViewSet as BaseUserViewSet
+from apps.accounts.cache import get_session
+from apps.accounts.models import CustomUser, Personalization
+from apps.storyline.cache import get_catalog_version
+from .serializers import CustomUserSerializer, PersonalizationSerializer
 
 @api_view(['GET'])
 def get_routes(request):
@@ -18,6 +24,7 @@ def get_routes(request):
             "Resend Activation": "/api/v1/auth/users/resend_activation/",
             "Set New Password": "/api/v1/auth/users/set_password/",
             "User Profile": "/api/v1/auth/users/me/",
+            "Session Bootstrap": "/api/v1/auth/session/",
             "Delete User": "/api/v1/auth/users/{id}/",
             "User List (Admin)": "/api/v1/auth/users/",
             "User Detail (Admin)": "/api/v1/auth/users/{id}/",
@@ -33,9 +40,37 @@ class PersonalizationViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        # Optionally, restrict to the authenticated user's personalization
-        return Personalization.objects.filter(user=self.request.user)
+        # Optionally, restrict to the authenticated user's personalization. By id, since
+        # request.user is built from the token's claims
+        return Personalization.objects.filter(user_id=self.request.user.pk)
 
     def perform_create(self, serializer):
         # Automatically set the user to the authenticated user
-        serializer.save(user=self.request.user)
\ No newline at end of file
+        serializer.save(user_id=self.request.user.pk)
+
+class UserViewSet(BaseUserViewSet):
+    """
+    djoser's user endpoints, which read and save the user, with the real user loaded.
+    """
+    authentication_classes = [JWTAuthentication]
+
+
+class SessionView(APIView):
+    """
+    What the client loads on start-up, in one request: the user, their personalization
+    (null when they have none) and the storyline catalog version. The user part is
+    cached per user, so with a warm cache and a claims token this runs no queries.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        session = get_session(request.user.pk, lambda: self.build_session(request.user.pk))
+        return Response({**session, 'catalog_version': get_catalog_version()})
+
+    def build_session(self, user_id):
+        user = get_object_or_404(CustomUser.objects.select_related('personalization'), pk=user_id)
+        personalization = getattr(user, 'personalization', None)
+        return {
+            'user': dict(CustomUserSerializer(user).data),
+            'personalization': dict(PersonalizationSerializer(personalization).data) if personalization else None,
+        }
@@ -0,0 +1,51 @@
+"""
+Claims-based JWT authentication.
+
+Access tokens carry the user's is_active and is_staff flags and their
+Personalization difficulty, so ClaimsJWTAuthentication can authenticate a request
+from the token alone and hand the view a ClaimsUser instead of loading the
+CustomUser row. Views that need the real user (to save it, or to use it in a query
+as a model instance) opt in with authentication_classes = [JWTAuthentication].
+
+Claims are written when an access token is issued (tokens.RefreshToken), at login
+and on every refresh, so a change to the user shows up in their requests within
+ACCESS_TOKEN_LIFETIME.
+"""
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from .tokens import USER_CLAIMS
+
+
+class ClaimsUser(TokenUser):
+    """
+    The user as described by the access token. Has the id, pk, is_active, is_staff and
+    difficulty of the CustomUser without a query; it can't be saved or used as a model
+    instance.
+    """
+    @cached_property
+    def is_active(self):
+        return self.token['is_active']
+
+    @cached_property
+    def difficulty(self):
+        return self.token.get('difficulty')
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that builds the user from the token's claims. Tokens issued
+    before the claims were added fall back to loading the user.
+    """
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        user = ClaimsUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
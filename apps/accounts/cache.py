@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.cache import cache
+from config.db_routers import use_primary
+
+SESSION_KEY = 'accounts:session:{user_id}'
+
+
+def get_session(user_id, build):
+    """
+    Return the cached session payload of a user (their profile and personalization),
+    calling build() to produce and cache it on a miss. Like the catalog, it is built
+    from the primary so a lagging replica can't get cached.
+    """
+    key = SESSION_KEY.format(user_id=user_id)
+    session = cache.get(key)
+    if session is None:
+        with use_primary():
+            session = build()
+        cache.set(key, session, timeout=settings.ACCOUNTS_SESSION_CACHE_TIMEOUT)
+    return session
+
+
+def invalidate_session(user_id):
+    cache.delete(SESSION_KEY.format(user_id=user_id))
@@ -0,0 +1,119 @@
+"""
+Queued email delivery.
+
+QueuedEmailBackend is the EMAIL_BACKEND: sending mail (djoser's activation and
+confirmation emails included) only records an OutboundEmail, so requests never wait
+on SMTP. deliver() claims due emails and sends them through EMAIL_DELIVERY_BACKEND
+over one connection kept open across batches, retrying failures with exponential
+backoff.
+"""
+import logging
+import smtplib
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        return OutboundEmail.objects.enqueue(email_messages)
+
+
+def backoff(attempts):
+    # 1x, 2x, 4x ... the base delay, capped
+    delay = settings.EMAIL_QUEUE_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, settings.EMAIL_QUEUE_MAX_BACKOFF_SECONDS))
+
+
+def claim_emails(batch_size):
+    """
+    Claim up to batch_size due emails, leased like assistant sync jobs: a crashed
+    worker's emails become due again when the lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(
+                status__in=[OutboundEmail.STATUS_PENDING, OutboundEmail.STATUS_RUNNING],
+                run_after__lte=now,
+            )
+            .order_by('run_after')[:batch_size]
+        )
+        if emails:
+            OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                status=OutboundEmail.STATUS_RUNNING,
+                run_after=now + timedelta(seconds=settings.EMAIL_QUEUE_LEASE_SECONDS),
+            )
+    return emails
+
+
+def fail_email(email, error, permanent=False):
+    attempts = email.attempts + 1
+    logger.warning("Email %s failed (attempt %s): %s", email.pk, attempts, error)
+    failed = permanent or attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        attempts=attempts,
+        last_error=str(error),
+        status=OutboundEmail.STATUS_FAILED if failed else OutboundEmail.STATUS_PENDING,
+        run_after=timezone.now() + backoff(attempts),
+    )
+    return OutboundEmail.STATUS_FAILED if failed else 'retry'
+
+
+def send_email(connection, email):
+    try:
+        # Opens the connection if it isn't already; a no-op while it stays up
+        connection.open()
+        connection.send_messages([email.to_message()])
+    except smtplib.SMTPRecipientsRefused as e:
+        # The server is fine, the addresses aren't: retrying won't help
+        return fail_email(email, e, permanent=True)
+    except Exception as e:
+        # The connection may be broken; drop it so the next email reconnects
+        try:
+            connection.close()
+        except Exception:
+            pass
+        return fail_email(email, e)
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        attempts=email.attempts + 1,
+        last_error='',
+        status=OutboundEmail.STATUS_SENT,
+        sent_at=timezone.now(),
+    )
+    return OutboundEmail.STATUS_SENT
+
+
+def deliver(connection=None, batch_size=50, limit=None):
+    """
+    Send due emails until none are left (or limit emails were handled) over a single
+    connection, and return counts per outcome and the seconds it took.
+    """
+    if connection is None:
+        connection = get_connection(settings.EMAIL_DELIVERY_BACKEND)
+    stats = {OutboundEmail.STATUS_SENT: 0, 'retry': 0, OutboundEmail.STATUS_FAILED: 0}
+    handled = 0
+    start = time.perf_counter()
+    try:
+        while limit is None or handled < limit:
+            size = batch_size if limit is None else min(batch_size, limit - handled)
+            emails = claim_emails(size)
+            if not emails:
+                break
+            for email in emails:
+                stats[send_email(connection, email)] += 1
+            handled += len(emails)
+    finally:
+        connection.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from apps.accounts.models import RevokedToken
+
+
+def delete_in_batches(queryset, batch_size, pause):
+    # Short transactions by primary key, so the purge never holds locks on millions of rows
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        queryset.model.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete revoked refresh tokens that have expired, in batches. Also empties simplejwt's "
+        "outstanding and blacklisted token tables of expired tokens, which are no longer written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        revoked = delete_in_batches(
+            RevokedToken.objects.filter(expires_at__lte=now), options['batch_size'], options['pause']
+        )
+        outstanding = delete_in_batches(
+            OutstandingToken.objects.filter(expires_at__lte=now), options['batch_size'], options['pause']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {revoked} revoked tokens and {outstanding} outstanding tokens."
+        ))
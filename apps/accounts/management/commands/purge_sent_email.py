@@ -0,0 +1,30 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from apps.accounts.models import OutboundEmail
+from .purge_revoked_tokens import delete_in_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete sent and failed emails older than EMAIL_QUEUE_RETENTION_DAYS from the outbox, "
+        "in batches. Pending mail is never deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Retention in days, instead of EMAIL_QUEUE_RETENTION_DAYS.")
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.EMAIL_QUEUE_RETENTION_DAYS
+        cutoff = timezone.now() - timedelta(days=days)
+        # Failed rows have no finish time; they are kept for the retention from when they were queued
+        done = OutboundEmail.objects.filter(
+            Q(status=OutboundEmail.STATUS_SENT, sent_at__lte=cutoff)
+            | Q(status=OutboundEmail.STATUS_FAILED, created_at__lte=cutoff)
+        )
+        deleted = delete_in_batches(done, options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} emails."))
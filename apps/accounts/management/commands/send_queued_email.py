@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.accounts.mail import deliver
+
+
+class Command(BaseCommand):
+    help = "Send queued emails through EMAIL_DELIVERY_BACKEND over one connection, with retries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Send the due emails once and exit.")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            stats = deliver(batch_size=options['batch_size'])
+            if any(stats[outcome] for outcome in ('sent', 'retry', 'failed')):
+                self.stdout.write(
+                    f"Sent {stats['sent']}, retrying {stats['retry']}, failed {stats['failed']} in {stats['seconds']:.1f}s"
+                )
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
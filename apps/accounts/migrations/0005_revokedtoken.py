@@ -0,0 +1,42 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:46
+
+import uuid
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_blacklisted_tokens(apps, schema_editor):
+    # Carry over the unexpired entries of simplejwt's blacklist, which revocation no longer reads
+    BlacklistedToken = apps.get_model('token_blacklist', 'BlacklistedToken')
+    RevokedToken = apps.get_model('accounts', 'RevokedToken')
+    rows = (
+        BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+        .values_list('token__jti', 'token__expires_at')
+        .iterator(chunk_size=10000)
+    )
+    batch = []
+    for jti, expires_at in rows:
+        batch.append(RevokedToken(jti=uuid.UUID(jti), expires_at=expires_at))
+        if len(batch) == 10000:
+            RevokedToken.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    RevokedToken.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_customuser_email_lower_index'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('jti', models.UUIDField(primary_key=True, serialize=False)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(copy_blacklisted_tokens, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,34 @@
+import base64
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
-from django.db import models
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from django.db.models.functions import Lower
 class CustomUserManager(BaseUserManager):
 
     def get_by_natural_key(self, username):
-        return self.get(
-            Q(**{self.model.USERNAME_FIELD: username}) |
-            Q(**{self.model.EMAIL_FIELD: username})
-        )
+        """
+        Log in by username or email with one index lookup rather than an OR across both
+        columns. Only input with an '@' can be an email; it is matched case-insensitively
+        through the lower(email) index and falls back to the username, which may contain
+        '@' too.
+        """
+        if '@' in username:
+            user = self.get_by_email(username)
+            if user is not None:
+                return user
+        return self.get(**{self.model.USERNAME_FIELD: username})
+
+    def get_by_email(self, email):
+        users = list(self.alias(email_lower=Lower(self.model.EMAIL_FIELD)).filter(email_lower=email.lower())[:2])
+        if len(users) == 1:
+            return users[0]
+        if users:
+            # Addresses differing only in case, which the unique constraint allows; take the exact one
+            return self.filter(**{self.model.EMAIL_FIELD: email}).first()
+        return None
 
     def create_user(self, username, email, password, **extra_fields):
 
@@ -47,10 +68,155 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     EMAIL_FIELD = 'email'
     REQUIRED_FIELDS = ['email']
 
+    class Meta:
+        indexes = [
+            models.Index(Lower('email'), name='accounts_user_email_lower_idx'),
+        ]
+
     def __str__(self):
         return self.username
 
 class Personalization(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='personalization')
     difficulty = models.IntegerField(default=1) # HSK 1,2,3,4,5
-    personal_details = models.TextField(blank=True, null=True)
\ No newline at end of file
+    personal_details = models.TextField(blank=True, null=True)
+
+
+def remaining_seconds(expires_at):
+    return max(int((expires_at - timezone.now()).total_seconds()), 1)
+
+
+class RevokedTokenManager(models.Manager):
+    """
+    Revocation checks go through the cache: a revoked jti is cached until its token
+    expires, and a jti found not revoked for up to TOKEN_REVOCATION_NEGATIVE_CACHE_SECONDS.
+    The negative entry is only ever added, never overwritten onto a revocation, so a
+    shared cache can't answer "not revoked" for a revoked token.
+    """
+    CACHE_KEY = 'accounts:revoked:{jti}'
+
+    def is_revoked(self, jti, expires_at):
+        key = self.CACHE_KEY.format(jti=jti)
+        revoked = cache.get(key)
+        if revoked is None:
+            revoked = self.filter(jti=jti).exists()
+            timeout = remaining_seconds(expires_at)
+            if not revoked:
+                timeout = min(timeout, settings.TOKEN_REVOCATION_NEGATIVE_CACHE_SECONDS)
+            cache.add(key, revoked, timeout=timeout)
+        return revoked
+
+    def revoke(self, jti, expires_at):
+        """
+        Revoke the token and return True, or False when it already was. The insert
+        decides, so of two concurrent refreshes with the same token only one wins.
+        """
+        try:
+            with transaction.atomic():
+                self.create(jti=jti, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        transaction.on_commit(
+            lambda: cache.set(self.CACHE_KEY.format(jti=jti), True, timeout=remaining_seconds(expires_at))
+        )
+        return True
+
+
+class RevokedToken(models.Model):
+    """
+    A refresh token that was rotated or logged out, keyed by its jti. Only revoked
+    tokens are stored, and only what the check needs, so the table and its primary
+    key index stay small; purge_revoked_tokens removes rows once the token has expired.
+    """
+    jti = models.UUIDField(primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = RevokedTokenManager()
+
+    def __str__(self):
+        return str(self.jti)
+
+
+class OutboundEmailManager(models.Manager):
+    def enqueue(self, messages):
+        # Written in the caller's transaction, so mail about a rolled back change is never sent
+        return len(self.bulk_create([OutboundEmail(message=OutboundEmail.serialize(message)) for message in messages]))
+
+
+class OutboundEmail(models.Model):
+    """
+    Outbox entry for an email, sent by the send_queued_email worker. The message is
+    stored as JSON: subject, body, addresses, headers, alternatives and attachments.
+    purge_sent_email deletes sent and failed rows after EMAIL_QUEUE_RETENTION_DAYS.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    message = models.JSONField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # Not claimable before this time (backoff and lease)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OutboundEmailManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.message['subject']} to {', '.join(self.message['to'])} ({self.status})"
+
+    @staticmethod
+    def serialize(message):
+        attachments = []
+        for attachment in message.attachments:
+            if not isinstance(attachment, tuple):
+                raise ValueError("Only (filename, content, mimetype) attachments can be queued")
+            filename, content, mimetype = attachment
+            if isinstance(content, bytes):
+                attachments.append([filename, base64.b64encode(content).decode(), mimetype, 'base64'])
+            else:
+                attachments.append([filename, content, mimetype, None])
+        return {
+            'subject': message.subject,
+            'body': message.body,
+            'content_subtype': message.content_subtype,
+            'from_email': message.from_email,
+            'to': list(message.to),
+            'cc': list(message.cc),
+            'bcc': list(message.bcc),
+            'reply_to': list(message.reply_to),
+            'headers': message.extra_headers,
+            'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+            'attachments': attachments,
+        }
+
+    def to_message(self):
+        data = self.message
+        message = EmailMultiAlternatives(
+            subject=data['subject'],
+            body=data['body'],
+            from_email=data['from_email'],
+            to=data['to'],
+            cc=data['cc'],
+            bcc=data['bcc'],
+            reply_to=data['reply_to'],
+            headers=data['headers'],
+            alternatives=[tuple(alternative) for alternative in data['alternatives']],
+        )
+        message.content_subtype = data['content_subtype']
+        for filename, content, mimetype, encoding in data['attachments']:
+            message.attach(filename, base64.b64decode(content) if encoding == 'base64' else content, mimetype)
+        return message
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .cache import invalidate_session
+from .models import CustomUser, Personalization
+
+# Changes to a user or their personalization drop their cached session payload once the transaction commits
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_session_on_user_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_session(instance.pk))
+
+@receiver([post_save, post_delete], sender=Personalization)
+def invalidate_session_on_personalization_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_session(instance.user_id))
@@ -1,10 +1,27 @@
-from django.test import TestCase
-from django.urls import reverse
+import re
+import uuid
+from datetime import timedelta
+from io import StringIO
+import pytest
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core import mail
-from rest_framework.test import APIClient
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from django.contrib.auth import get_user_model
-import re
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.accounts.mail import deliver
+from apps.accounts.models import OutboundEmail, Personalization, RevokedToken
+from apps.storyline.cache import get_catalog_version
+from services.smtp_stub import SMTPStubServer
 
 User = get_user_model()
 
@@ -145,4 +162,441 @@ class AccountEndpointsTestCase(TestCase):
         url = reverse('accounts:v1:jwt-refresh')
         response = self.client.post(url, {'refresh': refresh_token})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIn('access', response.data)
\ No newline at end of file
+        self.assertIn('access', response.data)
+
+class NaturalKeyLookupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='learner', email='Learner@Example.com', password='testpassword123')
+
+    def test_username_lookup(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(User.objects.get_by_natural_key('learner'), self.user)
+
+    def test_email_lookup_ignores_case(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(User.objects.get_by_natural_key('learner@example.com'), self.user)
+
+    def test_username_containing_at_sign(self):
+        other = User.objects.create_user(username='me@home', email='other@example.com', password='testpassword123')
+        self.assertEqual(User.objects.get_by_natural_key('me@home'), other)
+
+    def test_email_differing_only_in_case(self):
+        other = User.objects.create_user(username='other', email='learner@example.com', password='testpassword123')
+        self.assertEqual(User.objects.get_by_natural_key('learner@example.com'), other)
+        self.assertEqual(User.objects.get_by_natural_key('Learner@Example.com'), self.user)
+
+    def test_unknown_user(self):
+        with self.assertRaises(User.DoesNotExist):
+            User.objects.get_by_natural_key('nobody')
+        with self.assertRaises(User.DoesNotExist):
+            User.objects.get_by_natural_key('nobody@example.com')
+
+    def test_login_with_email(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        response = APIClient().post(reverse('accounts:v1:jwt-create'), {
+            'username': 'LEARNER@example.com',
+            'password': 'testpassword123',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+def policy_hashers(policy):
+    preferred = settings.PASSWORD_HASHER_POLICIES[policy]
+    return [preferred] + [path for path in settings.PASSWORD_HASHERS if path != preferred]
+
+
+@override_settings(
+    PASSWORD_HASHERS=policy_hashers('argon2'),
+    PASSWORD_ARGON2={'TIME_COST': 1, 'MEMORY_COST': 1024, 'PARALLELISM': 1},
+    PASSWORD_PBKDF2_ITERATIONS=1000,
+)
+class PasswordHashingTestCase(TestCase):
+    password = 'testpassword123'
+
+    def create_user(self, policy):
+        with override_settings(PASSWORD_HASHERS=policy_hashers(policy)):
+            return User.objects.create_user(username='learner', email='learner@example.com', password=self.password, is_active=True)
+
+    def login(self, password=None):
+        return APIClient().post(reverse('accounts:v1:jwt-create'), {
+            'username': 'learner',
+            'password': password or self.password,
+        })
+
+    def stored_hash(self):
+        return User.objects.get(username='learner').password
+
+    def test_new_passwords_use_configured_cost(self):
+        self.create_user('argon2')
+        self.assertTrue(self.stored_hash().startswith('argon2$argon2id$v=19$m=1024,t=1,p=1$'))
+
+    def test_pbkdf2_policy(self):
+        self.create_user('pbkdf2')
+        self.assertTrue(self.stored_hash().startswith('pbkdf2_sha256$1000$'))
+
+    def test_login_rehashes_other_policy(self):
+        self.create_user('pbkdf2')
+        response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(self.stored_hash().startswith('argon2$'))
+
+    def test_login_rehashes_changed_cost(self):
+        self.create_user('argon2')
+        with override_settings(PASSWORD_ARGON2={'TIME_COST': 2, 'MEMORY_COST': 2048, 'PARALLELISM': 1}):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertTrue(self.stored_hash().startswith('argon2$argon2id$v=19$m=2048,t=2,p=1$'))
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    def test_failed_login_keeps_hash(self):
+        self.create_user('pbkdf2')
+        before = self.stored_hash()
+        self.assertEqual(self.login('wrongpassword').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.stored_hash(), before)
+
+
+class ClaimsAuthenticationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='learner', email='learner@example.com', password='testpassword123', is_active=True)
+        Personalization.objects.create(user=self.user, difficulty=3)
+        self.client = APIClient()
+
+    def tearDown(self):
+        cache.clear()
+
+    def obtain(self):
+        response = self.client.post(reverse('accounts:v1:jwt-create'), {'username': 'learner', 'password': 'testpassword123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def refresh(self, refresh_token):
+        return self.client.post(reverse('accounts:v1:jwt-refresh'), {'refresh': refresh_token})
+
+    def test_access_token_carries_claims(self):
+        access = AccessToken(self.obtain()['access'])
+        self.assertEqual((access['is_active'], access['is_staff'], access['difficulty']), (True, False, 3))
+
+    def test_refresh_token_has_no_claims(self):
+        refresh = self.obtain()['refresh']
+        self.assertNotIn('difficulty', AccessToken(refresh, verify=False).payload)
+
+    def test_authenticated_request_runs_no_queries(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.obtain()['access']}")
+        url = reverse('storyline:v1:story-list')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        # The catalog is cached now, so only authentication could still query
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+    def test_refresh_picks_up_changes(self):
+        tokens = self.obtain()
+        Personalization.objects.filter(user=self.user).update(difficulty=5)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.refresh(tokens['refresh'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = AccessToken(response.data['access'])
+        self.assertEqual((access['is_staff'], access['difficulty']), (True, 5))
+
+    def test_refresh_rejected_for_inactive_user(self):
+        tokens = self.obtain()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_claim_rejected(self):
+        access = AccessToken.for_user(self.user)
+        access['is_active'], access['is_staff'], access['difficulty'] = False, False, 1
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(self.client.get(reverse('storyline:v1:story-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_without_claims_loads_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        self.assertEqual(self.client.get(reverse('storyline:v1:story-list')).status_code, status.HTTP_200_OK)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('storyline:v1:story-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_opted_in_views_get_the_real_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.obtain()['access']}")
+        response = self.client.get('/api/v1/auth/users/me/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'learner@example.com')
+
+    def test_personalizations_use_claims(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.obtain()['access']}")
+        # Only the personalization itself is read; the user comes from the token
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/personalizations/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(p['user'], p['difficulty']) for p in response.data], [(self.user.pk, 3)])
+
+        Personalization.objects.all().delete()
+        response = self.client.post('/api/v1/personalizations/', {'difficulty': 2})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Personalization.objects.get().user, self.user)
+
+    def test_staff_rights_checked_against_database(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.obtain()['access']}")
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        response = self.client.post(reverse('storyline:v1:story-reorder'), {'order': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TokenRevocationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='learner', email='learner@example.com', password='testpassword123', is_active=True)
+        self.client = APIClient()
+
+    def tearDown(self):
+        cache.clear()
+
+    def obtain(self):
+        response = self.client.post(reverse('accounts:v1:jwt-create'), {'username': 'learner', 'password': 'testpassword123'})
+        return response.data['refresh']
+
+    def refresh(self, refresh_token):
+        return self.client.post(reverse('accounts:v1:jwt-refresh'), {'refresh': refresh_token})
+
+    def test_login_records_nothing(self):
+        self.obtain()
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertFalse(RevokedToken.objects.exists())
+
+    def test_rotation_revokes_old_token(self):
+        refresh_token = self.obtain()
+        response = self.refresh(refresh_token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(RevokedToken.objects.count(), 1)
+        self.assertEqual(self.refresh(refresh_token).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, status.HTTP_200_OK)
+
+    def test_replay_rejected_despite_cached_check(self):
+        refresh_token = self.obtain()
+        # Another process checked the token and cached it as not revoked
+        self.client.post(reverse('accounts:v1:jwt-verify'), {'token': refresh_token})
+        self.assertEqual(self.refresh(refresh_token).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.refresh(refresh_token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_verify_rejects_revoked_token(self):
+        refresh_token = self.obtain()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/auth/token/blacklist/', {'refresh': refresh_token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('accounts:v1:jwt-verify'), {'token': refresh_token})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_checks_are_cached(self):
+        jti, expires_at = uuid.uuid4(), timezone.now() + timedelta(days=1)
+        self.assertFalse(RevokedToken.objects.is_revoked(jti, expires_at))
+        with self.assertNumQueries(0):
+            self.assertFalse(RevokedToken.objects.is_revoked(jti, expires_at))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(RevokedToken.objects.revoke(jti, expires_at))
+        with self.assertNumQueries(0):
+            self.assertTrue(RevokedToken.objects.is_revoked(jti, expires_at))
+
+    def test_revoke_only_once(self):
+        jti, expires_at = uuid.uuid4(), timezone.now() + timedelta(days=1)
+        self.assertTrue(RevokedToken.objects.revoke(jti, expires_at))
+        self.assertFalse(RevokedToken.objects.revoke(jti, expires_at))
+
+    def test_purge_deletes_expired_tokens(self):
+        now = timezone.now()
+        RevokedToken.objects.bulk_create([RevokedToken(jti=uuid.uuid4(), expires_at=now - timedelta(days=1)) for _ in range(5)])
+        kept = RevokedToken.objects.create(jti=uuid.uuid4(), expires_at=now + timedelta(days=1))
+        OutstandingToken.objects.create(jti='legacy', token='', expires_at=now - timedelta(days=1))
+        out = StringIO()
+        call_command('purge_revoked_tokens', batch_size=2, stdout=out)
+        self.assertEqual(list(RevokedToken.objects.all()), [kept])
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertIn('Purged 5 revoked tokens and 1 outstanding tokens', out.getvalue())
+
+
+@override_settings(
+    EMAIL_BACKEND='apps.accounts.mail.QueuedEmailBackend',
+    EMAIL_DELIVERY_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class QueuedEmailTestCase(TestCase):
+    def send(self, count=1):
+        for n in range(count):
+            EmailMultiAlternatives(f'Hello {n}', 'Plain', 'from@example.com', [f'learner{n}@example.com']).send()
+
+    def test_registration_queues_activation_email(self):
+        response = APIClient().post('/api/v1/auth/users/', {
+            'username': 'learner', 'email': 'learner@example.com', 'password': 'testpassword123', 're_password': 'testpassword123',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.STATUS_PENDING)
+
+        self.assertEqual(deliver()['sent'], 1)
+        self.assertEqual(mail.outbox[0].to, ['learner@example.com'])
+        self.assertRegex(mail.outbox[0].body, r'http://\S+/activate/')
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.STATUS_SENT)
+
+    def test_message_round_trip(self):
+        message = EmailMultiAlternatives('Subject', 'Plain', 'from@example.com', ['to@example.com'], cc=['cc@example.com'], headers={'X-Tag': 'activation'})
+        message.attach_alternative('<p>Html</p>', 'text/html')
+        message.attach('notes.txt', 'Some notes', 'text/plain')
+        message.attach('data.bin', b'\x00\x01', 'application/octet-stream')
+        message.send()
+        deliver()
+        sent = mail.outbox[0]
+        self.assertEqual((sent.subject, sent.body, sent.cc, sent.extra_headers), ('Subject', 'Plain', ['cc@example.com'], {'X-Tag': 'activation'}))
+        self.assertEqual(sent.alternatives, [('<p>Html</p>', 'text/html')])
+        self.assertEqual(sent.attachments, [('notes.txt', 'Some notes', 'text/plain'), ('data.bin', b'\x00\x01', 'application/octet-stream')])
+
+    def test_rolled_back_mail_is_not_sent(self):
+        with transaction.atomic():
+            self.send()
+            transaction.set_rollback(True)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def smtp_settings(self, stub):
+        return override_settings(
+            EMAIL_DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=stub.port, EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+        )
+
+    def test_one_smtp_connection_for_many_emails(self):
+        self.send(5)
+        with SMTPStubServer() as stub, self.smtp_settings(stub):
+            stats = deliver(batch_size=2)
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(stub.connections, 1)
+        self.assertEqual(sorted(recipients[0] for _, recipients, _ in stub.messages), [f'learner{n}@example.com' for n in range(5)])
+
+    def test_failures_are_retried(self):
+        self.send(3)
+        with SMTPStubServer() as stub, self.smtp_settings(stub):
+            stub.reject_next = 1
+            stats = deliver()
+            self.assertEqual((stats['sent'], stats['retry']), (2, 1))
+            retry = OutboundEmail.objects.get(status=OutboundEmail.STATUS_PENDING)
+            self.assertEqual(retry.attempts, 1)
+            self.assertIn('451', retry.last_error)
+            # Not due again until the backoff has passed
+            self.assertEqual(deliver()['sent'], 0)
+            OutboundEmail.objects.filter(pk=retry.pk).update(run_after=timezone.now())
+            self.assertEqual(deliver()['sent'], 1)
+        self.assertEqual(len(stub.messages), 3)
+
+    @override_settings(EMAIL_QUEUE_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        self.send()
+        with SMTPStubServer() as stub, self.smtp_settings(stub):
+            stub.reject_next = 2
+            deliver()
+            OutboundEmail.objects.update(run_after=timezone.now())
+            self.assertEqual(deliver()['failed'], 1)
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.STATUS_FAILED)
+
+    @override_settings(EMAIL_QUEUE_RETENTION_DAYS=30)
+    def test_purge_deletes_old_sent_and_failed_mail(self):
+        self.send(6)
+        deliver()
+        old = timezone.now() - timedelta(days=31)
+        sent = list(OutboundEmail.objects.order_by('pk'))
+        OutboundEmail.objects.filter(pk__in=[sent[0].pk, sent[1].pk]).update(sent_at=old)
+        OutboundEmail.objects.filter(pk=sent[2].pk).update(status=OutboundEmail.STATUS_FAILED, created_at=old)
+        # Pending mail is kept however old it is
+        OutboundEmail.objects.filter(pk=sent[3].pk).update(status=OutboundEmail.STATUS_PENDING, created_at=old, sent_at=None)
+        out = StringIO()
+        call_command('purge_sent_email', batch_size=2, stdout=out)
+        self.assertEqual(list(OutboundEmail.objects.order_by('pk').values_list('pk', flat=True)), [e.pk for e in sent[3:]])
+        self.assertIn('Purged 3 emails', out.getvalue())
+
+
+class SessionBootstrapTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='learner', email='learner@example.com', password='testpassword123', is_active=True)
+        self.personalization = Personalization.objects.create(user=self.user, difficulty=3, personal_details='Likes tea')
+        self.client = APIClient()
+        response = self.client.post(reverse('accounts:v1:jwt-create'), {'username': 'learner', 'password': 'testpassword123'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        self.url = reverse('accounts:v1:session')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_returns_user_personalization_and_catalog_version(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user']['username'], 'learner')
+        self.assertEqual(response.data['personalization']['difficulty'], 3)
+        self.assertEqual(response.data['catalog_version'], get_catalog_version())
+
+    def test_warm_cache_runs_no_queries(self):
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data['personalization']['personal_details'], 'Likes tea')
+
+    def test_saving_personalization_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/v1/personalizations/{self.personalization.pk}/', {'difficulty': 4})
+        self.assertEqual(self.client.get(self.url).data['personalization']['difficulty'], 4)
+
+    def test_saving_user_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Lin'
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).data['user']['first_name'], 'Lin')
+
+    def test_without_personalization(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.personalization.delete()
+        self.assertIsNone(self.client.get(self.url).data['personalization'])
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@pytest.mark.slow
+class NaturalKeyQueryPlanTestCase(TestCase):
+    """
+    Checks on a million users that each login lookup is a single index scan, not a
+    sequential scan or a BitmapOr of both indexes.
+    """
+    user_count = 1_000_000
+
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {User._meta.db_table}
+                    (password, is_superuser, username, email, first_name, last_name, is_active, is_staff, date_joined)
+                SELECT '', false, 'user' || n, 'User' || n || '@example.com', '', '', true, false, now()
+                FROM generate_series(1, %s) AS n
+                """,
+                [cls.user_count],
+            )
+            cursor.execute(f"ANALYZE {User._meta.db_table}")
+
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Needs PostgreSQL')
+
+    def plan(self, natural_key):
+        with CaptureQueriesContext(connection) as queries:
+            User.objects.get_by_natural_key(natural_key)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN ' + queries[-1]['sql'])
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def assert_index_scan(self, plan, index):
+        self.assertIn(f'Index Scan using {index}', plan)
+        self.assertNotIn('Seq Scan', plan)
+        self.assertNotIn('BitmapOr', plan)
+
+    def test_username_uses_username_index(self):
+        self.assert_index_scan(self.plan('user500000'), 'accounts_customuser_username')
+
+    def test_email_uses_lower_email_index(self):
+        self.assert_index_scan(self.plan('USER500000@example.com'), 'accounts_user_email_lower_idx')
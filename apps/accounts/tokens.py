@@ -0,0 +1,89 @@
+"""
+Refresh tokens and the serializers of the token endpoints.
+
+Access tokens carry the user claims ClaimsJWTAuthentication reads (see
+authentication.py). Revocation uses RevokedToken rather than simplejwt's
+token_blacklist app, which stores every issued refresh token with its full text
+and joins two tables on each check: issuing a token writes nothing, and rotation
+or logout inserts one narrow row keyed by the jti.
+"""
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt import serializers
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, UntypedToken, RefreshToken as BaseRefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .models import Personalization, RevokedToken
+
+USER_CLAIMS = ('is_active', 'is_staff', 'difficulty')
+
+
+def user_claims(user):
+    return {
+        'is_active': user.is_active,
+        'is_staff': user.is_staff,
+        'difficulty': Personalization.objects.filter(user=user).values_list('difficulty', flat=True).first(),
+    }
+
+
+def is_revoked(token):
+    return RevokedToken.objects.is_revoked(token[api_settings.JTI_CLAIM], datetime_from_epoch(token['exp']))
+
+
+class RefreshToken(BaseRefreshToken):
+    """
+    Refresh token whose access tokens carry the user claims. The refresh token itself
+    doesn't, so every refresh reads them afresh instead of copying them for 90 days.
+    """
+    user = None
+
+    @classmethod
+    def for_user(cls, user):
+        # Skip BlacklistMixin.for_user, which records every issued token as outstanding
+        token = super(BlacklistMixin, cls).for_user(user)
+        token.user = user
+        return token
+
+    def check_blacklist(self):
+        if is_revoked(self):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        if not RevokedToken.objects.revoke(self[api_settings.JTI_CLAIM], datetime_from_epoch(self['exp'])):
+            # Already rotated or logged out: this is a replay
+            raise TokenError(_("Token is blacklisted"))
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = self.user
+        if user is None:
+            User = get_user_model()
+            user = User.objects.filter(**{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]}).first()
+            if user is None or not user.is_active:
+                raise TokenError(_("User is inactive or deleted"))
+        for claim, value in user_claims(user).items():
+            access[claim] = value
+        return access
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    token_class = RefreshToken
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+
+class TokenBlacklistSerializer(serializers.TokenBlacklistSerializer):
+    token_class = RefreshToken
+
+
+class TokenVerifySerializer(serializers.TokenVerifySerializer):
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if api_settings.BLACKLIST_AFTER_ROTATION and api_settings.JTI_CLAIM in token and is_revoked(token):
+            raise ValidationError(_("Token is blacklisted"))
+        return {}
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib import messages
-from .models import GeneralInstructions, QuestInstructions, Assistant, QuestAssistant
+from .models import GeneralInstructions, QuestInstructions, Assistant, QuestAssistant, AssistantSyncJob
 
 @admin.register(GeneralInstructions)
 class GeneralInstructionsAdmin(admin.ModelAdmin):
@@ -18,12 +18,18 @@ class AssistantAdmin(admin.ModelAdmin):
         try:
             obj.save()
             if not change:
-                messages.success(request, 'Assistant created successfully and OpenAI assistant ID retrieved.')
+                messages.success(request, 'Assistant created successfully; the OpenAI assistant will be created by the sync worker.')
             else:
-                messages.success(request, 'Assistant updated successfully.')
+                messages.success(request, 'Assistant updated successfully; OpenAI sync queued.')
         except Exception as e:
             messages.error(request, f'Error saving assistant: {e}')
 
 @admin.register(QuestAssistant)
 class QuestAssistantAdmin(admin.ModelAdmin):
-    list_display = ('quest', 'assistant')
\ No newline at end of file
+    list_display = ('quest', 'assistant')
+
+@admin.register(AssistantSyncJob)
+class AssistantSyncJobAdmin(admin.ModelAdmin):
+    list_display = ('assistant', 'delete_openai_assistant_id', 'status', 'attempts', 'coalesced', 'run_after', 'last_error', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'updated_at')
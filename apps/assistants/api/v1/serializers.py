@@ -0,0 +1,6 @@
+from rest_framework import serializers
+
+
+class ChatMessageSerializer(serializers.Serializer):
+    message = serializers.CharField(max_length=4000)
+    thread_id = serializers.CharField(max_length=255, required=False, allow_blank=True)
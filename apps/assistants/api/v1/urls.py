@@ -1,4 +1,5 @@
 from django.urls import path, include
+from .views import QuestChatView, AssistantSyncView
 
 
 urlpatterns = [
@@ -6,4 +7,6 @@ urlpatterns = [
     # path('auth/', include('djoser.urls.jwt')),
     # path('auth/token/blacklist/', TokenBlacklistView.as_view(), name='token_blacklist'),
     # path('auth/routes/', get_routes, name='routes'),
-]
\ No newline at end of file
+    path('quest/<int:pk>/chat/', QuestChatView.as_view(), name='quest-chat'),
+    path('assistant/<uuid:pk>/sync/', AssistantSyncView.as_view(), name='assistant-sync'),
+]
@@ -1,3 +1,173 @@
-from django.shortcuts import render
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.core import signing
+from django.db import connections
+from django.db.models import F
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from apps.assistants.chat import get_chat_backend
+from apps.assistants.models import Assistant, AssistantSyncJob
+from apps.storyline.models import Quest
+from .serializers import ChatMessageSerializer
 
-# Create your views here.
+logger = logging.getLogger(__name__)
+
+
+def authenticate(request, authentication_classes):
+    # The DRF authenticators, run outside a DRF view
+    drf_request = Request(request, authenticators=[auth() for auth in authentication_classes])
+    return drf_request.user
+
+
+def release_connections():
+    """
+    What close_old_connections() does at the end of a request, for a view that is done
+    with the database but not with its response: closes (or hands back to the pool)
+    connections that aren't kept between requests. Leaves open transactions alone.
+    """
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def thread_signer(user_id, quest_id):
+    """
+    Signs the thread ids handed to clients for one user and quest, so that a client can
+    only continue its own conversations, without storing which threads are whose.
+    """
+    return signing.Signer(salt=f'assistants.chat.thread:{user_id}:{quest_id}')
+
+
+async def chat_events(assistant_id, message, thread_id, signer=None):
+    try:
+        async for event, data in get_chat_backend().stream(assistant_id, message, thread_id):
+            if event == 'thread' and signer is not None:
+                data = {'thread_id': signer.sign(data['thread_id'])}
+            yield sse(event, data)
+    except Exception as e:
+        # Headers are already sent, so failures are reported in the stream
+        logger.warning("Chat stream for assistant %s failed: %s", assistant_id, e)
+        yield sse('error', {'detail': "The assistant could not answer."})
+        return
+    yield sse('done', {})
+
+
+class AsyncAPIView(View):
+    """
+    Base for async JSON endpoints, which DRF views can't be: runs DRF's authenticators
+    and throttles and answers errors with DRF-shaped bodies. Set staff_only for admin
+    endpoints.
+    """
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    staff_only = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Authenticated by the JWT header rather than a session cookie, so CSRF doesn't apply
+        # (csrf_exempt() can't wrap async views before Django 5)
+        view.csrf_exempt = True
+        return view
+
+    def check_throttles(self, request):
+        # As APIView.check_throttles: every throttle runs, the longest wait is reported
+        durations = []
+        for throttle in (throttle_class() for throttle_class in self.throttle_classes):
+            if not throttle.allow_request(request, self):
+                durations.append(throttle.wait())
+        if durations:
+            raise exceptions.Throttled(max((d for d in durations if d is not None), default=None))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await sync_to_async(authenticate)(request, self.authentication_classes)
+            if not user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            if self.staff_only and not user.is_staff:
+                raise exceptions.PermissionDenied()
+            request.user = user
+            await sync_to_async(self.check_throttles)(request)
+        except exceptions.APIException as e:
+            # Same body and headers as DRF's exception handler
+            data = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            response = JsonResponse(data, status=e.status_code)
+            if getattr(e, 'wait', None):
+                response['Retry-After'] = '%d' % e.wait
+            return response
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class QuestChatView(AsyncAPIView):
+    """
+    Send a message to the quest's assistant and stream the reply as Server-Sent Events:
+    'thread' (the thread id to send with the next message), 'delta' for each chunk of
+    text, then 'done' or 'error'. Async so that one ASGI worker can hold many streams.
+    Thread ids are signed for the user and quest; any other answers 404.
+    """
+    http_method_names = ['post', 'options']
+    throttle_scope = 'chat'
+
+    async def post(self, request, pk):
+        try:
+            body = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'detail': "Invalid JSON."}, status=400)
+        serializer = ChatMessageSerializer(data=body)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        signer = thread_signer(request.user.pk, pk)
+        thread_id = serializer.validated_data.get('thread_id')
+        if thread_id:
+            try:
+                thread_id = signer.unsign(thread_id)
+            except signing.BadSignature:
+                return JsonResponse({'detail': "Not found."}, status=404)
+
+        assistant_id = await (
+            Quest.objects.filter(pk=pk, include=True)
+            .values_list(F('questassistant__assistant__openai_assistant_id'), flat=True)
+            .afirst()
+        )
+        if not assistant_id:
+            return JsonResponse({'detail': "Not found."}, status=404)
+        # request_finished releases the connection only once the stream ends
+        await sync_to_async(release_connections)()
+
+        response = StreamingHttpResponse(
+            chat_events(assistant_id, serializer.validated_data['message'], thread_id, signer),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx-style proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class AssistantSyncView(AsyncAPIView):
+    """
+    Queue a sync of one assistant to OpenAI (staff only). Answers 202 with the pending
+    job; the run_assistant_sync worker makes the OpenAI calls.
+    """
+    http_method_names = ['post', 'options']
+    # Staff rights are checked against the database rather than the token's claims
+    authentication_classes = [JWTAuthentication]
+    staff_only = True
+
+    async def post(self, request, pk):
+        if not await Assistant.objects.filter(pk=pk).aexists():
+            return JsonResponse({'detail': "Not found."}, status=404)
+        await sync_to_async(AssistantSyncJob.objects.enqueue)([pk])
+        job = await AssistantSyncJob.objects.filter(
+            assistant_id=pk, status=AssistantSyncJob.STATUS_PENDING
+        ).values('id', 'status', 'run_after', 'coalesced').afirst()
+        return JsonResponse(job, status=202)
@@ -0,0 +1,62 @@
+"""
+Backends for streaming a conversation turn with a quest assistant.
+
+A backend's stream(assistant_id, message, thread_id) is an async generator of
+(event, data) pairs: one ('thread', {'thread_id': ...}) first, then a ('delta',
+{'text': ...}) per chunk of the reply as OpenAI produces it. ASSISTANT_CHAT_BACKEND
+picks the backend; FakeChatBackend streams a canned reply without network access.
+"""
+import asyncio
+from django.conf import settings
+from django.utils.module_loading import import_string
+from services.openai_service import get_async_client
+
+
+class OpenAIChatBackend:
+    async def stream(self, assistant_id, message, thread_id=None):
+        client = get_async_client()
+        user_message = {'role': 'user', 'content': message}
+        if thread_id:
+            yield 'thread', {'thread_id': thread_id}
+            events = await client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                additional_messages=[user_message],
+                stream=True,
+            )
+        else:
+            # Creating the thread and starting the run in one request saves a round trip
+            events = await client.beta.threads.create_and_run(
+                assistant_id=assistant_id,
+                thread={'messages': [user_message]},
+                stream=True,
+            )
+        async with events:
+            async for event in events:
+                if event.event == 'thread.run.created' and not thread_id:
+                    yield 'thread', {'thread_id': event.data.thread_id}
+                elif event.event == 'thread.message.delta':
+                    for content in event.data.delta.content or []:
+                        if content.type == 'text' and content.text and content.text.value:
+                            yield 'delta', {'text': content.text.value}
+                elif event.event == 'thread.run.failed':
+                    error = event.data.last_error
+                    raise RuntimeError(error.message if error else "Assistant run failed")
+                elif event.event == 'error':
+                    raise RuntimeError(event.data.message)
+
+
+class FakeChatBackend:
+    """
+    Echoes the message back word by word, waiting ASSISTANT_CHAT_FAKE_DELAY seconds
+    between words, for tests and load tests.
+    """
+    async def stream(self, assistant_id, message, thread_id=None):
+        yield 'thread', {'thread_id': thread_id or f"thread_fake_{assistant_id}"}
+        for word in f"You said: {message}".split(' '):
+            await asyncio.sleep(settings.ASSISTANT_CHAT_FAKE_DELAY)
+            yield 'delta', {'text': word + ' '}
+
+
+def get_chat_backend():
+    return import_string(settings.ASSISTANT_CHAT_BACKEND)()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from apps.assistants.models import Assistant
+from apps.assistants.sync import queue_stale_assistants
+
+
+class Command(BaseCommand):
+    help = "Render every assistant prompt in batches and queue a sync for those that differ from OpenAI."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--general-instructions', type=int, help="Only assistants using this GeneralInstructions id.")
+        parser.add_argument('--quest', type=int, help="Only assistants of this quest id.")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        assistants = Assistant.objects.all()
+        if options['general_instructions'] is not None:
+            assistants = assistants.filter(general_instructions_id=options['general_instructions'])
+        if options['quest'] is not None:
+            assistants = assistants.filter(quest_id=options['quest'])
+        checked, queued = queue_stale_assistants(assistants, chunk_size=options['chunk_size'])
+        self.stdout.write(f"Checked {checked} assistants, queued {queued} syncs")
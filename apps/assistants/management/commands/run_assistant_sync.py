@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.assistants.models import AssistantSyncJob
+from apps.assistants.sync import drain, throughput
+
+
+class Command(BaseCommand):
+    help = "Drain the assistant sync outbox, pushing queued assistants to OpenAI with retries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the due jobs once and exit.")
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, help="OpenAI calls in flight at once (ASSISTANT_SYNC_CONCURRENCY).")
+        parser.add_argument('--rate-limit', type=float, help="OpenAI calls per second, 0 for no limit (ASSISTANT_SYNC_RATE_LIMIT).")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--stats', action='store_true', help="Print how many syncs coalescing has saved and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = AssistantSyncJob.objects.coalescing_stats()
+            self.stdout.write(
+                f"{stats['requests']} change requests, {stats['syncs']} syncs queued, {stats['saved']} saved by coalescing"
+            )
+            return
+        while True:
+            stats = drain(
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                rate_limit=options['rate_limit'],
+            )
+            if any(stats[outcome] for outcome in ('done', 'unchanged', 'retry', 'failed')):
+                self.stdout.write(
+                    f"Synced {stats['done']}, unchanged {stats['unchanged']}, retrying {stats['retry']}, failed {stats['failed']}, "
+                    f"saved {stats['coalesced']} syncs by coalescing, {throughput(stats):.1f} calls/s"
+                )
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
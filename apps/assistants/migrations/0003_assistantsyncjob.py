@@ -0,0 +1,31 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistants', '0002_questassistant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssistantSyncJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('assistant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='assistants.assistant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='assistants__status_da2d80_idx')],
+            },
+        ),
+    ]
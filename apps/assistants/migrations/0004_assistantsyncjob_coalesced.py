@@ -0,0 +1,27 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistants', '0003_assistantsyncjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistantsyncjob',
+            name='coalesced',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='assistantsyncjob',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='assistantsyncjob',
+            index=models.Index(fields=['assistant', 'status'], name='assistants__assista_2495a0_idx'),
+        ),
+    ]
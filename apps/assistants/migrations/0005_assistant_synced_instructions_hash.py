@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistants', '0004_assistantsyncjob_coalesced'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistant',
+            name='synced_instructions_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
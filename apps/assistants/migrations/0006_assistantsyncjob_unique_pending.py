@@ -0,0 +1,36 @@
+# Generated by Django 4.2.15 on 2026-10-18 14:39
+
+from django.db import migrations, models
+
+
+def fold_duplicate_pending_jobs(apps, schema_editor):
+    # Keep the oldest pending job of each assistant, counting the others as folded into it
+    AssistantSyncJob = apps.get_model('assistants', 'AssistantSyncJob')
+    duplicates = (
+        AssistantSyncJob.objects.filter(status='pending')
+        .values('assistant_id')
+        .annotate(count=models.Count('pk'))
+        .filter(count__gt=1)
+        .values_list('assistant_id', flat=True)
+    )
+    for assistant_id in list(duplicates):
+        jobs = list(AssistantSyncJob.objects.filter(assistant_id=assistant_id, status='pending').order_by('pk'))
+        kept, others = jobs[0], jobs[1:]
+        kept.coalesced += sum(job.coalesced + 1 for job in others)
+        kept.save(update_fields=['coalesced'])
+        AssistantSyncJob.objects.filter(pk__in=[job.pk for job in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistants', '0005_assistant_synced_instructions_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_duplicate_pending_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='assistantsyncjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('assistant',), name='unique_pending_sync_job'),
+        ),
+    ]
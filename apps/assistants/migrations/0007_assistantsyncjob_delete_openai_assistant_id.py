@@ -0,0 +1,24 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assistants', '0006_assistantsyncjob_unique_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistantsyncjob',
+            name='delete_openai_assistant_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='assistantsyncjob',
+            name='assistant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_jobs', to='assistants.assistant'),
+        ),
+    ]
@@ -1,7 +1,10 @@
+import hashlib
 import uuid
+from datetime import timedelta
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from apps.storyline.models import Quest
-from services.openai_service import client
 from django.db import transaction
 
 
@@ -23,6 +26,23 @@ class QuestInstructions(models.Model):
         return f"{self.name} ({self.quest})"
 
 
+class AssistantQuerySet(models.QuerySet):
+    def for_instructions(self):
+        # Everything build_instructions() reads, in two queries for any number of assistants
+        return self.select_related(
+            'general_instructions', 'quest_instructions', 'quest__character'
+        ).prefetch_related('quest__objectives')
+
+    def build_instructions(self, chunk_size=500):
+        """
+        Render the prompt of every assistant in the queryset, as a {pk: instructions} dict.
+        """
+        return {
+            assistant.pk: assistant.build_instructions()
+            for assistant in self.for_instructions().iterator(chunk_size=chunk_size)
+        }
+
+
 class Assistant(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     quest = models.ForeignKey(Quest, on_delete=models.CASCADE)
@@ -31,51 +51,23 @@ class Assistant(models.Model):
     openai_assistant_id = models.CharField(max_length=255, blank=True, null=True)  # Stores the assistant ID from OpenAI
     name = models.CharField(max_length=255)  # The name of the assistant in the playground
     model = models.CharField(max_length=255, default="gpt-4o")  # The model used by the assistant
+    synced_instructions_hash = models.CharField(max_length=64, blank=True, editable=False)  # Hash of the instructions last pushed to OpenAI
+
+    objects = AssistantQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
-        with transaction.atomic(): 
-            instructions = self.build_instructions()
-            if not self.openai_assistant_id:
-                # Creating a new assistant
-                try:
-                    assistant = client.beta.assistants.create(
-                        instructions=instructions,
-                        name=self.name,
-                        tools=[],
-                        model=self.model,
-                    )
-                    self.openai_assistant_id = assistant.id
-                    super().save(*args, **kwargs)
-                    QuestAssistant.objects.create(quest=self.quest, assistant=self)
-                except Exception as e:
-                    print(f"Error creating assistant: {e}")
-                    raise
-            else:
-                # Updating the assistant instructions
-                try:
-                    assistant = client.beta.assistants.update(
-                        self.openai_assistant_id,
-                        instructions=instructions,
-                    )
-                    super().save(*args, **kwargs)
-                except Exception as e:
-                    print(f"Error updating assistant: {e}")
-                    raise
-                
-    def delete(self, *args, **kwargs):
-        if self.openai_assistant_id:
-            try:
-                response = client.beta.assistants.delete(self.openai_assistant_id)
-                if not response.get('deleted', False):
-                    raise Exception(f"Assistant deletion failed: {response}")
-            except Exception as e:
-                print(f"Error deleting assistant: {e}")
-                raise
-        super().delete(*args, **kwargs)
+        # The OpenAI call happens later in the sync worker; here we only queue it in the same transaction
+        with transaction.atomic():
+            is_new = self._state.adding
+            super().save(*args, **kwargs)
+            if is_new and not self.openai_assistant_id:
+                QuestAssistant.objects.create(quest=self.quest, assistant=self)
+            AssistantSyncJob.objects.enqueue([self.pk])
 
+    # Deleting queues the removal of the OpenAI assistant, see signals.py
 
     def build_instructions(self):
         """
@@ -94,10 +86,107 @@ class Assistant(models.Model):
         instructions += "This is the quest instructions the individual you are talking to is following, you should follow and push them to complete the objectives:\n" + self.quest.as_text() + "\n\n"
         return instructions.strip()
 
+    @staticmethod
+    def hash_instructions(instructions):
+        return hashlib.sha256(instructions.encode()).hexdigest()
+
 
 class QuestAssistant(models.Model):
     quest = models.OneToOneField(Quest, on_delete=models.CASCADE)
     assistant = models.ForeignKey(Assistant, on_delete=models.CASCADE)
 
     def __str__(self):
-        return f"{self.assistant} for {self.quest}"
\ No newline at end of file
+        return f"{self.assistant} for {self.quest}"
+
+
+class AssistantSyncJobManager(models.Manager):
+    def enqueue(self, assistant_ids):
+        """
+        Queue a sync for each assistant, folding into its not-yet-claimed pending job when
+        there is one. The fold happens in the caller's transaction, so any number of changes
+        in one transaction, or within the debounce window, costs a single sync.
+        Runs a constant number of queries however many assistants are given.
+
+        An assistant has at most one pending job (unique_pending_sync_job): when a
+        concurrent transaction queues the same assistant first, our insert is dropped
+        and its job does the sync.
+        """
+        assistant_ids = set(assistant_ids)
+        if not assistant_ids:
+            return
+        pending = self.filter(assistant_id__in=assistant_ids, status=AssistantSyncJob.STATUS_PENDING)
+        pending.update(coalesced=models.F('coalesced') + 1)
+        queued = set(pending.values_list('assistant_id', flat=True))
+        run_after = timezone.now() + timedelta(seconds=settings.ASSISTANT_SYNC_DEBOUNCE_SECONDS)
+        self.bulk_create(
+            [
+                AssistantSyncJob(assistant_id=assistant_id, run_after=run_after)
+                for assistant_id in assistant_ids - queued
+            ],
+            ignore_conflicts=True,
+        )
+
+    def enqueue_deletion(self, openai_assistant_ids):
+        """
+        Queue the deletion of OpenAI assistants whose rows are gone. The jobs belong to
+        no assistant, so they outlive the row, and are written in the caller's transaction.
+        """
+        self.bulk_create([
+            AssistantSyncJob(delete_openai_assistant_id=openai_assistant_id)
+            for openai_assistant_id in openai_assistant_ids
+        ])
+
+    def coalescing_stats(self):
+        # How many change requests were collapsed into an already queued sync
+        totals = self.aggregate(jobs=models.Count('pk'), saved=models.Sum('coalesced'))
+        saved = totals['saved'] or 0
+        return {'requests': totals['jobs'] + saved, 'syncs': totals['jobs'], 'saved': saved}
+
+
+class AssistantSyncJob(models.Model):
+    """
+    Outbox entry asking the sync worker to push an assistant to OpenAI, or, with
+    delete_openai_assistant_id set, to delete the remote assistant of a deleted one.
+    Written in the same transaction as the change that requires it.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    assistant = models.ForeignKey(Assistant, on_delete=models.CASCADE, related_name='sync_jobs', null=True, blank=True)
+    delete_openai_assistant_id = models.CharField(max_length=255, blank=True)  # Remote assistant to delete, on jobs without an assistant
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    coalesced = models.PositiveIntegerField(default=0)  # Extra change requests folded into this job
+    run_after = models.DateTimeField(default=timezone.now)  # Not claimable before this time (debounce, backoff and lease)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = AssistantSyncJobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['assistant', 'status']),
+        ]
+        constraints = [
+            # Concurrent enqueues of one assistant must fold into a single sync
+            models.UniqueConstraint(
+                fields=['assistant'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_sync_job',
+            ),
+        ]
+
+    def __str__(self):
+        if self.delete_openai_assistant_id:
+            return f"Delete {self.delete_openai_assistant_id} ({self.status})"
+        return f"Sync {self.assistant} ({self.status})"
@@ -1,19 +1,27 @@
 # When the quest instructions and general instructions get updated, we want to automatically update the assistant instructions
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import QuestInstructions, GeneralInstructions, Assistant
+from django.utils import timezone
+from apps.storyline.models import Quest
+from .models import QuestInstructions, GeneralInstructions, Assistant, AssistantSyncJob, QuestAssistant
 
 @receiver(post_save, sender=QuestInstructions)
 def update_assistants_on_questinstructions_change(sender, instance, **kwargs):
-
-    assistants = Assistant.objects.filter(quest_instructions=instance)
-    for assistant in assistants:
-        assistant.save()
+    AssistantSyncJob.objects.enqueue(Assistant.objects.filter(quest_instructions=instance).values_list('pk', flat=True))
 
 @receiver(post_save, sender=GeneralInstructions)
 def update_assistants_on_generalinstructions_change(sender, instance, **kwargs):
-    # Find all Assistants that reference this GeneralInstructions
-    assistants = Assistant.objects.filter(general_instructions=instance)
-    for assistant in assistants:
-        assistant.save()  
\ No newline at end of file
+    # Shared by many assistants: queue them all and let the worker render the prompts, it skips unchanged ones
+    AssistantSyncJob.objects.enqueue(Assistant.objects.filter(general_instructions=instance).values_list('pk', flat=True))
+
+# The quest detail exposes the assistant id, so linking an assistant changes the quest's Last-Modified
+@receiver([post_save, post_delete], sender=QuestAssistant)
+def touch_quest_on_questassistant_change(sender, instance, **kwargs):
+    Quest.objects.filter(pk=instance.quest_id).update(updated_at=timezone.now())
+
+# Also on cascades from the quest and queryset deletes, which skip Assistant.delete()
+@receiver(post_delete, sender=Assistant)
+def delete_remote_assistant_on_delete(sender, instance, **kwargs):
+    if instance.openai_assistant_id:
+        AssistantSyncJob.objects.enqueue_deletion([instance.openai_assistant_id])
@@ -0,0 +1,244 @@
+"""
+Worker side of the assistant sync outbox.
+
+Assistant.save() and deletes only record an AssistantSyncJob; drain() claims due
+jobs, pushes the assistants to (or deletes them from) OpenAI over a bounded, rate
+limited thread pool and retries failures with exponential backoff.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+import openai
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from services.openai_service import get_client
+from .models import Assistant, AssistantSyncJob
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(attempts):
+    # 1x, 2x, 4x ... the base delay, capped
+    delay = settings.ASSISTANT_SYNC_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, settings.ASSISTANT_SYNC_MAX_BACKOFF_SECONDS))
+
+
+def claim_jobs(batch_size):
+    """
+    Claim up to batch_size due jobs. Claimed jobs are marked running, so new changes
+    queue a fresh job instead of folding into one whose instructions may already be
+    built, and leased: a crashed worker's jobs become due again when the lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            AssistantSyncJob.objects.select_for_update(skip_locked=True, of=('self',))
+            .prefetch_related(Prefetch('assistant', queryset=Assistant.objects.for_instructions()))
+            .filter(
+                status__in=[AssistantSyncJob.STATUS_PENDING, AssistantSyncJob.STATUS_RUNNING],
+                run_after__lte=now,
+            )
+            .order_by('run_after')[:batch_size]
+        )
+        if jobs:
+            AssistantSyncJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=AssistantSyncJob.STATUS_RUNNING,
+                run_after=now + timedelta(seconds=settings.ASSISTANT_SYNC_LEASE_SECONDS),
+            )
+    return jobs
+
+
+def queue_stale_assistants(assistants, chunk_size=500):
+    """
+    Render the prompts of the given assistants in one pass and queue a sync only for
+    those whose instructions differ from what was last pushed. Returns
+    (checked, queued) counts.
+    """
+    stale = []
+    checked = 0
+    for assistant in assistants.for_instructions().iterator(chunk_size=chunk_size):
+        checked += 1
+        if Assistant.hash_instructions(assistant.build_instructions()) != assistant.synced_instructions_hash:
+            stale.append(assistant.pk)
+    AssistantSyncJob.objects.enqueue(stale)
+    return checked, len(stale)
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1/rate seconds apart across all threads. A rate of 0 disables it.
+    """
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+def push_remote(client, limiter, assistant, instructions):
+    """
+    Create or update the remote assistant and return its OpenAI id. Runs on a pool
+    thread, so it only reads fields already loaded on the assistant and never the database.
+    """
+    limiter.wait()
+    if not assistant.openai_assistant_id:
+        remote = client.beta.assistants.create(
+            instructions=instructions,
+            name=assistant.name,
+            tools=[],
+            model=assistant.model,
+        )
+        return remote.id
+    client.beta.assistants.update(
+        assistant.openai_assistant_id,
+        instructions=instructions,
+    )
+    return assistant.openai_assistant_id
+
+
+def delete_remote(client, limiter, openai_assistant_id):
+    limiter.wait()
+    try:
+        response = client.beta.assistants.delete(openai_assistant_id)
+    except openai.NotFoundError:
+        # Already gone, e.g. a retry of a deletion that went through
+        return
+    if not response.deleted:
+        raise Exception(f"Assistant deletion failed: {response}")
+
+
+def complete_job(job, pushed):
+    AssistantSyncJob.objects.filter(pk=job.pk).update(
+        attempts=job.attempts + 1,
+        last_error='',
+        status=AssistantSyncJob.STATUS_DONE,
+        updated_at=timezone.now(),
+    )
+    return AssistantSyncJob.STATUS_DONE if pushed else 'unchanged'
+
+
+def fail_job(job, error):
+    attempts = job.attempts + 1
+    logger.warning("Assistant sync %s failed (attempt %s): %s", job.pk, attempts, error)
+    failed = attempts >= settings.ASSISTANT_SYNC_MAX_ATTEMPTS
+    fields = {
+        'attempts': attempts,
+        'last_error': str(error),
+        'run_after': timezone.now() + backoff(attempts),
+        'updated_at': timezone.now(),
+    }
+    job_row = AssistantSyncJob.objects.filter(pk=job.pk)
+    if failed:
+        job_row.update(status=AssistantSyncJob.STATUS_FAILED, **fields)
+        return AssistantSyncJob.STATUS_FAILED
+    try:
+        with transaction.atomic():
+            job_row.update(status=AssistantSyncJob.STATUS_PENDING, **fields)
+    except IntegrityError:
+        # A change since the claim queued a newer pending job, which retries the
+        # assistant with the latest instructions; this one ends here
+        job_row.update(status=AssistantSyncJob.STATUS_FAILED, **fields)
+    return 'retry'
+
+
+def process_jobs(jobs, client, executor, limiter):
+    """
+    Push the assistants of claimed jobs, with the OpenAI calls running concurrently on
+    the executor, and return the outcome of each job. Building the instructions and
+    recording results stay on this thread and its database connection. An assistant
+    whose instructions hash to what was last pushed is completed without a call, and
+    results are written through update() so that no new sync job is queued for our own
+    bookkeeping. A remote assistant created for a row deleted in the meantime is queued
+    for deletion instead of being recorded.
+    """
+    outcomes = []
+    futures = {}
+    for job in jobs:
+        if job.delete_openai_assistant_id:
+            futures[executor.submit(delete_remote, client, limiter, job.delete_openai_assistant_id)] = (job, None)
+            continue
+        assistant = job.assistant
+        try:
+            instructions = assistant.build_instructions()
+        except Exception as e:
+            outcomes.append(fail_job(job, e))
+            continue
+        instructions_hash = Assistant.hash_instructions(instructions)
+        if assistant.openai_assistant_id and instructions_hash == assistant.synced_instructions_hash:
+            outcomes.append(complete_job(job, pushed=False))
+            continue
+        futures[executor.submit(push_remote, client, limiter, assistant, instructions)] = (job, instructions_hash)
+
+    for future in as_completed(futures):
+        job, instructions_hash = futures[future]
+        try:
+            remote_id = future.result()
+        except Exception as e:
+            outcomes.append(fail_job(job, e))
+            continue
+        if job.delete_openai_assistant_id:
+            outcomes.append(complete_job(job, pushed=True))
+            continue
+        created = remote_id != job.assistant.openai_assistant_id
+        updated = Assistant.objects.filter(pk=job.assistant_id).update(
+            openai_assistant_id=remote_id,
+            synced_instructions_hash=instructions_hash,
+        )
+        if not updated and created:
+            # Deleted while the call was in flight; its deletion only knew the old remote id
+            AssistantSyncJob.objects.enqueue_deletion([remote_id])
+        job.assistant.openai_assistant_id = remote_id
+        job.assistant.synced_instructions_hash = instructions_hash
+        outcomes.append(complete_job(job, pushed=True))
+    return outcomes
+
+
+def drain(client=None, batch_size=20, limit=None, concurrency=None, rate_limit=None):
+    """
+    Process due jobs until none are left (or limit jobs were handled) and return
+    counts per outcome ('unchanged' jobs completed without calling OpenAI), how many
+    change requests the processed jobs absorbed and the seconds it took. Up to
+    concurrency OpenAI calls run at once, at most rate_limit per second.
+    """
+    if client is None:
+        client = get_client()
+    if concurrency is None:
+        concurrency = settings.ASSISTANT_SYNC_CONCURRENCY
+    if rate_limit is None:
+        rate_limit = settings.ASSISTANT_SYNC_RATE_LIMIT
+
+    stats = {AssistantSyncJob.STATUS_DONE: 0, 'unchanged': 0, 'retry': 0, AssistantSyncJob.STATUS_FAILED: 0, 'coalesced': 0}
+    limiter = RateLimiter(rate_limit)
+    handled = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='assistant-sync') as executor:
+        while limit is None or handled < limit:
+            size = batch_size if limit is None else min(batch_size, limit - handled)
+            jobs = claim_jobs(size)
+            if not jobs:
+                break
+            for outcome in process_jobs(jobs, client, executor, limiter):
+                stats[outcome] += 1
+            stats['coalesced'] += sum(job.coalesced for job in jobs)
+            handled += len(jobs)
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def throughput(stats):
+    # OpenAI calls per second over a drain() run
+    calls = stats[AssistantSyncJob.STATUS_DONE] + stats['retry'] + stats[AssistantSyncJob.STATUS_FAILED]
+    return calls / stats['seconds'] if stats['seconds'] else 0.0
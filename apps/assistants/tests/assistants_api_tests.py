@@ -0,0 +1,293 @@
+import asyncio
+import json
+import time
+import uuid
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.assistants.api.v1.views import chat_events, thread_signer
+from apps.assistants.models import Assistant, AssistantSyncJob
+from apps.assistants.tests.factories import create_assistant
+from apps.storyline.models import Quest
+from apps.storyline.tests.factories import create_quest
+from config.performance import registry
+from services.openai_stub import AssistantsStubServer
+
+User = get_user_model()
+
+
+def parse_events(response):
+    # The view streams from an async generator, which the sync test client hands back as is
+    async def read():
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    body = async_to_sync(read)().decode()
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def reply_text(events):
+    return "".join(data["text"] for event, data in events if event == "delta").strip()
+
+
+@pytest.fixture(autouse=True)
+def fake_backend(settings):
+    settings.ASSISTANT_CHAT_BACKEND = "apps.assistants.chat.FakeChatBackend"
+    settings.ASSISTANT_CHAT_FAKE_DELAY = 0
+
+
+@pytest.fixture
+def auth_headers(db):
+    user = User.objects.create_user(username="player", email="player@example.com", password="password123", is_active=True)
+    return {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+
+
+@pytest.fixture
+def quest(db):
+    quest = create_quest()
+    assistant = create_assistant(quest, name="Quest Assistant")
+    Assistant.objects.filter(pk=assistant.pk).update(openai_assistant_id="asst_quest")
+    return quest
+
+
+def chat_url(quest):
+    return f"/api/v1/quest/{quest.pk}/chat/"
+
+
+@pytest.mark.django_db
+class TestQuestChat:
+
+    def test_streams_reply_as_server_sent_events(self, client, quest, auth_headers):
+        response = client.post(chat_url(quest), {"message": "Hello there"}, content_type="application/json", **auth_headers)
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "text/event-stream"
+        assert response["Cache-Control"] == "no-cache"
+        events = parse_events(response)
+        assert events[0][0] == "thread"
+        assert events[0][1]["thread_id"].startswith("thread_fake_asst_quest:")
+        assert reply_text(events) == "You said: Hello there"
+        assert events[-1] == ("done", {})
+
+    def test_continues_own_thread(self, client, quest, auth_headers):
+        first = parse_events(client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json", **auth_headers))
+        thread_id = first[0][1]["thread_id"]
+
+        response = client.post(
+            chat_url(quest), {"message": "Again", "thread_id": thread_id}, content_type="application/json", **auth_headers
+        )
+
+        assert response.status_code == 200
+        assert parse_events(response)[0] == ("thread", {"thread_id": thread_id})
+
+    def test_rejects_other_threads(self, client, quest, auth_headers):
+        other = User.objects.create_user(username="other", email="other@example.com", password="password123", is_active=True)
+        other_headers = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(other)}"}
+        first = parse_events(client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json", **other_headers))
+        other_thread = first[0][1]["thread_id"]
+        other_quest = Quest.objects.create(
+            title="Quest Two", description="Second Quest", character=quest.character, adventure=quest.adventure
+        )
+        own_thread_for_other_quest = thread_signer(User.objects.get(username="player").pk, other_quest.pk).sign("thread_abc")
+
+        # Unsigned, another user's, or signed for another quest
+        for thread_id in ("thread_abc", other_thread, own_thread_for_other_quest):
+            response = client.post(
+                chat_url(quest), {"message": "Again", "thread_id": thread_id}, content_type="application/json", **auth_headers
+            )
+            assert response.status_code == 404
+
+    def test_requires_authentication(self, client, quest):
+        response = client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json")
+        assert response.status_code == 401
+
+    def test_rejects_invalid_token(self, client, quest):
+        response = client.post(
+            chat_url(quest), {"message": "Hello"}, content_type="application/json", HTTP_AUTHORIZATION="Bearer nope"
+        )
+        assert response.status_code == 401
+
+    def test_validates_message(self, client, quest, auth_headers):
+        response = client.post(chat_url(quest), {"message": ""}, content_type="application/json", **auth_headers)
+        assert response.status_code == 400
+        assert "message" in response.json()
+
+    def test_quest_without_synced_assistant(self, client, quest, auth_headers):
+        Assistant.objects.update(openai_assistant_id=None)
+        response = client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json", **auth_headers)
+        assert response.status_code == 404
+
+    @pytest.mark.django_db(transaction=True)
+    def test_connection_is_released_before_streaming(self, client, quest, auth_headers, monkeypatch):
+        if connection.vendor != "postgresql":
+            # In-memory SQLite databases are never closed
+            pytest.skip("Needs PostgreSQL")
+        monkeypatch.setitem(connection.settings_dict, "CONN_MAX_AGE", 0)
+        response = client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json", **auth_headers)
+
+        # Not held for the length of the reply
+        assert connection.connection is None
+        assert reply_text(parse_events(response)) == "You said: Hello"
+
+    def test_only_post(self, client, quest, auth_headers):
+        assert client.get(chat_url(quest), **auth_headers).status_code == 405
+
+    def test_throttled(self, client, quest, auth_headers, settings):
+        settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": {"chat.user": "1/min"}}
+        assert client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json", **auth_headers).status_code == 200
+
+        response = client.post(chat_url(quest), {"message": "Again"}, content_type="application/json", **auth_headers)
+
+        assert response.status_code == 429
+        assert response["Retry-After"] == "60"
+        assert "throttled" in response.json()["detail"]
+
+    def test_backend_failure_is_reported_in_stream(self, client, quest, auth_headers, settings):
+        settings.ASSISTANT_CHAT_BACKEND = "apps.assistants.chat.OpenAIChatBackend"
+        settings.OPENAI_BASE_URL = "http://127.0.0.1:9/v1"
+        settings.OPENAI_API_KEY = "stub"
+        settings.OPENAI_MAX_RETRIES = 0
+
+        response = client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json", **auth_headers)
+
+        assert parse_events(response) == [("error", {"detail": "The assistant could not answer."})]
+
+    def test_openai_backend_against_stub(self, client, quest, auth_headers, settings):
+        settings.ASSISTANT_CHAT_BACKEND = "apps.assistants.chat.OpenAIChatBackend"
+        settings.OPENAI_API_KEY = "stub"
+        settings.OPENAI_MAX_RETRIES = 0
+        registry.clear()
+        with AssistantsStubServer() as stub:
+            settings.OPENAI_BASE_URL = stub.base_url
+            first = parse_events(client.post(chat_url(quest), {"message": "Hello"}, content_type="application/json", **auth_headers))
+            thread_id = first[0][1]["thread_id"]
+            second = parse_events(client.post(
+                chat_url(quest), {"message": "Again", "thread_id": thread_id}, content_type="application/json", **auth_headers
+            ))
+
+        assert thread_id.startswith("thread_")
+        assert reply_text(first) == "You said: Hello"
+        # Each stream's OpenAI calls are timed, once the stream is read
+        openai = registry.collect()["assistants:v1:quest-chat"][4]
+        assert openai.count == 2 and openai.sum > 0
+        assert second[0] == ("thread", {"thread_id": thread_id})
+        assert reply_text(second) == "You said: Again"
+        assert first[-1] == second[-1] == ("done", {})
+
+
+class TestConcurrentStreams:
+
+    def test_streams_share_one_event_loop(self, settings):
+        settings.ASSISTANT_CHAT_FAKE_DELAY = 0.05
+
+        async def consume(n):
+            return [chunk async for chunk in chat_events(f"asst_{n}", "one two three four", None)]
+
+        async def consume_all():
+            return await asyncio.gather(*(consume(n) for n in range(100)))
+
+        start = time.perf_counter()
+        streams = asyncio.run(consume_all())
+        elapsed = time.perf_counter() - start
+
+        assert all(stream[-1] == "event: done\ndata: {}\n\n" for stream in streams)
+        # 100 streams of six 50ms chunks interleave instead of taking 30s back to back
+        assert elapsed < 1.5
+
+
+@pytest.mark.django_db
+class TestAssistantSyncTrigger:
+
+    @pytest.fixture
+    def staff_headers(self):
+        user = User.objects.create_user(
+            username="staff", email="staff@example.com", password="password123", is_active=True, is_staff=True
+        )
+        return {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(user)}"}
+
+    def test_queues_sync(self, client, quest, staff_headers):
+        assistant = Assistant.objects.get(quest=quest)
+        AssistantSyncJob.objects.update(status=AssistantSyncJob.STATUS_DONE)
+
+        response = client.post(f"/api/v1/assistant/{assistant.pk}/sync/", **staff_headers)
+
+        assert response.status_code == 202
+        job = AssistantSyncJob.objects.get(status=AssistantSyncJob.STATUS_PENDING)
+        assert response.json()["id"] == job.pk
+        assert job.assistant_id == assistant.pk
+
+    def test_folds_into_pending_sync(self, client, quest, staff_headers):
+        assistant = Assistant.objects.get(quest=quest)
+
+        response = client.post(f"/api/v1/assistant/{assistant.pk}/sync/", **staff_headers)
+
+        assert response.status_code == 202
+        assert response.json()["coalesced"] == 1
+        assert AssistantSyncJob.objects.count() == 1
+
+    def test_staff_only(self, client, quest, auth_headers):
+        assistant = Assistant.objects.get(quest=quest)
+        response = client.post(f"/api/v1/assistant/{assistant.pk}/sync/", **auth_headers)
+        assert response.status_code == 403
+
+    def test_unknown_assistant(self, client, staff_headers):
+        response = client.post(f"/api/v1/assistant/{uuid.uuid4()}/sync/", **staff_headers)
+        assert response.status_code == 404
+
+
+@pytest.mark.django_db
+class TestASGIApplication:
+
+    def test_chat_streams_through_asgi_entry_point(self, quest, auth_headers):
+        from config.asgi import application
+
+        body = json.dumps({"message": "Hello there"}).encode()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": chat_url(quest),
+            "raw_path": chat_url(quest).encode(),
+            "query_string": b"",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"authorization", auth_headers["HTTP_AUTHORIZATION"].encode()),
+            ],
+            "client": ("127.0.0.1", 5000),
+            "server": ("testserver", 80),
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        # From the main thread, so the view's database calls share the test transaction, and
+        # without closing that connection at the request boundaries (as Django's test clients do)
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(application)(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+        assert messages[0]["type"] == "http.response.start"
+        assert messages[0]["status"] == 200
+        chunks = [m["body"] for m in messages[1:] if m.get("body")]
+        # One ASGI message per event rather than a single buffered body
+        assert len(chunks) > 3
+        assert chunks[0].startswith(b"event: thread")
+        assert chunks[-1] == b"event: done\ndata: {}\n\n"
@@ -1,71 +1,72 @@
+import time
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 from unittest.mock import patch, MagicMock
+from django.core.management import call_command
 from django.db.utils import IntegrityError
-from apps.storyline.models import Story, Adventure, Quest, Character
+from django.db import transaction
+from django.utils import timezone
+from apps.storyline.models import Quest, Character, Objectives
+from apps.storyline.tests.factories import create_adventure, create_quest
 from apps.assistants.models import (
-    GeneralInstructions,
-    QuestInstructions,
     Assistant,
     QuestAssistant,
+    AssistantSyncJob,
 )
+import openai
+from apps.assistants.sync import claim_jobs, drain, process_jobs, RateLimiter
+from apps.assistants.tests.factories import build_assistant, create_assistant, create_general_instructions
+from services.openai_stub import AssistantsStubServer
+
+@pytest.fixture(autouse=True)
+def no_debounce(settings):
+    # Make queued syncs due immediately unless a test is about debouncing
+    settings.ASSISTANT_SYNC_DEBOUNCE_SECONDS = 0
+
+
+@pytest.fixture
+def quest(db):
+    return create_quest()
+
+
+@pytest.fixture
+def general_instructions(db):
+    return create_general_instructions()
+
 
 @pytest.mark.django_db
 class TestAssistantModels:
-    @patch("apps.assistants.models.client")
-    def test_assistant_creation(self, mock_client):
+    @patch("apps.assistants.sync.get_client")
+    def test_assistant_creation(self, mock_get_client, quest):
+        mock_client = mock_get_client.return_value
         # Mock the assistant creation response
         mock_assistant = MagicMock()
         mock_assistant.id = "asst_mock_id"
 
         mock_client.beta.assistants.create.return_value = mock_assistant
 
-        # Create necessary instances
-        general_instructions = GeneralInstructions.objects.create(
-            name="General", instructions="General Instructions"
-        )
-
-        # Create Story and Adventure as required
-        story = Story.objects.create(
-            title="Story One", description="First Story"
-        )
-        adventure = Adventure.objects.create(
-            title="Adventure One", description="First Adventure", story=story
-        )
-
-        # Create Character
-        character = Character.objects.create(
-            name="Character One",
-            description="First Character",
-            voice="alloy"
-        )
+        assistant = build_assistant(quest)
+        assistant.save()
 
-        # Create Quest with Character
-        quest = Quest.objects.create(
-            title="Quest One",
-            description="First Quest",
-            character=character,
-            adventure=adventure, 
-        )
+        # Saving only queues the sync, OpenAI is called by the worker
+        mock_client.beta.assistants.create.assert_not_called()
+        job = AssistantSyncJob.objects.get(assistant=assistant)
+        assert job.status == AssistantSyncJob.STATUS_PENDING
 
-        quest_instructions = QuestInstructions.objects.create(
-            quest=quest, name="Quest Specific", instructions="Quest Instructions"
-        )
+        # Ensure QuestAssistant was created
+        quest_assistant = QuestAssistant.objects.get(quest=quest)
+        assert quest_assistant.assistant == assistant
 
         # Mock the as_text methods
-        character.as_text = MagicMock(return_value="Character As Text")
-        quest.as_text = MagicMock(return_value="Quest As Text")
+        with patch.object(Character, "as_text", return_value="Character As Text"), \
+                patch.object(Quest, "as_text", return_value="Quest As Text"):
+            stats = drain(client=mock_client)
 
-        assistant = Assistant(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Test Assistant",
-            model="gpt-4",
-        )
-
-        assistant.save()
+        assert stats["done"] == 1
 
         # Ensure assistant has openai_assistant_id set
+        assistant.refresh_from_db()
         assert assistant.openai_assistant_id == "asst_mock_id"
 
         # Ensure assistant was created via the API with correct parameters
@@ -85,149 +86,39 @@ class TestAssistantModels:
             model=assistant.model,
         )
 
-        # Ensure QuestAssistant was created
-        quest_assistant = QuestAssistant.objects.get(quest=quest)
-        assert quest_assistant.assistant == assistant
-
-    @patch("apps.assistants.models.client")
-    def test_assistant_deletion(self, mock_client):
-        # Mock the assistant deletion response for success
-        mock_delete_response_success = {
-            "id": "asst_mock_id",
-            "object": "assistant.deleted",
-            "deleted": True,
-        }
-        mock_client.beta.assistants.delete.return_value = mock_delete_response_success
-
-        # Create necessary instances
-        general_instructions = GeneralInstructions.objects.create(
-            name="General", instructions="General Instructions"
-        )
-
-        # Create Story and Adventure as required
-        story = Story.objects.create(
-            title="Story One", description="First Story"
-        )
-        adventure = Adventure.objects.create(
-            title="Adventure One", description="First Adventure", story=story
-        )
-
-        # Create Character
-        character = Character.objects.create(
-            name="Character One",
-            description="First Character",
-            voice="alloy"
-        )
-
-        # Create Quest with Character
-        quest = Quest.objects.create(
-            title="Quest One",
-            description="First Quest",
-            character=character,
-            adventure=adventure,
-        )
-        quest_instructions = QuestInstructions.objects.create(
-            quest=quest, name="Quest Specific", instructions="Quest Instructions"
-        )
-
-        assistant = Assistant.objects.create(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Test Assistant",
-            model="gpt-4",
-            openai_assistant_id="asst_mock_id",
-        )
-
-        # Delete the assistant
-        assistant.delete()
+        job.refresh_from_db()
+        assert job.status == AssistantSyncJob.STATUS_DONE
+        assert job.attempts == 1
 
-        # Ensure assistant was deleted via the API
-        mock_client.beta.assistants.delete.assert_called_once_with("asst_mock_id")
+    def test_assistant_deletion_is_queued(self, quest):
+        assistant = create_assistant(quest, openai_assistant_id="asst_mock_id")
 
-        # Ensure the assistant is deleted from the database
+        # Deleting makes no OpenAI call, it queues one for the worker
+        with patch("apps.assistants.sync.get_client") as mock_get_client:
+            assistant.delete()
+        mock_get_client.assert_not_called()
         assert not Assistant.objects.filter(id=assistant.id).exists()
+        job = AssistantSyncJob.objects.get()
+        assert (job.assistant_id, job.delete_openai_assistant_id) == (None, "asst_mock_id")
 
-        # Now test the case where deletion fails
-        # Reset the mock
-        mock_client.reset_mock()
-
-        # Mock the assistant deletion response to indicate failure
-        mock_delete_response_failure = {
-            "id": "asst_mock_id",
-            "object": "assistant.deleted",
-            "deleted": False,
-        }
-        mock_client.beta.assistants.delete.return_value = mock_delete_response_failure
-
-        # Re-create the assistant
-        assistant_failure = Assistant.objects.create(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Test Assistant Failure",
-            model="gpt-4",
-            openai_assistant_id="asst_mock_id",
-        )
-
-        # Attempt to delete the assistant, expecting an exception
-        with pytest.raises(Exception) as excinfo:
-            assistant_failure.delete()
+        # A failed deletion is retried
+        client = MagicMock()
+        client.beta.assistants.delete.return_value = MagicMock(deleted=False)
+        assert drain(client=client)["retry"] == 1
+        client.beta.assistants.delete.assert_called_once_with("asst_mock_id")
 
-        # Ensure the exception message is as expected
-        assert "Assistant deletion failed" in str(excinfo.value)
+        AssistantSyncJob.objects.update(run_after=timezone.now())
+        client.beta.assistants.delete.return_value = MagicMock(deleted=True)
+        assert drain(client=client)["done"] == 1
+        assert AssistantSyncJob.objects.get().status == AssistantSyncJob.STATUS_DONE
 
-        # Ensure assistant was deleted via the API
-        mock_client.beta.assistants.delete.assert_called_once_with("asst_mock_id")
-
-        # Ensure the assistant still exists in the database because deletion failed
-        assert Assistant.objects.filter(id=assistant_failure.id).exists()
-
-    def test_build_instructions(self):
-        # Create necessary instances
-        general_instructions = GeneralInstructions.objects.create(
-            name="General", instructions="General Instructions"
-        )
-
-        # Create Story, Adventure, and Quest if required
-        story = Story.objects.create(
-            title="Story One", description="First Story"
-        )
-        adventure = Adventure.objects.create(
-            title="Adventure One", description="First Adventure", story=story
-        )
-
-        # Create Character
-        character = Character.objects.create(
-            name="Character One",
-            description="First Character",
-            voice="alloy"
-        )
-
-        # Create Quest with Character
-        quest = Quest.objects.create(
-            title="Quest One",
-            description="First Quest",
-            character=character,
-            adventure=adventure,
-        )
-
-        quest_instructions = QuestInstructions.objects.create(
-            quest=quest, name="Quest Specific", instructions="Quest Instructions"
-        )
+    def test_build_instructions(self, quest):
+        assistant = build_assistant(quest)
 
         # Mock the as_text methods
-        character.as_text = MagicMock(return_value="Character As Text")
+        quest.character.as_text = MagicMock(return_value="Character As Text")
         quest.as_text = MagicMock(return_value="Quest As Text")
 
-        assistant = Assistant(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Test Assistant",
-            model="gpt-4",
-        )
-
         instructions = assistant.build_instructions()
         expected_instructions = (
             "General Instructions\n\n"
@@ -240,49 +131,10 @@ class TestAssistantModels:
 
         assert instructions == expected_instructions
 
-    @patch("apps.assistants.models.client")
-    def test_save_existing_assistant(self, mock_client):
-        # Create necessary instances
-        general_instructions = GeneralInstructions.objects.create(
-            name="General", instructions="General Instructions"
-        )
-
-        # Create Story, Adventure, and Quest as required
-        story = Story.objects.create(
-            title="Story One", description="First Story"
-        )
-        adventure = Adventure.objects.create(
-            title="Adventure One", description="First Adventure", story=story
-        )
-
-        # Create Character
-        character = Character.objects.create(
-            name="Character One",
-            description="First Character",
-            voice="alloy"
-        )
-
-        # Create Quest with Character
-        quest = Quest.objects.create(
-            title="Quest One",
-            description="First Quest",
-            character=character,
-            adventure=adventure,
-        )
-
-        quest_instructions = QuestInstructions.objects.create(
-            quest=quest, name="Quest Specific", instructions="Quest Instructions"
-        )
-
-        # Mock assistant
-        assistant = Assistant.objects.create(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Test Assistant",
-            model="gpt-4",
-            openai_assistant_id="asst_existing_id",
-        )
+    @patch("apps.assistants.sync.get_client")
+    def test_save_existing_assistant(self, mock_get_client, quest):
+        mock_client = mock_get_client.return_value
+        assistant = create_assistant(quest, openai_assistant_id="asst_existing_id")
 
         # Save assistant again
         assistant.save()
@@ -290,116 +142,369 @@ class TestAssistantModels:
         # Ensure that API create is not called since openai_assistant_id is already set
         mock_client.beta.assistants.create.assert_not_called()
 
-    @pytest.mark.django_db(transaction=True)
-    @patch("apps.assistants.models.client")
-    def test_assistant_save_failure(self, mock_client):
+    def test_assistant_sync_failure_is_retried(self, settings, quest):
+        settings.ASSISTANT_SYNC_MAX_ATTEMPTS = 2
         # Mock the assistant creation to raise an exception
-        mock_client.beta.assistants.create.side_effect = Exception("API Error")
+        failing_client = MagicMock()
+        failing_client.beta.assistants.create.side_effect = Exception("API Error")
 
-        # Create necessary instances
-        general_instructions = GeneralInstructions.objects.create(
-            name="General", instructions="General Instructions"
-        )
+        assistant = build_assistant(quest)
 
-        # Create Story and Adventure as required
-        story = Story.objects.create(
-            title="Story One", description="First Story"
-        )
-        adventure = Adventure.objects.create(
-            title="Adventure One", description="First Adventure", story=story
-        )
-
-        # Create Character
-        character = Character.objects.create(
-            name="Character One",
-            description="First Character",
-            voice="alloy"
-        )
-
-        # Create Quest with Character
-        quest = Quest.objects.create(
-            title="Quest One",
-            description="First Quest",
-            character=character,
-            adventure=adventure,
-        )
+        # Saving succeeds even though OpenAI is failing
+        assistant.save()
+        assert Assistant.objects.filter(name="Test Assistant").exists()
 
-        quest_instructions = QuestInstructions.objects.create(
-            quest=quest, name="Quest Specific", instructions="Quest Instructions"
-        )
+        stats = drain(client=failing_client)
+        assert stats["retry"] == 1
 
-        assistant = Assistant(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Test Assistant",
-            model="gpt-4",
-        )
+        job = AssistantSyncJob.objects.get(assistant=assistant)
+        assert job.status == AssistantSyncJob.STATUS_PENDING
+        assert job.attempts == 1
+        assert "API Error" in job.last_error
+        assert job.run_after > timezone.now()
 
-        with pytest.raises(Exception) as excinfo:
-            assistant.save()
+        # The job waits out its backoff
+        assert drain(client=failing_client)["retry"] == 0
 
-        assert "API Error" in str(excinfo.value)
+        AssistantSyncJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        stats = drain(client=failing_client)
+        assert stats["failed"] == 1
 
-        # Ensure that the assistant was not saved to the database
-        assert not Assistant.objects.filter(name="Test Assistant").exists()
+        job.refresh_from_db()
+        assert job.status == AssistantSyncJob.STATUS_FAILED
+        assert job.attempts == 2
+        assistant.refresh_from_db()
+        assert assistant.openai_assistant_id is None
 
-    @patch("apps.assistants.models.client")
-    def test_quest_assistant_uniqueness(self, mock_client):
+    @patch("apps.assistants.sync.get_client")
+    def test_quest_assistant_uniqueness(self, mock_get_client, quest, general_instructions):
+        mock_client = mock_get_client.return_value
         # Mock the assistant creation response
         mock_assistant = MagicMock()
         mock_assistant.id = "asst_mock_id"
 
         mock_client.beta.assistants.create.return_value = mock_assistant
 
-        # Create necessary instances
-        general_instructions = GeneralInstructions.objects.create(
-            name="General", instructions="General Instructions"
-        )
+        create_assistant(quest, general_instructions, "Assistant One")
+        assistant2 = build_assistant(quest, general_instructions, "Assistant Two")
 
-        # Create Story and Adventure as required
-        story = Story.objects.create(
-            title="Story One", description="First Story"
-        )
-        adventure = Adventure.objects.create(
-            title="Adventure One", description="First Adventure", story=story
-        )
+        with pytest.raises(IntegrityError):
+            assistant2.save()
 
-        # Create Character
-        character = Character.objects.create(
-            name="Character One",
-            description="First Character",
-            voice="alloy"
-        )
 
-        # Create Quest with Character
-        quest = Quest.objects.create(
-            title="Quest One",
-            description="First Quest",
-            character=character,
-            adventure=adventure,
-        )
+class FakeAssistants:
+    """
+    Stands in for client.beta.assistants, recording the calls it receives.
+    """
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.deleted = []
 
-        quest_instructions = QuestInstructions.objects.create(
-            quest=quest, name="Quest Specific", instructions="Quest Instructions"
-        )
+    def create(self, **kwargs):
+        self.created.append(kwargs)
+        return MagicMock(id=f"asst_fake_{len(self.created)}")
 
-        assistant1 = Assistant(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Assistant One",
-            model="gpt-4",
-        )
-        assistant1.save()
-
-        assistant2 = Assistant(
-            quest=quest,
-            quest_instructions=quest_instructions,
-            general_instructions=general_instructions,
-            name="Assistant Two",
-            model="gpt-4",
-        )
+    def update(self, assistant_id, **kwargs):
+        self.updated.append((assistant_id, kwargs))
+        return MagicMock(id=assistant_id)
 
-        with pytest.raises(IntegrityError):
-            assistant2.save()
+    def delete(self, assistant_id):
+        self.deleted.append(assistant_id)
+        return MagicMock(id=assistant_id, deleted=True)
+
+
+class FakeOpenAIClient:
+    def __init__(self):
+        self.beta = MagicMock()
+        self.beta.assistants = FakeAssistants()
+
+
+@pytest.mark.django_db
+class TestAssistantSyncWorker:
+
+    @pytest.fixture
+    def assistant(self, quest):
+        return create_assistant(quest)
+
+    def test_create_then_update(self, assistant):
+        client = FakeOpenAIClient()
+        drain(client=client)
+        assistant.refresh_from_db()
+        assert assistant.openai_assistant_id == "asst_fake_1"
+
+        # Editing the quest queues an update of the same remote assistant
+        quest = assistant.quest
+        quest.description = "Changed Quest"
+        quest.save()
+        drain(client=client)
+
+        assert len(client.beta.assistants.created) == 1
+        assistant_id, kwargs = client.beta.assistants.updated[-1]
+        assert assistant_id == "asst_fake_1"
+        assert "Changed Quest" in kwargs["instructions"]
+        assert not AssistantSyncJob.objects.filter(status=AssistantSyncJob.STATUS_PENDING).exists()
+
+    def test_unchanged_instructions_are_not_pushed(self, assistant):
+        client = FakeOpenAIClient()
+        drain(client=client)
+        assistant.refresh_from_db()
+        assert assistant.synced_instructions_hash == Assistant.hash_instructions(assistant.build_instructions())
+
+        # The image isn't part of the prompt, so the queued sync is a local comparison
+        quest = assistant.quest
+        quest.image_name = "new_image.png"
+        quest.save()
+        stats = drain(client=client)
+
+        assert stats["unchanged"] == 1
+        assert stats["done"] == 0
+        assert client.beta.assistants.updated == []
+        assert AssistantSyncJob.objects.filter(status=AssistantSyncJob.STATUS_DONE).count() == 2
+
+    def test_worker_command_drains_outbox(self, assistant):
+        client = FakeOpenAIClient()
+        out = StringIO()
+
+        with patch("apps.assistants.sync.get_client", return_value=client):
+            call_command("run_assistant_sync", "--once", stdout=out)
+
+        assert "Synced 1" in out.getvalue()
+        assistant.refresh_from_db()
+        assert assistant.openai_assistant_id == "asst_fake_1"
+
+    def test_claimed_jobs_are_leased(self, assistant):
+        jobs = claim_jobs(10)
+
+        assert [job.assistant_id for job in jobs] == [assistant.pk]
+        # A second worker doesn't see the claimed job until the lease expires
+        assert claim_jobs(10) == []
+
+    def test_quest_deletion_deletes_remote_assistant(self, assistant):
+        client = FakeOpenAIClient()
+        drain(client=client)
+
+        # Cascades skip Assistant.delete(), the queued deletion still happens
+        assistant.quest.delete()
+        stats = drain(client=client)
+
+        assert stats["done"] == 1
+        assert client.beta.assistants.deleted == ["asst_fake_1"]
+
+    def test_assistant_deleted_during_create_is_not_orphaned(self, assistant):
+        client = FakeOpenAIClient()
+        jobs = claim_jobs(10)
+        # Deleted after the claim, while the create call is in flight
+        Assistant.objects.filter(pk=assistant.pk).delete()
+
+        with ThreadPoolExecutor(1) as executor:
+            assert process_jobs(jobs, client, executor, RateLimiter(0)) == [AssistantSyncJob.STATUS_DONE]
+
+        job = AssistantSyncJob.objects.get()
+        assert job.delete_openai_assistant_id == "asst_fake_1"
+        drain(client=client)
+        assert client.beta.assistants.deleted == ["asst_fake_1"]
+
+
+@pytest.mark.django_db
+class TestSyncCoalescing:
+
+    def test_objective_edits_collapse_into_one_sync(self, quest, general_instructions):
+        assistant = create_assistant(quest, general_instructions, "Test Assistant")
+
+        # Like an admin inline saving three objectives in one request
+        with transaction.atomic():
+            for n in range(3):
+                Objectives.objects.create(quest=quest, objective=f"Objective {n}")
+
+        job = AssistantSyncJob.objects.get(assistant=assistant)
+        # Creation plus three objective changes
+        assert job.coalesced == 3
+
+        client = FakeOpenAIClient()
+        stats = drain(client=client)
+        assert stats["done"] == 1
+        assert stats["coalesced"] == 3
+        assert len(client.beta.assistants.created) == 1
+        assert "Objective 2" in client.beta.assistants.created[0]["instructions"]
+
+    def test_character_change_syncs_each_assistant_once(self, quest, django_assert_max_num_queries, general_instructions):
+        other_quest = Quest.objects.create(
+            title="Quest Two", description="Second Quest", character=quest.character, adventure=quest.adventure
+        )
+        assistants = [
+            create_assistant(quest, general_instructions, "Assistant One"),
+            create_assistant(other_quest, general_instructions, "Assistant Two"),
+        ]
+        drain(client=FakeOpenAIClient())
+
+        character = quest.character
+        character.description = "Changed"
+        # The fan-out is a fixed number of queries, not a save per assistant
+        with django_assert_max_num_queries(5):
+            character.save()
+        character.save()
+
+        pending = AssistantSyncJob.objects.filter(status=AssistantSyncJob.STATUS_PENDING)
+        assert sorted(pending.values_list('assistant_id', flat=True)) == sorted(a.pk for a in assistants)
+        assert set(pending.values_list('coalesced', flat=True)) == {1}
+
+    def test_changes_after_claim_queue_a_new_sync(self, quest, general_instructions):
+        assistant = create_assistant(quest, general_instructions, "Test Assistant")
+        claim_jobs(10)
+
+        Objectives.objects.create(quest=quest, objective="Late objective")
+
+        jobs = AssistantSyncJob.objects.filter(assistant=assistant)
+        assert sorted(jobs.values_list('status', flat=True)) == [AssistantSyncJob.STATUS_PENDING, AssistantSyncJob.STATUS_RUNNING]
+
+    def test_one_pending_job_per_assistant(self, quest, general_instructions):
+        assistant = create_assistant(quest, general_instructions, "Test Assistant")
+
+        with pytest.raises(IntegrityError), transaction.atomic():
+            AssistantSyncJob.objects.create(assistant=assistant, run_after=timezone.now())
+
+        # A concurrent enqueue that inserted first: ours is dropped instead of failing
+        with patch.object(AssistantSyncJob.objects, 'filter', return_value=AssistantSyncJob.objects.none()):
+            AssistantSyncJob.objects.enqueue([assistant.pk])
+        assert AssistantSyncJob.objects.filter(assistant=assistant).count() == 1
+
+    def test_retry_yields_to_newer_pending_job(self, quest, general_instructions):
+        assistant = create_assistant(quest, general_instructions, "Test Assistant")
+        [claimed] = claim_jobs(10)
+        Objectives.objects.create(quest=quest, objective="Late objective")
+
+        failing_client = MagicMock()
+        failing_client.beta.assistants.create.side_effect = Exception("API Error")
+        with ThreadPoolExecutor(1) as executor:
+            assert process_jobs([claimed], failing_client, executor, RateLimiter(0)) == ['retry']
+
+        jobs = AssistantSyncJob.objects.filter(assistant=assistant)
+        assert sorted(jobs.values_list('status', flat=True)) == [AssistantSyncJob.STATUS_FAILED, AssistantSyncJob.STATUS_PENDING]
+
+    def test_debounce_window(self, quest, settings, general_instructions):
+        settings.ASSISTANT_SYNC_DEBOUNCE_SECONDS = 60
+        create_assistant(quest, general_instructions, "Test Assistant")
+
+        # Not due until the window closes
+        assert claim_jobs(10) == []
+        AssistantSyncJob.objects.update(run_after=timezone.now())
+        assert len(claim_jobs(10)) == 1
+
+    def test_coalescing_stats(self, quest, general_instructions):
+        create_assistant(quest, general_instructions, "Test Assistant")
+        general_instructions.save()
+        general_instructions.save()
+
+        assert AssistantSyncJob.objects.coalescing_stats() == {'requests': 3, 'syncs': 1, 'saved': 2}
+
+
+@pytest.fixture
+def assistants(general_instructions):
+    adventure = create_adventure()
+    assistants = []
+    for n in range(5):
+        # A character each, so loading them is part of what's measured
+        character = Character.objects.create(name=f"Character {n}", description="A Character", voice="alloy")
+        quest = Quest.objects.create(title=f"Quest {n}", description="A Quest", character=character, adventure=adventure)
+        Objectives.objects.bulk_create([Objectives(quest=quest, objective=f"Objective {n}.{m}") for m in range(3)])
+        assistants.append(create_assistant(quest, general_instructions, f"Assistant {n}"))
+    return assistants
+
+
+@pytest.mark.django_db
+class TestBatchInstructions:
+
+    def test_build_instructions_in_constant_queries(self, assistants, django_assert_num_queries):
+        expected = {a.pk: Assistant.objects.get(pk=a.pk).build_instructions() for a in assistants}
+
+        # Assistants with their instructions and characters, then the objectives
+        with django_assert_num_queries(2):
+            rendered = Assistant.objects.all().build_instructions()
+
+        assert rendered == expected
+
+    def test_drain_loads_a_batch_in_constant_queries(self, assistants, django_assert_max_num_queries):
+        client = FakeOpenAIClient()
+        # Two claims with their savepoints (the second finds nothing), the batch load
+        # of assistants and objectives, then two writes per job; none per related row
+        with django_assert_max_num_queries(9 + 2 * len(assistants)):
+            stats = drain(client=client)
+        assert stats["done"] == len(assistants)
+
+    def test_general_instructions_change_is_rendered_by_the_worker(
+        self, assistants, general_instructions, django_assert_max_num_queries
+    ):
+        drain(client=FakeOpenAIClient())
+
+        general_instructions.name = "Renamed"
+        # Queueing doesn't load the assistants or render their prompts
+        with django_assert_max_num_queries(5):
+            general_instructions.save()
+        assert AssistantSyncJob.objects.filter(status=AssistantSyncJob.STATUS_PENDING).count() == len(assistants)
+        client = FakeOpenAIClient()
+        stats = drain(client=client)
+        assert stats["unchanged"] == len(assistants)
+        assert client.beta.assistants.updated == []
+
+        general_instructions.instructions = "New General Instructions"
+        general_instructions.save()
+        stats = drain(client=client)
+        assert stats["done"] == len(assistants)
+
+    def test_rebuild_command_queues_stale_assistants(self, assistants):
+        drain(client=FakeOpenAIClient())
+        # A change made behind the signals' back, e.g. a bulk update
+        Objectives.objects.filter(quest=assistants[0].quest).update(objective="Rewritten")
+
+        out = StringIO()
+        call_command("rebuild_assistant_instructions", stdout=out)
+
+        assert "Checked 5 assistants, queued 1 syncs" in out.getvalue()
+        pending = AssistantSyncJob.objects.filter(status=AssistantSyncJob.STATUS_PENDING)
+        assert list(pending.values_list('assistant_id', flat=True)) == [assistants[0].pk]
+
+
+@pytest.mark.django_db
+class TestConcurrentSync:
+
+    def test_bounded_concurrency_against_stub_server(self, assistants):
+        with AssistantsStubServer(latency=0.1) as stub:
+            client = openai.Client(base_url=stub.base_url, api_key="stub", max_retries=0)
+            stats = drain(client=client, concurrency=3)
+
+        assert stats["done"] == len(assistants)
+        assert stub.requests == len(assistants)
+        assert stub.peak_in_flight == 3
+        # Five 100ms calls three at a time take two rounds, not five
+        assert stats["seconds"] < 0.4
+        ids = set(Assistant.objects.values_list('openai_assistant_id', flat=True))
+        assert ids == set(stub.assistants)
+
+    def test_failures_are_recorded_per_assistant(self, assistants):
+        failing = assistants[2]
+        client = FakeOpenAIClient()
+        create = client.beta.assistants.create
+
+        def flaky_create(**kwargs):
+            if kwargs["name"] == failing.name:
+                raise Exception("API Error")
+            return create(**kwargs)
+
+        client.beta.assistants.create = flaky_create
+        stats = drain(client=client, concurrency=4)
+
+        assert stats["done"] == len(assistants) - 1
+        assert stats["retry"] == 1
+        job = AssistantSyncJob.objects.get(assistant=failing)
+        assert job.status == AssistantSyncJob.STATUS_PENDING
+        assert job.last_error == "API Error"
+        assert AssistantSyncJob.objects.filter(status=AssistantSyncJob.STATUS_DONE).count() == len(assistants) - 1
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = RateLimiter(50)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        # The first call goes straight through, the next five wait 20ms each
+        assert time.monotonic() - start >= 0.1
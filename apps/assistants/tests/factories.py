@@ -0,0 +1,27 @@
+"""
+Assistants for the assistants tests, on top of the storyline factories.
+"""
+from apps.assistants.models import Assistant, GeneralInstructions, QuestInstructions
+
+
+def create_general_instructions():
+    return GeneralInstructions.objects.create(name="General", instructions="General Instructions")
+
+
+def build_assistant(quest, general_instructions=None, name="Test Assistant", **fields):
+    # Unsaved, for tests about what saving does
+    quest_instructions = QuestInstructions.objects.create(quest=quest, name=f"{name} Instructions", instructions="Quest Instructions")
+    return Assistant(
+        quest=quest,
+        quest_instructions=quest_instructions,
+        general_instructions=general_instructions or create_general_instructions(),
+        name=name,
+        model="gpt-4",
+        **fields,
+    )
+
+
+def create_assistant(quest, general_instructions=None, name="Test Assistant", **fields):
+    assistant = build_assistant(quest, general_instructions, name, **fields)
+    assistant.save()
+    return assistant
@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from services import openai_service
+from services.openai_service import get_client, get_async_client, reset_clients
+from services.openai_stub import AssistantsStubServer
+
+
+@pytest.fixture
+def stub(settings):
+    with AssistantsStubServer() as stub:
+        settings.OPENAI_BASE_URL = stub.base_url
+        settings.OPENAI_API_KEY = "stub"
+        settings.OPENAI_MAX_RETRIES = 0
+        yield stub
+    reset_clients()
+
+
+class TestOpenAIClient:
+
+    def test_client_is_built_lazily_and_shared(self, stub):
+        reset_clients()
+        assert openai_service._client is None
+
+        client = get_client()
+        assert get_client() is client
+        assert str(client.base_url).rstrip("/") == stub.base_url
+
+    def test_setting_change_rebuilds_client(self, stub, settings):
+        client = get_client()
+        settings.OPENAI_TIMEOUT = 2
+        assert get_client() is not client
+        assert get_client().timeout.read == 2
+
+    def test_calls_reuse_pooled_connections(self, stub):
+        client = get_client()
+        for n in range(3):
+            client.beta.assistants.create(name=f"Assistant {n}", model="gpt-4", instructions="Hi")
+
+        assert len(stub.assistants) == 3
+        # All three requests went over a single keep-alive connection
+        assert stub.connections == 1
+
+    def test_lazy_module_client(self, stub):
+        remote = openai_service.client.beta.assistants.create(name="Lazy", model="gpt-4", instructions="Hi")
+        assert remote.id in stub.assistants
+
+    def test_module_client_introspection_needs_no_key(self, settings):
+        reset_clients()
+        settings.OPENAI_API_KEY = None
+        assert not hasattr(openai_service.client, "__func__")
+        assert openai_service._client is None
+
+    def test_async_client(self, stub):
+        async def create():
+            client = get_async_client()
+            assert get_async_client() is client
+            remote = await client.beta.assistants.create(name="Async", model="gpt-4", instructions="Hi")
+            await client.close()
+            return remote
+
+        remote = asyncio.run(create())
+        assert remote.name == "Async"
+        assert remote.id in stub.assistants
@@ -1,37 +1,59 @@
+from django import forms
 from django.contrib import admin
 from .models import Story, Adventure, Quest, Objectives, Character
 
+
+class OrderedModelForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # In sparse ordering mode the stored number is a snapshot; edit the live position,
+        # so that leaving it alone doesn't move the object
+        if self.instance.pk is not None and 'dense_num' in self.instance.__dict__:
+            self.initial[self.instance.num_field_name] = self.instance.dense_num
+
+
+class OrderedAdminMixin:
+    form = OrderedModelForm
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_counted_positions()
+
+    @admin.display(description='Position', ordering='order_key')
+    def position(self, obj):
+        return obj.position
+
+
 # Note objects must be deleted from their page, not with a select delete
-class QuestInline(admin.TabularInline):
+class QuestInline(OrderedAdminMixin, admin.TabularInline):
     model = Quest
     extra = 0
     fields = ('quest_num', 'title', 'description')
-    ordering = ('quest_num',)
+    ordering = ('order_key',)
     show_change_link = True
 
-class AdventureInline(admin.TabularInline):
+class AdventureInline(OrderedAdminMixin, admin.TabularInline):
     model = Adventure
     extra = 0
     fields = ('adventure_num', 'title', 'description')
-    ordering = ('adventure_num',)
+    ordering = ('order_key',)
     show_change_link = True
 
-class StoryAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title','story_num', 'include', 'description', 'created_at', 'updated_at')
-    ordering = ('story_num',)
+class StoryAdmin(OrderedAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'position', 'include', 'description', 'created_at', 'updated_at')
+    ordering = ('order_key',)
     search_fields = ('title',)
     inlines = [AdventureInline]
 
-class AdventureAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title','adventure_num', 'include', 'story',  'description', 'created_at', 'updated_at')
-    ordering = ('story', 'adventure_num')
+class AdventureAdmin(OrderedAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'position', 'include', 'story',  'description', 'created_at', 'updated_at')
+    ordering = ('story', 'order_key')
     search_fields = ('title', 'story__title')
     inlines = [QuestInline]
     list_filter = ('story',)
 
-class QuestAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'quest_num', 'include', 'adventure', 'description', 'character' ,'created_at', 'image_name', 'updated_at')
-    ordering = ('adventure', 'quest_num')
+class QuestAdmin(OrderedAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'position', 'include', 'adventure', 'description', 'character' ,'created_at', 'image_name', 'updated_at')
+    ordering = ('adventure', 'order_key')
     search_fields = ('title', 'adventure__title')
     list_filter = ('adventure__story', 'adventure')
 
@@ -5,11 +5,14 @@ from apps.assistants.models import QuestAssistant
 
 
 class StoryDetailSerializer(serializers.ModelSerializer):
+    story_num = serializers.IntegerField(source='position', read_only=True)
+
     class Meta:
         model = Story
         fields = ('id', 'title', 'description', 'story_num')
 
 class AdventureDetailSerializer(serializers.ModelSerializer):
+    adventure_num = serializers.IntegerField(source='position', read_only=True)
     story = StorySerializer()
 
     class Meta:
@@ -17,6 +20,7 @@ class AdventureDetailSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'description', 'adventure_num', 'story')
 
 class QuestDetailSerializer(serializers.ModelSerializer):
+    quest_num = serializers.IntegerField(source='position', read_only=True)
     adventure = AdventureSerializer()
     assistant_id = serializers.SerializerMethodField()
     character = CharacterSerializer()
@@ -27,6 +31,9 @@ class QuestDetailSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'description', 'quest_num', 'adventure', 'image_name', 'assistant_id', 'objectives', 'character')
 
     def get_assistant_id(self, obj):
+        # QuestDetailView annotates the id onto the quest; only fall back to a lookup without it
+        if hasattr(obj, 'openai_assistant_id'):
+            return obj.openai_assistant_id
         try:
             return QuestAssistant.objects.get(quest=obj).assistant.openai_assistant_id
         except QuestAssistant.DoesNotExist:
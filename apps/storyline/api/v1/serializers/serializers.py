@@ -3,6 +3,8 @@ from apps.storyline.models import Story, Adventure, Quest, Objectives, Character
 
 
 class QuestSerializer(serializers.ModelSerializer):
+    quest_num = serializers.IntegerField(source='position', read_only=True)
+
     class Meta:
         model = Quest
         fields = ('id', 'title', 'quest_num')
@@ -14,6 +16,7 @@ class ObjectivesSerializer(serializers.ModelSerializer):
 
 
 class AdventureSerializer(serializers.ModelSerializer):
+    adventure_num = serializers.IntegerField(source='position', read_only=True)
     quests = serializers.SerializerMethodField()
 
     class Meta:
@@ -21,12 +24,16 @@ class AdventureSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'adventure_num', 'quests')
 
     def get_quests(self, obj):
-        # Order quests by 'quest_num' and exclude any quest where include is false
-        quests = obj.quests.filter(include=True).order_by('quest_num')
+        # Use the included quests prefetched by the view when available
+        quests = getattr(obj, 'included_quests', None)
+        if quests is None:
+            # Order quests by position and exclude any quest where include is false
+            quests = obj.quests.filter(include=True).in_order().with_positions()
         return QuestSerializer(quests, many=True).data
 
 
 class StorySerializer(serializers.ModelSerializer):
+    story_num = serializers.IntegerField(source='position', read_only=True)
     adventures = serializers.SerializerMethodField()
 
     class Meta:
@@ -34,11 +41,17 @@ class StorySerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'story_num','adventures')
 
     def get_adventures(self, obj):
-        # Order adventures by 'adventure_num'
-        adventures = obj.adventures.filter(include=True).order_by('adventure_num')
+        # Use the included adventures prefetched by the view when available
+        adventures = getattr(obj, 'included_adventures', None)
+        if adventures is None:
+            # Order adventures by position
+            adventures = obj.adventures.filter(include=True).in_order().with_positions()
         return AdventureSerializer(adventures, many=True).data
 
 class CharacterSerializer(serializers.ModelSerializer):
     class Meta:
         model = Character
-        fields = ('id', 'name', 'voice')
\ No newline at end of file
+        fields = ('id', 'name', 'voice')
+
+class ReorderSerializer(serializers.Serializer):
+    order = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
@@ -1,8 +1,12 @@
 from django.urls import path
-from .views import StoryListView, AdventureDetailView, QuestDetailView
+from apps.storyline.models import Story, Adventure, Quest
+from .views import StoryListView, AdventureDetailView, QuestDetailView, ReorderView
 
 urlpatterns = [
     path('storyline/', StoryListView.as_view(), name='story-list'),
     path('adventure/<int:pk>/', AdventureDetailView.as_view(), name='adventure-detail'),
     path('quest/<int:pk>/', QuestDetailView.as_view(), name='quest-detail'),
+    path('storyline/reorder/', ReorderView.as_view(model=Story), name='story-reorder'),
+    path('story/<int:pk>/reorder/', ReorderView.as_view(model=Adventure, parent_model=Story), name='adventure-reorder'),
+    path('adventure/<int:pk>/reorder/', ReorderView.as_view(model=Quest, parent_model=Adventure), name='quest-reorder'),
 ]
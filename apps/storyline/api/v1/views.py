@@ -1,44 +1,116 @@
-from rest_framework import generics
+from django.db.models import F, Prefetch
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from rest_framework import generics, status
+from apps.storyline.cache import get_catalog
+from apps.storyline.conditional import catalog_condition, adventure_condition, quest_condition
 from apps.storyline.models import Story, Adventure, Quest
-from apps.storyline.api.v1.serializers.serializers import StorySerializer
+from apps.storyline.api.v1.serializers.serializers import StorySerializer, ReorderSerializer
 from apps.storyline.api.v1.serializers.detail_serializers import AdventureDetailSerializer, QuestDetailSerializer
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 
+@method_decorator(catalog_condition, name='get')
 @permission_classes([IsAuthenticated])
 class StoryListView(generics.ListAPIView):
-    queryset = Story.objects.filter(include=True).order_by('story_num')
+    queryset = Story.objects.filter(include=True)
     serializer_class = StorySerializer
 
+    def get_queryset(self):
+        # The whole tree is loaded in three queries: stories, adventures and quests
+        return super().get_queryset().in_order().with_positions().with_adventures()
+
     def list(self, request, *args, **kwargs):
-        
+        # The catalog is the same for every user, so it is served from cache until staff edit it
+        stories = get_catalog(self.serialize_catalog)
+        return Response({"stories": stories})
+
+    def serialize_catalog(self):
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
-    
-        return Response({"stories": serializer.data})
+        return list(serializer.data)
 
 
+@method_decorator(adventure_condition, name='get')
 @permission_classes([IsAuthenticated])
 class AdventureDetailView(generics.RetrieveAPIView):
     queryset = Adventure.objects.filter(include=True)
     serializer_class = AdventureDetailSerializer
     lookup_field = 'pk'
 
+    def get_queryset(self):
+        # The adventure's and its story's positions are counted in the same query
+        return (
+            super().get_queryset()
+            .select_related('story')
+            .with_counted_positions()
+            .annotate(story_position=Story.ordering_manager().position_expression('story__'))
+        )
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
+        instance.story.dense_num = instance.story_position
         serializer = self.get_serializer(instance)
         return Response({"adventure": serializer.data})
     
 
+@method_decorator(quest_condition, name='get')
 @permission_classes([IsAuthenticated])
 class QuestDetailView(generics.RetrieveAPIView):
     queryset = Quest.objects.filter(include=True)
     serializer_class = QuestDetailSerializer
     lookup_field = 'pk'
 
+    def get_queryset(self):
+        # Adventure, character, assistant id and positions are joined in; sibling quests and objectives are prefetched
+        return (
+            super().get_queryset()
+            .select_related('adventure', 'character')
+            .prefetch_related(
+                Prefetch(
+                    'adventure__quests',
+                    queryset=Quest.objects.filter(include=True).in_order().with_positions(),
+                    to_attr='included_quests',
+                ),
+                'objectives',
+            )
+            .with_counted_positions()
+            .annotate(
+                openai_assistant_id=F('questassistant__assistant__openai_assistant_id'),
+                adventure_position=Adventure.ordering_manager().position_expression('adventure__'),
+            )
+        )
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
+        instance.adventure.dense_num = instance.adventure_position
         serializer = self.get_serializer(instance)
-        return Response({"quest": serializer.data})
\ No newline at end of file
+        return Response({"quest": serializer.data})
+
+
+@permission_classes([IsAdminUser])
+class ReorderView(generics.GenericAPIView):
+    """
+    Staff-only endpoint applying a complete new order to the included children
+    of a parent in a single transaction.
+    """
+    # Staff rights are checked against the database rather than the token's claims
+    authentication_classes = [JWTAuthentication]
+    serializer_class = ReorderSerializer
+    model = None
+    parent_model = None
+
+    def post(self, request, pk=None, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = serializer.validated_data['order']
+
+        parent = get_object_or_404(self.parent_model, pk=pk) if self.parent_model else None
+        try:
+            self.model.ordering_manager().bulk_reorder(parent, order)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"order": order})
@@ -0,0 +1,43 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from config.db_routers import use_primary
+
+CATALOG_VERSION_KEY = 'storyline:catalog:version'
+CATALOG_KEY = 'storyline:catalog:{version}'
+
+
+def get_catalog_version():
+    """
+    Return the current catalog version, creating it if the cache doesn't have one.
+    A fresh version is seeded from the clock so it never collides with payloads
+    cached under an older, evicted version.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    # Every payload cached under the previous version becomes unreachable
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_catalog(build):
+    """
+    Return the serialized catalog for the current version, calling build() to
+    produce and cache it on a miss. The build reads from the primary: a lagging
+    replica would otherwise get cached under the new version until the next edit.
+    """
+    key = CATALOG_KEY.format(version=get_catalog_version())
+    catalog = cache.get(key)
+    if catalog is None:
+        with use_primary():
+            catalog = build()
+        cache.set(key, catalog, timeout=settings.STORYLINE_CATALOG_CACHE_TIMEOUT)
+    return catalog
@@ -0,0 +1,167 @@
+import hashlib
+from django.core.cache import cache
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.views.decorators.http import condition
+from config.db_routers import use_primary
+from .cache import get_catalog_version
+from .models import Story, Adventure, Quest
+
+CATALOG_VALIDATORS_KEY = 'storyline:catalog:{version}:validators'
+
+
+def make_etag(*parts):
+    return hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def latest(*timestamps):
+    return max(timestamp for timestamp in timestamps if timestamp is not None)
+
+
+def included_aggregate(queryset, group_field, aggregate):
+    # Correlated subquery computing one aggregate over the included rows of a group
+    return Subquery(
+        queryset.filter(include=True)
+        .order_by()
+        .values(group_field)
+        .annotate(value=aggregate)
+        .values('value')
+    )
+
+
+def catalog_validators():
+    """
+    ETag and Last-Modified of the whole storyline tree, computed once per catalog version.
+    Counts are part of the ETag so that deletions change it too.
+    """
+    version = get_catalog_version()
+    key = CATALOG_VALIDATORS_KEY.format(version=version)
+    validators = cache.get(key)
+    if validators is None:
+        # Cached for everyone until the next edit, so like the catalog itself read from the primary
+        with use_primary():
+            validators = compute_catalog_validators()
+        cache.set(key, validators, timeout=None)
+    return validators
+
+
+def compute_catalog_validators():
+    stories = Story.objects.filter(include=True).aggregate(latest=Max('updated_at'), count=Count('pk'))
+    adventures = Adventure.objects.filter(include=True).aggregate(latest=Max('updated_at'), count=Count('pk'))
+    quests = Quest.objects.filter(include=True).aggregate(latest=Max('updated_at'), count=Count('pk'))
+    timestamps = [stories['latest'], adventures['latest'], quests['latest']]
+    last_modified = latest(*timestamps) if any(timestamps) else None
+    etag = make_etag(stories['count'], adventures['count'], quests['count'], last_modified)
+    return etag, last_modified
+
+
+def adventure_validators(pk):
+    """
+    Validators for an adventure detail, which embeds its story with every included
+    adventure and quest of that story. The story's position depends on the other
+    stories, which don't write the story's row when they move.
+    """
+    row = (
+        Adventure.objects.filter(pk=pk, include=True)
+        .annotate(
+            story_updated_at=F('story__updated_at'),
+            story_position=Story.ordering_manager().position_expression('story__'),
+            stories_updated_at=Subquery(
+                Story.objects.filter(include=True).order_by('-updated_at').values('updated_at')[:1]
+            ),
+            adventures_updated_at=included_aggregate(
+                Adventure.objects.filter(story=OuterRef('story')), 'story', Max('updated_at')
+            ),
+            adventure_count=included_aggregate(
+                Adventure.objects.filter(story=OuterRef('story')), 'story', Count('pk')
+            ),
+            quests_updated_at=included_aggregate(
+                Quest.objects.filter(adventure__story=OuterRef('story'), adventure__include=True),
+                'adventure__story',
+                Max('updated_at'),
+            ),
+            quest_count=included_aggregate(
+                Quest.objects.filter(adventure__story=OuterRef('story'), adventure__include=True),
+                'adventure__story',
+                Count('pk'),
+            ),
+        )
+        .values(
+            'story_updated_at', 'story_position', 'stories_updated_at', 'adventures_updated_at', 'adventure_count',
+            'quests_updated_at', 'quest_count',
+        )
+        .first()
+    )
+    if row is None:
+        return None
+    last_modified = latest(
+        row['story_updated_at'], row['stories_updated_at'], row['adventures_updated_at'], row['quests_updated_at']
+    )
+    etag = make_etag(
+        'adventure', pk, row['story_position'], row['adventure_count'], row['quest_count'], last_modified
+    )
+    return etag, last_modified
+
+
+def quest_validators(pk):
+    """
+    Validators for a quest detail, which embeds its adventure with the sibling quests
+    and its character. Objective and assistant changes touch the quest's updated_at.
+    The adventure's position depends on the other adventures of its story.
+    """
+    row = (
+        Quest.objects.filter(pk=pk, include=True)
+        .annotate(
+            adventure_updated_at=F('adventure__updated_at'),
+            adventure_position=Adventure.ordering_manager().position_expression('adventure__'),
+            adventures_updated_at=included_aggregate(
+                Adventure.objects.filter(story=OuterRef('adventure__story')), 'story', Max('updated_at')
+            ),
+            character_updated_at=F('character__updated_at'),
+            siblings_updated_at=included_aggregate(
+                Quest.objects.filter(adventure=OuterRef('adventure')), 'adventure', Max('updated_at')
+            ),
+            sibling_count=included_aggregate(
+                Quest.objects.filter(adventure=OuterRef('adventure')), 'adventure', Count('pk')
+            ),
+        )
+        .values(
+            'updated_at', 'adventure_updated_at', 'adventure_position', 'adventures_updated_at',
+            'character_updated_at', 'siblings_updated_at', 'sibling_count',
+        )
+        .first()
+    )
+    if row is None:
+        return None
+    last_modified = latest(
+        row['updated_at'], row['adventure_updated_at'], row['adventures_updated_at'],
+        row['character_updated_at'], row['siblings_updated_at'],
+    )
+    return make_etag('quest', pk, row['adventure_position'], row['sibling_count'], last_modified), last_modified
+
+
+def conditional(compute):
+    """
+    Build a view decorator answering If-None-Match / If-Modified-Since with a 304
+    before the view runs. compute(**kwargs) returns (etag, last_modified), or None
+    when the object doesn't exist so the view can return its 404.
+    """
+    def validators(request, **kwargs):
+        # condition() asks for the ETag and Last-Modified separately; compute them once
+        if not hasattr(request, '_storyline_validators'):
+            request._storyline_validators = compute(**kwargs)
+        return request._storyline_validators
+
+    def etag_func(request, *args, **kwargs):
+        result = validators(request, **kwargs)
+        return result[0] if result else None
+
+    def last_modified_func(request, *args, **kwargs):
+        result = validators(request, **kwargs)
+        return result[1] if result else None
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
+
+
+catalog_condition = conditional(catalog_validators)
+adventure_condition = conditional(adventure_validators)
+quest_condition = conditional(quest_validators)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.storyline.cache import bump_catalog_version
+from apps.storyline.models import Story, Adventure, Quest
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite story, adventure and quest order numbers to 1..n and respace their order keys. "
+        "Refreshes the stored *_num snapshots in sparse mode and must run before switching back to dense mode."
+    )
+
+    def handle(self, *args, **options):
+        rows = 0
+        with transaction.atomic():
+            rows += Story.ordering_manager().rebalance()
+        for story_id in Story.objects.values_list('pk', flat=True):
+            with transaction.atomic():
+                rows += Adventure.ordering_manager().rebalance(story_id)
+        for adventure_id in Adventure.objects.values_list('pk', flat=True):
+            with transaction.atomic():
+                rows += Quest.ordering_manager().rebalance(adventure_id)
+        # QuerySet.update() bypasses the signals that invalidate the cached catalog
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebalanced {rows} rows."))
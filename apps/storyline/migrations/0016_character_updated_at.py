@@ -0,0 +1,20 @@
+# Generated by Django 4.2.15 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storyline', '0015_alter_quest_character'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
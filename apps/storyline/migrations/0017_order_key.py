@@ -0,0 +1,40 @@
+# Generated by Django 4.2.15 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+ORDER_KEY_GAP = 1024
+
+
+def populate_order_keys(apps, schema_editor):
+    # Mirror the dense order numbers so both ordering modes agree on existing rows
+    for model_name, num_field in (('Story', 'story_num'), ('Adventure', 'adventure_num'), ('Quest', 'quest_num')):
+        model = apps.get_model('storyline', model_name)
+        model.objects.filter(include=True, **{f'{num_field}__isnull': False}).update(
+            order_key=models.F(num_field) * ORDER_KEY_GAP
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storyline', '0016_character_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adventure',
+            name='order_key',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='quest',
+            name='order_key',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='order_key',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_order_keys, migrations.RunPython.noop),
+    ]
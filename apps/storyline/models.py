@@ -1,20 +1,33 @@
+from django.conf import settings
 from django.db import models
 from django.db import transaction
+from django.db.models.functions import Coalesce, RowNumber
+from django.dispatch import Signal
+from django.utils import timezone
+
+# Distance between consecutive order keys, leaving room for moves between neighbours
+ORDER_KEY_GAP = 1024
+
+# Sent once per bulk reorder with the model as sender and parent_id / pks as arguments,
+# since the single UPDATE bypasses post_save for the reordered rows
+ordering_changed = Signal()
 
 class OrderingManager:
+    """
+    Dense ordering: the included siblings always hold 1..n in their *_num field,
+    so inserts, moves and deletes shift every sibling in between. order_key is
+    kept equal to *_num * ORDER_KEY_GAP so the sparse mode can take over at any time.
+    """
     def __init__(self, model):
         self.model = model
 
     def insert(self, instance):
         if not instance.include:
             setattr(instance, instance.num_field_name, None)
+            instance.order_key = None
             return
 
         num_field = instance.num_field_name
-        parent_field = instance.parent_field_name
-
-        # Get parent instance if applicable
-        parent = getattr(instance, parent_field, None) if parent_field else None
 
         if getattr(instance, num_field) is None:
             # Assign next available order number if not specified
@@ -23,7 +36,8 @@ class OrderingManager:
         else:
             # Shift order numbers to make room for the new instance
             order = getattr(instance, num_field)
-            self.get_siblings(instance).filter(**{f"{num_field}__gte": order}).update(**{num_field: models.F(num_field) + 1})
+            self.get_siblings(instance).filter(**{f"{num_field}__gte": order}).update(**self.shifted(num_field, 1))
+        instance.order_key = getattr(instance, num_field) * ORDER_KEY_GAP
 
     def update(self, instance, old_order, old_include):
         num_field = instance.num_field_name
@@ -37,6 +51,7 @@ class OrderingManager:
             # Include changed from True to False, need to remove from ordering
             self.delete(instance)
             setattr(instance, num_field, None)
+            instance.order_key = None
         elif new_include:
             # Regular update
             if old_order == new_order:
@@ -48,16 +63,18 @@ class OrderingManager:
                 siblings.filter(**{
                     f"{num_field}__gt": old_order,
                     f"{num_field}__lte": new_order
-                }).update(**{num_field: models.F(num_field) - 1})
+                }).update(**self.shifted(num_field, -1))
             else:
                 # Increment order numbers of intervening instances
                 siblings.filter(**{
                     f"{num_field}__lt": old_order,
                     f"{num_field}__gte": new_order
-                }).update(**{num_field: models.F(num_field) + 1})
+                }).update(**self.shifted(num_field, 1))
+            instance.order_key = new_order * ORDER_KEY_GAP
         else:
             # New include is False; set order number to None
             setattr(instance, num_field, None)
+            instance.order_key = None
 
     def delete(self, instance):
         num_field = instance.num_field_name
@@ -65,28 +82,289 @@ class OrderingManager:
         if order is None:
             return
         # Decrement order numbers of instances that come after the deleted one
-        self.get_siblings(instance).filter(**{f"{num_field}__gt": order}).update(**{num_field: models.F(num_field) - 1})
+        self.get_siblings(instance).filter(**{f"{num_field}__gt": order}).update(**self.shifted(num_field, -1))
+
+    def shifted(self, num_field, step):
+        # Shift the order number and its mirrored order key in the same statement
+        return {
+            num_field: models.F(num_field) + step,
+            'order_key': (models.F(num_field) + step) * ORDER_KEY_GAP,
+            # update() skips auto_now, but ETags and Last-Modified rely on it
+            'updated_at': timezone.now(),
+        }
 
     def get_siblings(self, instance):
         parent_field = instance.parent_field_name
+        parent_id = getattr(instance, f"{parent_field}_id") if parent_field else None
+        return self.siblings_of(parent_id)
+
+    def siblings_of(self, parent_id=None):
+        parent_field = self.model.parent_field_name
         if parent_field:
-            parent = getattr(instance, parent_field)
-            return self.model.objects.filter(**{parent_field: parent, 'include': True})
+            return self.model.objects.filter(**{f"{parent_field}_id": parent_id, 'include': True})
         else:
             return self.model.objects.filter(include=True)
 
+    def sort_fields(self):
+        return (self.model.num_field_name,)
+
+    def with_positions(self, queryset):
+        # The stored order numbers are already dense
+        return queryset
+
+    def position_expression(self, prefix=''):
+        # The position of the row (or of the related row at prefix, e.g. 'adventure__')
+        return models.F(f"{prefix}{self.model.num_field_name}")
+
+    def position_of(self, instance):
+        return getattr(instance, instance.num_field_name)
+
+    def rebalance(self, parent_id=None):
+        """
+        Rewrite the order numbers and keys of a sibling set to 1..n in its current
+        order, in a single UPDATE.
+        """
+        pks = list(self.siblings_of(parent_id).order_by(*self.sort_fields(), 'pk').values_list('pk', flat=True))
+        self.apply_order(pks)
+        return len(pks)
+
+    def bulk_reorder(self, parent, pks):
+        """
+        Apply a complete new ordering to the included children of parent (None for
+        stories) with one locking SELECT and one UPDATE, whatever the number of rows.
+        pks must list every included sibling exactly once.
+        """
+        parent_id = parent.pk if parent is not None else None
+        pks = list(pks)
+        with transaction.atomic():
+            current = set(self.siblings_of(parent_id).select_for_update().values_list('pk', flat=True))
+            if len(pks) != len(set(pks)) or set(pks) != current:
+                raise ValueError("The new order must list every included sibling exactly once.")
+            self.apply_order(pks)
+            ordering_changed.send(sender=self.model, parent_id=parent_id, pks=pks)
+
+    def apply_order(self, pks):
+        if not pks:
+            return 0
+        num_field = self.model.num_field_name
+        nums = [models.When(pk=pk, then=models.Value(position)) for position, pk in enumerate(pks, start=1)]
+        keys = [models.When(pk=pk, then=models.Value(position * ORDER_KEY_GAP)) for position, pk in enumerate(pks, start=1)]
+        return self.model.objects.filter(pk__in=pks).update(**{
+            num_field: models.Case(*nums, output_field=models.IntegerField()),
+            'order_key': models.Case(*keys, output_field=models.BigIntegerField()),
+            # update() skips auto_now, but ETags and Last-Modified rely on it
+            'updated_at': timezone.now(),
+        })
+
+
+class SparseOrderingManager(OrderingManager):
+    """
+    Gap-based ordering: siblings are sorted by order_key, and inserts or moves
+    pick a key between the new neighbours, so only the moved row is written.
+    *_num is only a snapshot taken at write time or by rebalance(); the dense
+    position exposed to clients is computed at read time.
+    """
+    def insert(self, instance):
+        if not instance.include:
+            setattr(instance, instance.num_field_name, None)
+            instance.order_key = None
+            return
+        self.place(instance, getattr(instance, instance.num_field_name))
+
+    def update(self, instance, old_order, old_include):
+        num_field = instance.num_field_name
+        if not instance.include:
+            setattr(instance, num_field, None)
+            instance.order_key = None
+        elif not old_include or instance.order_key is None:
+            self.insert(instance)
+        else:
+            # old_order is the stored snapshot, which moves of siblings leave stale: a
+            # requested number is compared with where the row actually is
+            requested = getattr(instance, num_field)
+            if requested != old_order or instance.__dict__.get('_num_assigned', False):
+                if requested != self.live_position(instance):
+                    self.place(instance, requested)
+
+    def delete(self, instance):
+        # Gaps are harmless, nothing to renumber
+        pass
+
+    def live_position(self, instance):
+        # Where the row sits now, by its stored key, among its included siblings
+        before = models.Q(order_key__lt=instance.order_key) | models.Q(order_key=instance.order_key, pk__lt=instance.pk)
+        return self.get_siblings(instance).exclude(pk=instance.pk).filter(before).count() + 1
+
+    def place(self, instance, position):
+        num_field = instance.num_field_name
+        siblings = self.get_siblings(instance).exclude(pk=instance.pk)
+
+        if position is None or position < 1:
+            # Append after the last sibling
+            last = siblings.aggregate(key=models.Max('order_key'), count=models.Count('pk'))
+            instance.order_key = (last['key'] or 0) + ORDER_KEY_GAP
+            setattr(instance, num_field, last['count'] + 1)
+            return
+
+        keys = siblings.order_by(*self.sort_fields()).values_list('order_key', flat=True)
+        if position == 1:
+            window = list(keys[:1])
+            before, after = None, (window[0] if window else None)
+        else:
+            window = list(keys[position - 2:position])
+            if not window:
+                # Past the end of the list
+                return self.place(instance, None)
+            before, after = window[0], (window[1] if len(window) > 1 else None)
+
+        if after is None:
+            key = (before or 0) + ORDER_KEY_GAP
+        elif before is None:
+            key = after - ORDER_KEY_GAP
+        elif after - before > 1:
+            key = (before + after) // 2
+        else:
+            # No room left between the neighbours; spread the siblings out and retry
+            self.rebalance(getattr(instance, f"{instance.parent_field_name}_id") if instance.parent_field_name else None)
+            return self.place(instance, position)
+
+        instance.order_key = key
+        setattr(instance, num_field, position)
+
+    def sort_fields(self):
+        return ('order_key', 'pk')
+
+    def with_positions(self, queryset):
+        parent_field = self.model.parent_field_name
+        return queryset.annotate(dense_num=models.Window(
+            RowNumber(),
+            partition_by=[models.F(parent_field)] if parent_field else None,
+            order_by=[models.F('order_key').asc(), models.F('pk').asc()],
+        ))
+
+    def position_expression(self, prefix=''):
+        # One indexed count of the included siblings with a smaller key, for querysets
+        # that don't hold every sibling (with_positions() numbers the rows it returns)
+        parent_field = self.model.parent_field_name
+        siblings = self.model._base_manager.filter(include=True, order_key__lt=models.OuterRef(f"{prefix}order_key"))
+        if parent_field:
+            siblings = siblings.filter(**{f"{parent_field}_id": models.OuterRef(f"{prefix}{parent_field}_id")})
+        before = siblings.order_by().annotate(count=models.Func(models.F('pk'), function='COUNT')).values('count')
+        return models.Case(
+            models.When(
+                models.Q(**{f"{prefix}include": True, f"{prefix}order_key__isnull": False}),
+                then=Coalesce(models.Subquery(before), 0) + 1,
+            ),
+            default=None,
+            output_field=models.IntegerField(),
+        )
+
+    def position_of(self, instance):
+        # A query per object would make every serialized list an N+1
+        raise RuntimeError(
+            f"{self.model.__name__} positions are computed at read time in sparse ordering mode; "
+            f"load it with with_positions() or with_counted_positions()"
+        )
+
+
+class OrderedQuerySet(models.QuerySet):
+    def in_order(self):
+        return self.order_by(*self.model.ordering_manager().sort_fields())
+
+    def with_positions(self):
+        # Annotate the dense 1-based position of each row among its included siblings,
+        # which must all be in the queryset
+        return self.model.ordering_manager().with_positions(self)
+
+    def with_counted_positions(self):
+        # Same, for querysets holding only some of the siblings, e.g. a single object
+        return self.annotate(dense_num=self.model.ordering_manager().position_expression())
+
+
+class OrderedModelManager(models.Manager):
+    def get_queryset(self):
+        # Meta.ordering sorts by *_num, which sparse ordering mode doesn't keep current
+        return super().get_queryset().in_order()
+
+
 class OrderedModel(models.Model):
     include = models.BooleanField(default=True)
+    order_key = models.BigIntegerField(null=True, blank=True, db_index=True, editable=False)
     num_field_name = None
     parent_field_name = None
 
     class Meta:
         abstract = True
 
+    @classmethod
+    def ordering_manager(cls):
+        if settings.STORYLINE_ORDERING_MODE == 'sparse':
+            return SparseOrderingManager(cls)
+        return OrderingManager(cls)
+
+    @property
+    def position(self):
+        """
+        Dense 1-based position among the included siblings, as exposed to clients.
+        In sparse ordering mode the object must have been loaded with with_positions()
+        or with_counted_positions().
+        """
+        if 'dense_num' in self.__dict__:
+            return self.dense_num
+        return self.ordering_manager().position_of(self)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the ordering state as loaded so saves that don't touch it can skip the ordering work
+        loaded = dict(zip(field_names, values))
+        if cls.num_field_name in loaded and 'include' in loaded:
+            instance._loaded_ordering = (loaded[cls.num_field_name], loaded['include'])
+        return instance
+
+    def __setattr__(self, name, value):
+        # In sparse ordering mode the loaded *_num is a snapshot that may be stale, so
+        # assigning the same number can still be a move; remember assignments after load
+        if name == self.num_field_name and '_loaded_ordering' in self.__dict__:
+            self.__dict__['_num_assigned'] = True
+        super().__setattr__(name, value)
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or {self.num_field_name, 'include'} <= set(fields):
+            self._loaded_ordering = self.current_ordering()
+            self._num_assigned = False
+
+    def current_ordering(self):
+        return (getattr(self, self.num_field_name), self.include)
+
     def save(self, *args, **kwargs):
+        is_new = self._state.adding
+        loaded = getattr(self, '_loaded_ordering', None)
+        maybe_moved = settings.STORYLINE_ORDERING_MODE == 'sparse' and self.__dict__.get('_num_assigned', False)
+
+        ordering_fields = {self.num_field_name, 'include', 'order_key'}
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            other_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ordering_fields
+            ]
+        else:
+            other_fields = [name for name in update_fields if name not in ordering_fields]
+
+        # Saves of only ordering fields take the full path below, since an empty update_fields
+        # would skip the save and its signals; an explicitly empty one is Django's no-op
+        if (not is_new and loaded is not None and loaded == self.current_ordering() and not maybe_moved
+                and (other_fields or not update_fields)):
+            # Ordering is unchanged since load: skip the re-read and the sibling updates, and leave the
+            # ordering columns alone in case siblings were moved by someone else in the meantime
+            kwargs['update_fields'] = other_fields
+            super().save(*args, **kwargs)
+            return
+
         with transaction.atomic():
-            is_new = self._state.adding
-            ordering_manager = OrderingManager(self.__class__)
+            ordering_manager = self.ordering_manager()
 
             if is_new:
                 # Handle insertion
@@ -99,13 +377,31 @@ class OrderedModel(models.Model):
                 ordering_manager.update(self, old_order, old_include)
 
             super().save(*args, **kwargs)
+        self._loaded_ordering = self.current_ordering()
+        self._num_assigned = False
 
     def delete(self, *args, **kwargs):
         with transaction.atomic():
-            ordering_manager = OrderingManager(self.__class__)
+            ordering_manager = self.ordering_manager()
             ordering_manager.delete(self)
             super().delete(*args, **kwargs)
 
+class StoryQuerySet(OrderedQuerySet):
+    def with_adventures(self):
+        # Prefetch the included adventures (and their quests) of every story in order
+        adventures = Adventure.objects.filter(include=True).in_order().with_positions().with_quests()
+        return self.prefetch_related(
+            models.Prefetch('adventures', queryset=adventures, to_attr='included_adventures')
+        )
+
+class AdventureQuerySet(OrderedQuerySet):
+    def with_quests(self):
+        # Prefetch the included quests of every adventure in order
+        quests = Quest.objects.filter(include=True).in_order().with_positions()
+        return self.prefetch_related(
+            models.Prefetch('quests', queryset=quests, to_attr='included_quests')
+        )
+
 class Story(OrderedModel):
     num_field_name = 'story_num'
     parent_field_name = None
@@ -116,6 +412,8 @@ class Story(OrderedModel):
     include = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OrderedModelManager.from_queryset(StoryQuerySet)()
   
     class Meta:
         ordering = ['story_num']
@@ -135,6 +433,8 @@ class Adventure(OrderedModel):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderedModelManager.from_queryset(AdventureQuerySet)()
+
     class Meta:
         ordering = ['adventure_num']
 
@@ -156,6 +456,7 @@ class Character(models.Model):
     name = models.CharField(max_length=255) # actual name of the character
     description = models.TextField()
     voice = models.CharField(max_length=255, choices=VOICE_CHOICES, default='alloy')
+    updated_at = models.DateTimeField(auto_now=True)
 
     # There could be so many more things, attributes, demographic, skills, backstory, etc.
 
@@ -180,6 +481,8 @@ class Quest(OrderedModel):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderedModelManager.from_queryset(OrderedQuerySet)()
+
     class Meta:
         ordering = ['quest_num']
 
@@ -1,38 +1,47 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Character, Quest, Objectives
-from apps.assistants.models import Assistant
+from django.utils import timezone
+from .cache import bump_catalog_version
+from .models import Story, Adventure, Character, Quest, Objectives, ordering_changed
+from apps.assistants.models import Assistant, AssistantSyncJob
+
+# Any change to the catalog tree invalidates the cached storyline payload once the transaction commits
+@receiver([post_save, post_delete], sender=Story)
+@receiver([post_save, post_delete], sender=Adventure)
+@receiver([post_save, post_delete], sender=Quest)
+@receiver([post_save, post_delete], sender=Objectives)
+def invalidate_catalog_on_change(sender, instance, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+# A bulk reorder is a single change notification, however many rows moved
+@receiver(ordering_changed)
+def invalidate_catalog_on_reorder(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+# Objectives have no timestamp of their own, so their changes touch the quest for ETag/Last-Modified
+@receiver([post_save, post_delete], sender=Objectives)
+def touch_quest_on_objectives_change(sender, instance, **kwargs):
+    Quest.objects.filter(pk=instance.quest_id).update(updated_at=timezone.now())
+
+# Content changes only mark the affected assistants dirty; the outbox folds repeated marks
+# into one pending sync per assistant
 
 @receiver(post_save, sender=Character)
 def update_assistants_on_character_change(sender, instance, **kwargs):
-    # Find all Quests associated with this Character
-    quests = instance.quests.all()
-    # Find all Assistants associated with these Quests
-    assistants = Assistant.objects.filter(quest__in=quests)
-    for assistant in assistants:
-        assistant.save()
+    # Find all Assistants on the Quests of this Character
+    assistant_ids = Assistant.objects.filter(quest__character=instance).values_list('pk', flat=True)
+    AssistantSyncJob.objects.enqueue(assistant_ids)
 
 @receiver(post_save, sender=Quest)
 def update_assistants_on_quest_change(sender, instance, **kwargs):
-    try:
-        assistant = Assistant.objects.get(quest=instance)
-        assistant.save()  # Update the assistant
-    except Assistant.DoesNotExist:
-        pass 
+    AssistantSyncJob.objects.enqueue(Assistant.objects.filter(quest=instance).values_list('pk', flat=True))
 
 @receiver(post_save, sender=Objectives)
 def update_assistants_on_objectives_change(sender, instance, **kwargs):
-    try:
-        assistant = Assistant.objects.get(quest=instance.quest)
-        assistant.save()  # Update the assistant
-    except Assistant.DoesNotExist:
-        pass 
+    AssistantSyncJob.objects.enqueue(Assistant.objects.filter(quest_id=instance.quest_id).values_list('pk', flat=True))
 
 # Deleting objectives can also affect the assistant
 @receiver(post_delete, sender=Objectives)
 def update_assistants_on_objectives_delete(sender, instance, **kwargs):
-    try:
-        assistant = Assistant.objects.get(quest=instance.quest)
-        assistant.save()
-    except Assistant.DoesNotExist:
-        pass
\ No newline at end of file
+    AssistantSyncJob.objects.enqueue(Assistant.objects.filter(quest_id=instance.quest_id).values_list('pk', flat=True))
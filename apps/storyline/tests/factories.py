@@ -0,0 +1,26 @@
+"""
+Catalog rows that the storyline and assistants tests build over and over.
+"""
+from apps.storyline.models import Story, Adventure, Quest, Character
+
+
+def create_adventure():
+    story = Story.objects.create(title="Main Story", description="Main Story Description")
+    return Adventure.objects.create(title="Main Adventure", description="Main Adventure Description", story=story)
+
+
+def create_quests(count, adventure=None, character=None):
+    """
+    Quest 1 to Quest <count>, numbered in turn by OrderedModel.save, all played by the
+    Hero. They go in a new adventure of a new story unless one is given.
+    """
+    adventure = adventure or create_adventure()
+    character = character or Character.objects.create(name="Hero", description="Brave hero")
+    return [
+        Quest.objects.create(title=f"Quest {n}", description="Quest", adventure=adventure, character=character)
+        for n in range(1, count + 1)
+    ]
+
+
+def create_quest(**kwargs):
+    return create_quests(1, **kwargs)[0]
@@ -0,0 +1,424 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from rest_framework.test import APIClient
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from apps.storyline.api.v1.views import StoryListView
+from apps.storyline.api.v1.serializers.detail_serializers import AdventureDetailSerializer, QuestDetailSerializer
+from apps.storyline.cache import get_catalog_version
+from apps.storyline.models import Story, Adventure, Quest, Character, Objectives, ordering_changed
+from apps.storyline.tests.factories import create_adventure, create_quest, create_quests
+from apps.assistants.models import GeneralInstructions, QuestInstructions, Assistant, QuestAssistant
+
+User = get_user_model()
+
+STORIES = 50
+ADVENTURES_PER_STORY = 10
+QUESTS_PER_ADVENTURE = 10
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # The locmem cache outlives the per-test database rollback
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def api_client():
+    user = User.objects.create_user(username="reader", email="reader@example.com", password="password123")
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+@pytest.fixture
+def catalog():
+    # Bulk create the catalog with explicit order numbers, bypassing OrderedModel.save
+    character = Character.objects.create(name="Hero", description="Brave hero")
+    stories = Story.objects.bulk_create([
+        Story(title=f"Story {s}", description="Story", story_num=s)
+        for s in range(1, STORIES + 1)
+    ])
+    adventures = Adventure.objects.bulk_create([
+        Adventure(title=f"Adventure {story.story_num}.{a}", description="Adventure", story=story, adventure_num=a)
+        for story in stories
+        for a in range(1, ADVENTURES_PER_STORY + 1)
+    ])
+    Quest.objects.bulk_create([
+        Quest(
+            title=f"Quest {adventure.title}.{q}",
+            description="Quest",
+            adventure=adventure,
+            character=character,
+            quest_num=q,
+        )
+        for adventure in adventures
+        for q in range(1, QUESTS_PER_ADVENTURE + 1)
+    ])
+    # Excluded rows must not show up in the tree
+    Adventure.objects.create(title="Hidden Adventure", description="Hidden", story=stories[0], include=False)
+    Quest.objects.create(title="Hidden Quest", description="Hidden", adventure=adventures[0], character=character, include=False)
+    return stories
+
+
+@pytest.fixture
+def quest(db):
+    return create_quest()
+
+
+@pytest.mark.django_db
+class TestStoryListView:
+
+    def test_story_list_query_count_is_constant(self, api_client, catalog, django_assert_num_queries):
+        # Stories, adventures and quests are each aggregated for the validators and loaded with a single query
+        with django_assert_num_queries(6):
+            response = api_client.get('/api/v1/storyline/')
+
+        assert response.status_code == 200
+        stories = response.data['stories']
+        assert len(stories) == STORIES
+        assert all(len(story['adventures']) == ADVENTURES_PER_STORY for story in stories)
+        assert all(
+            len(adventure['quests']) == QUESTS_PER_ADVENTURE
+            for story in stories
+            for adventure in story['adventures']
+        )
+
+    def test_story_list_is_ordered(self, api_client, catalog):
+        response = api_client.get('/api/v1/storyline/')
+
+        stories = response.data['stories']
+        assert [story['story_num'] for story in stories] == list(range(1, STORIES + 1))
+        adventures = stories[0]['adventures']
+        assert [adventure['adventure_num'] for adventure in adventures] == list(range(1, ADVENTURES_PER_STORY + 1))
+        quests = adventures[0]['quests']
+        assert [quest['quest_num'] for quest in quests] == list(range(1, QUESTS_PER_ADVENTURE + 1))
+
+
+@pytest.mark.django_db
+class TestStoryListCache:
+
+    def test_cached_catalog_costs_no_queries(self, api_client, quest, django_assert_num_queries):
+        first = api_client.get('/api/v1/storyline/')
+
+        with django_assert_num_queries(0):
+            second = api_client.get('/api/v1/storyline/')
+
+        assert second.data == first.data
+
+    def test_quest_change_invalidates_catalog(self, api_client, quest, django_capture_on_commit_callbacks):
+        api_client.get('/api/v1/storyline/')
+        version = get_catalog_version()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            quest.title = "Renamed Quest"
+            quest.save()
+
+        assert get_catalog_version() != version
+        response = api_client.get('/api/v1/storyline/')
+        assert response.data['stories'][0]['adventures'][0]['quests'][0]['title'] == "Renamed Quest"
+
+    def test_story_delete_invalidates_catalog(self, api_client, quest, django_capture_on_commit_callbacks):
+        api_client.get('/api/v1/storyline/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            quest.adventure.story.delete()
+
+        response = api_client.get('/api/v1/storyline/')
+        assert response.data['stories'] == []
+
+    def test_objectives_change_bumps_version(self, quest, django_capture_on_commit_callbacks):
+        version = get_catalog_version()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            objective = Objectives.objects.create(quest=quest, objective="Find the treasure")
+        assert get_catalog_version() != version
+
+        version = get_catalog_version()
+        with django_capture_on_commit_callbacks(execute=True):
+            objective.delete()
+        assert get_catalog_version() != version
+
+    def test_uncommitted_change_keeps_version(self, quest):
+        version = get_catalog_version()
+
+        quest.title = "Renamed Quest"
+        quest.save()
+
+        # The bump waits for the surrounding transaction to commit
+        assert get_catalog_version() == version
+
+
+@pytest.mark.django_db
+class TestConditionalRequests:
+
+    def test_storyline_not_modified(self, api_client, quest):
+        response = api_client.get('/api/v1/storyline/')
+        assert response.status_code == 200
+        assert response['Last-Modified']
+        etag = response['ETag']
+
+        with patch.object(StoryListView, 'serialize_catalog', side_effect=AssertionError("serialized")):
+            response = api_client.get('/api/v1/storyline/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+
+    def test_storyline_etag_changes_with_catalog(self, api_client, quest, django_capture_on_commit_callbacks):
+        etag = api_client.get('/api/v1/storyline/')['ETag']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            quest.delete()
+
+        response = api_client.get('/api/v1/storyline/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_adventure_not_modified(self, api_client, quest):
+        url = f'/api/v1/adventure/{quest.adventure.pk}/'
+        etag = api_client.get(url)['ETag']
+
+        with patch.object(AdventureDetailSerializer, 'to_representation', side_effect=AssertionError("serialized")):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == 304
+
+    def test_adventure_etag_changes_with_sibling_quest(self, api_client, quest):
+        url = f'/api/v1/adventure/{quest.adventure.pk}/'
+        etag = api_client.get(url)['ETag']
+
+        Quest.objects.create(title="Quest Two", description="Second Quest", adventure=quest.adventure, character=quest.character)
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_quest_not_modified(self, api_client, quest):
+        url = f'/api/v1/quest/{quest.pk}/'
+        response = api_client.get(url)
+        etag = response['ETag']
+
+        with patch.object(QuestDetailSerializer, 'to_representation', side_effect=AssertionError("serialized")):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 304
+            response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            assert response.status_code == 304
+
+    def test_quest_etag_changes_with_objectives(self, api_client, quest):
+        url = f'/api/v1/quest/{quest.pk}/'
+        etag = api_client.get(url)['ETag']
+
+        Objectives.objects.create(quest=quest, objective="Find the treasure")
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.data['quest']['objectives'][0]['objective'] == "Find the treasure"
+
+    @pytest.mark.parametrize('mode', ['dense', 'sparse'])
+    def test_quest_etag_changes_when_its_adventure_moves(self, api_client, quest, settings, mode):
+        settings.STORYLINE_ORDERING_MODE = mode
+        first = Adventure.objects.create(title="First Adventure", description="First", story=quest.adventure.story, adventure_num=1)
+        url = f'/api/v1/quest/{quest.pk}/'
+        response = api_client.get(url)
+        assert response.data['quest']['adventure']['adventure_num'] == 2
+
+        # Only the sibling is saved; the quest's adventure is shifted or keeps its key
+        first.adventure_num = 2
+        first.save()
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 200
+        assert response.data['quest']['adventure']['adventure_num'] == 1
+
+    @pytest.mark.parametrize('mode', ['dense', 'sparse'])
+    def test_adventure_etag_changes_when_its_story_moves(self, api_client, quest, settings, mode):
+        settings.STORYLINE_ORDERING_MODE = mode
+        first = Story.objects.create(title="First Story", description="First", story_num=1)
+        url = f'/api/v1/adventure/{quest.adventure.pk}/'
+        response = api_client.get(url)
+        assert response.data['adventure']['story']['story_num'] == 2
+
+        first.story_num = 2
+        first.save()
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 200
+        assert response.data['adventure']['story']['story_num'] == 1
+
+    def test_missing_quest_still_404(self, api_client):
+        response = api_client.get('/api/v1/quest/999/', HTTP_IF_NONE_MATCH='"anything"')
+        assert response.status_code == 404
+
+
+@pytest.mark.django_db
+class TestQuestDetailView:
+
+    @pytest.fixture
+    def quest(self):
+        quests = create_quests(5)
+        for n in range(3):
+            Objectives.objects.create(quest=quests[0], objective=f"Objective {n}")
+        return quests[0]
+
+    def test_quest_detail_query_count(self, api_client, quest, django_assert_num_queries):
+        general_instructions = GeneralInstructions.objects.create(name="General", instructions="General Instructions")
+        quest_instructions = QuestInstructions.objects.create(quest=quest, name="Quest Specific", instructions="Quest Instructions")
+        assistant = Assistant.objects.create(
+            quest=quest,
+            quest_instructions=quest_instructions,
+            general_instructions=general_instructions,
+            name="Test Assistant",
+            openai_assistant_id="asst_existing_id",
+        )
+        QuestAssistant.objects.create(quest=quest, assistant=assistant)
+
+        # One query for the validators, one for the quest with its joins, one each for siblings and objectives
+        with django_assert_num_queries(4):
+            response = api_client.get(f'/api/v1/quest/{quest.pk}/')
+
+        data = response.data['quest']
+        assert data['assistant_id'] == "asst_existing_id"
+        assert data['character']['name'] == "Hero"
+        assert [objective['objective'] for objective in data['objectives']] == ["Objective 0", "Objective 1", "Objective 2"]
+        assert [sibling['quest_num'] for sibling in data['adventure']['quests']] == [1, 2, 3, 4, 5]
+
+    def test_quest_detail_without_assistant(self, api_client, quest):
+        response = api_client.get(f'/api/v1/quest/{quest.pk}/')
+
+        assert response.status_code == 200
+        assert response.data['quest']['assistant_id'] is None
+
+
+@pytest.mark.django_db
+class TestSparseOrderingApi:
+
+    @pytest.fixture(autouse=True)
+    def sparse_mode(self, settings):
+        settings.STORYLINE_ORDERING_MODE = 'sparse'
+
+    def test_positions_are_dense_after_moves(self, api_client):
+        quests = create_quests(4)
+        quests[3].quest_num = 1
+        quests[3].save()
+        quests[1].delete()
+
+        response = api_client.get('/api/v1/storyline/')
+        listed = response.data['stories'][0]['adventures'][0]['quests']
+        assert [(quest['title'], quest['quest_num']) for quest in listed] == [
+            ("Quest 4", 1), ("Quest 1", 2), ("Quest 3", 3),
+        ]
+
+        response = api_client.get(f'/api/v1/quest/{quests[2].pk}/')
+        assert response.data['quest']['quest_num'] == 3
+        assert [quest['quest_num'] for quest in response.data['quest']['adventure']['quests']] == [1, 2, 3]
+        assert response.data['quest']['adventure']['adventure_num'] == 1
+
+    def test_detail_positions_after_moves(self, api_client):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(1, 4)]
+        adventures = [
+            Adventure.objects.create(title=f"Adventure {n}", description="Adventure", story=stories[2]) for n in range(1, 4)
+        ]
+        stories[2].story_num = 1
+        stories[2].save()
+        adventures[0].adventure_num = 3
+        adventures[0].save()
+
+        response = api_client.get(f'/api/v1/adventure/{adventures[0].pk}/')
+
+        assert response.data['adventure']['adventure_num'] == 3
+        assert response.data['adventure']['story']['story_num'] == 1
+
+
+@pytest.mark.django_db
+class TestBulkReorder:
+
+    @pytest.fixture
+    def staff_client(self):
+        user = User.objects.create_user(username="staff", email="staff@example.com", password="password123", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client
+
+    def make_quests(self, count):
+        adventure = create_adventure()
+        character = Character.objects.create(name="Hero", description="Brave hero")
+        Quest.objects.bulk_create([
+            Quest(title=f"Quest {n}", description="Quest", adventure=adventure, character=character, quest_num=n, order_key=n * 1024)
+            for n in range(1, count + 1)
+        ])
+        return adventure, list(Quest.objects.filter(adventure=adventure).order_by('quest_num').values_list('pk', flat=True))
+
+    @pytest.mark.parametrize("count", [10, 200])
+    def test_statement_count_is_constant(self, count):
+        adventure, pks = self.make_quests(count)
+        new_order = list(reversed(pks))
+
+        with CaptureQueriesContext(connection) as queries:
+            Quest.ordering_manager().bulk_reorder(adventure, new_order)
+
+        statements = [query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+        assert len(statements) == 2
+        assert list(Quest.objects.filter(adventure=adventure).order_by('quest_num').values_list('pk', flat=True)) == new_order
+
+    def test_sends_one_notification(self):
+        adventure, pks = self.make_quests(5)
+        post_save_receiver, ordering_receiver = MagicMock(), MagicMock()
+        post_save.connect(post_save_receiver, sender=Quest)
+        ordering_changed.connect(ordering_receiver, sender=Quest)
+        try:
+            Quest.ordering_manager().bulk_reorder(adventure, list(reversed(pks)))
+        finally:
+            post_save.disconnect(post_save_receiver, sender=Quest)
+            ordering_changed.disconnect(ordering_receiver, sender=Quest)
+
+        post_save_receiver.assert_not_called()
+        ordering_receiver.assert_called_once()
+        assert ordering_receiver.call_args.kwargs['parent_id'] == adventure.pk
+
+    def test_rejects_incomplete_order(self):
+        adventure, pks = self.make_quests(3)
+
+        with pytest.raises(ValueError):
+            Quest.ordering_manager().bulk_reorder(adventure, pks[:2])
+        with pytest.raises(ValueError):
+            Quest.ordering_manager().bulk_reorder(adventure, pks + [pks[0]])
+
+    def test_reorder_endpoint(self, staff_client, django_capture_on_commit_callbacks):
+        adventure, pks = self.make_quests(4)
+        version = get_catalog_version()
+        new_order = [pks[2], pks[0], pks[3], pks[1]]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = staff_client.post(f'/api/v1/adventure/{adventure.pk}/reorder/', {"order": new_order}, format='json')
+
+        assert response.status_code == 200
+        assert get_catalog_version() != version
+        assert list(Quest.objects.filter(adventure=adventure).order_by('quest_num').values_list('pk', flat=True)) == new_order
+
+    def test_reorder_stories_endpoint(self, staff_client):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(3)]
+        new_order = [story.pk for story in reversed(stories)]
+
+        response = staff_client.post('/api/v1/storyline/reorder/', {"order": new_order}, format='json')
+
+        assert response.status_code == 200
+        assert list(Story.objects.order_by('story_num').values_list('pk', flat=True)) == new_order
+
+    def test_reorder_endpoint_rejects_bad_order(self, staff_client):
+        adventure, pks = self.make_quests(3)
+
+        response = staff_client.post(f'/api/v1/adventure/{adventure.pk}/reorder/', {"order": pks[:1]}, format='json')
+
+        assert response.status_code == 400
+
+    def test_reorder_endpoint_is_staff_only(self, api_client):
+        adventure, pks = self.make_quests(3)
+
+        response = api_client.post(f'/api/v1/adventure/{adventure.pk}/reorder/', {"order": pks}, format='json')
+
+        assert response.status_code == 403
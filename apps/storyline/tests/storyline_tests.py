@@ -1,5 +1,13 @@
 import pytest
-from apps.storyline.models import Story, Adventure, Quest, Character, Objectives
+from io import StringIO
+from django.core.management import call_command
+from django.contrib.admin.sites import AdminSite
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from apps.storyline.admin import StoryAdmin
+from apps.storyline.models import ORDER_KEY_GAP, Story, Adventure, Quest, Character, Objectives
 
 @pytest.mark.django_db
 class TestOrderedModels:
@@ -337,3 +345,214 @@ class TestOrderedModels:
         # Check that adventure and quests are deleted
         assert not Adventure.objects.filter(pk=adventure.pk).exists()
         assert not Quest.objects.filter(adventure=adventure).exists()
+
+
+@pytest.mark.django_db
+class TestSparseOrdering:
+
+    @pytest.fixture(autouse=True)
+    def sparse_mode(self, settings):
+        settings.STORYLINE_ORDERING_MODE = 'sparse'
+
+    def positions(self, queryset):
+        return [(obj.title, obj.position) for obj in queryset.filter(include=True).in_order().with_positions()]
+
+    def test_move_writes_only_moved_row(self):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(1, 6)]
+        keys_before = dict(Story.objects.values_list('pk', 'order_key'))
+
+        story = stories[4]
+        story.story_num = 1
+        with CaptureQueriesContext(connection) as queries:
+            story.save()
+
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        assert len(updates) == 1
+        keys_after = dict(Story.objects.values_list('pk', 'order_key'))
+        assert {pk: key for pk, key in keys_after.items() if pk != story.pk} == {
+            pk: key for pk, key in keys_before.items() if pk != story.pk
+        }
+        assert self.positions(Story.objects) == [
+            ("Story 5", 1), ("Story 1", 2), ("Story 2", 3), ("Story 3", 4), ("Story 4", 5),
+        ]
+
+    def test_move_down(self):
+        story = Story.objects.create(title="Main Story", description="Main Story Description")
+        adventures = [Adventure.objects.create(title=f"Adventure {n}", description="Adventure", story=story) for n in range(1, 5)]
+
+        adventures[0].adventure_num = 3
+        adventures[0].save()
+
+        assert self.positions(Adventure.objects) == [
+            ("Adventure 2", 1), ("Adventure 3", 2), ("Adventure 1", 3), ("Adventure 4", 4),
+        ]
+        assert Adventure.objects.with_counted_positions().get(pk=adventures[0].pk).position == 3
+
+    def test_move_to_old_snapshot_after_another_move(self):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(1, 6)]
+        stories[4].story_num = 1
+        stories[4].save()
+
+        # Story 1's stored number is still 1, but it now sits second
+        story = Story.objects.get(pk=stories[0].pk)
+        assert story.story_num == 1
+        story.story_num = 1
+        story.save()
+        assert self.positions(Story.objects)[:2] == [("Story 1", 1), ("Story 5", 2)]
+
+        # Also from an instance loaded before the other move
+        stories[4].refresh_from_db()
+        stories[1].story_num = 2
+        stories[1].save()
+        assert self.positions(Story.objects)[:3] == [("Story 1", 1), ("Story 2", 2), ("Story 5", 3)]
+
+    def test_save_without_number_keeps_stale_row_in_place(self):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(1, 4)]
+        stories[2].story_num = 1
+        stories[2].save()
+
+        story = Story.objects.get(pk=stories[0].pk)
+        story.title = "Renamed"
+        story.save()
+
+        assert self.positions(Story.objects) == [("Story 3", 1), ("Renamed", 2), ("Story 2", 3)]
+
+    def test_admin_edits_live_position(self):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(1, 4)]
+        stories[2].story_num = 1
+        stories[2].save()
+        story_admin = StoryAdmin(Story, AdminSite())
+
+        story = story_admin.get_queryset(RequestFactory().get('/')).get(pk=stories[0].pk)
+        form = story_admin.get_form(None, story)(instance=story)
+
+        assert form.initial['story_num'] == 2
+        assert story_admin.position(story) == 2
+
+    def test_exclude_and_delete_leave_siblings_untouched(self):
+        story1 = Story.objects.create(title="Story One", description="First Story")
+        story2 = Story.objects.create(title="Story Two", description="Second Story")
+        story3 = Story.objects.create(title="Story Three", description="Third Story")
+        keys_before = dict(Story.objects.values_list('pk', 'order_key'))
+
+        story2.include = False
+        story2.save()
+        story1.delete()
+
+        story2.refresh_from_db()
+        story3.refresh_from_db()
+        assert story2.story_num is None and story2.order_key is None
+        assert story3.order_key == keys_before[story3.pk]
+        assert Story.objects.with_counted_positions().get(pk=story3.pk).position == 1
+        assert Story.objects.with_counted_positions().get(pk=story2.pk).position is None
+
+        # Re-included rows go to the end
+        story2.include = True
+        story2.save()
+        assert self.positions(Story.objects) == [("Story Three", 1), ("Story Two", 2)]
+
+    def test_exhausted_gap_rebalances(self):
+        Story.objects.create(title="First", description="Story")
+        Story.objects.create(title="Last", description="Story")
+
+        # Each insert halves the gap after "First" until the siblings must be respaced
+        for n in range(15):
+            Story.objects.create(title=f"Inserted {n}", description="Story", story_num=2)
+
+        titles = [title for title, _ in self.positions(Story.objects)]
+        assert titles == ["First"] + [f"Inserted {n}" for n in reversed(range(15))] + ["Last"]
+        assert [position for _, position in self.positions(Story.objects)] == list(range(1, 18))
+
+    def test_default_ordering_follows_order_key(self):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(1, 4)]
+        stories[2].story_num = 1
+        stories[2].save()
+
+        assert [story.title for story in Story.objects.all()] == ["Story 3", "Story 1", "Story 2"]
+
+    def test_unloaded_position_raises(self):
+        story = Story.objects.create(title="Story One", description="Story")
+        with pytest.raises(RuntimeError):
+            Story.objects.get(pk=story.pk).position
+
+    def test_rebalance_command_refreshes_numbers(self):
+        stories = [Story.objects.create(title=f"Story {n}", description="Story") for n in range(1, 4)]
+        stories[2].story_num = 1
+        stories[2].save()
+
+        call_command('rebalance_ordering', stdout=StringIO())
+
+        assert list(Story.objects.order_by('story_num').values_list('title', 'story_num', 'order_key')) == [
+            ("Story 3", 1, ORDER_KEY_GAP), ("Story 1", 2, 2 * ORDER_KEY_GAP), ("Story 2", 3, 3 * ORDER_KEY_GAP),
+        ]
+
+
+@pytest.mark.django_db
+class TestOrderedModelSaveQueries:
+
+    def test_unchanged_ordering_saves_with_one_query(self, django_assert_num_queries):
+        Story.objects.create(title="Story One", description="First Story")
+        story = Story.objects.get(title="Story One")
+
+        story.description = "Edited"
+        with django_assert_num_queries(1):
+            story.save()
+
+        story.refresh_from_db()
+        assert story.description == "Edited"
+
+    def test_changed_ordering_still_renumbers(self):
+        Story.objects.create(title="Story One", description="First Story")
+        Story.objects.create(title="Story Two", description="Second Story")
+        story = Story.objects.get(title="Story Two")
+
+        story.story_num = 1
+        story.save()
+
+        assert list(Story.objects.order_by('story_num').values_list('title', flat=True)) == ["Story Two", "Story One"]
+
+    def test_stale_copy_does_not_overwrite_ordering(self):
+        Story.objects.create(title="Story One", description="First Story")
+        Story.objects.create(title="Story Two", description="Second Story")
+        stale = Story.objects.get(title="Story One")
+
+        # Someone else moves Story Two to the front, shifting Story One to 2
+        mover = Story.objects.get(title="Story Two")
+        mover.story_num = 1
+        mover.save()
+
+        stale.description = "Edited"
+        stale.save()
+
+        assert list(Story.objects.order_by('story_num').values_list('title', 'story_num')) == [
+            ("Story Two", 1), ("Story One", 2),
+        ]
+
+    def test_saving_only_ordering_fields_still_saves(self):
+        Story.objects.create(title="Story One", description="First Story")
+        story = Story.objects.get(title="Story One")
+        saved = []
+
+        def receiver(sender, instance, update_fields, **kwargs):
+            saved.append(update_fields)
+
+        post_save.connect(receiver, sender=Story)
+        try:
+            story.save(update_fields=['story_num'])
+            story.save(update_fields=[])
+        finally:
+            post_save.disconnect(receiver, sender=Story)
+
+        # An explicitly empty update_fields is still a no-op
+        assert saved == [frozenset({'story_num'})]
+        assert Story.objects.get(pk=story.pk).story_num == 1
+
+    def test_bulk_edit_skips_ordering_work(self, django_assert_num_queries):
+        for n in range(10):
+            Story.objects.create(title=f"Story {n}", description="Story")
+        stories = list(Story.objects.all())
+
+        with django_assert_num_queries(len(stories)):
+            for story in stories:
+                story.description = "Bulk edited"
+                story.save()
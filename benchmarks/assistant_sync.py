@@ -0,0 +1,67 @@
+"""
+Assistant sync throughput against the local OpenAI stub server, by concurrency.
+
+    python -m benchmarks.assistant_sync --assistants 100 --latency 0.2 --concurrency 1 4 16
+"""
+import argparse
+
+from benchmarks.utils import benchmark_database, setup_django
+
+
+def create_assistants(count):
+    from apps.assistants.models import Assistant, GeneralInstructions, QuestInstructions
+    from apps.storyline.models import Story, Adventure, Quest, Character
+
+    general_instructions = GeneralInstructions.objects.create(name="Bench", instructions="Benchmark")
+    character = Character.objects.create(name="Bench", description="Benchmark")
+    story = Story.objects.create(title="Bench story", description="Benchmark")
+    adventure = Adventure.objects.create(title="Bench adventure", description="Benchmark", story=story)
+    for n in range(count):
+        quest = Quest.objects.create(title=f"Bench quest {n}", description="Benchmark", adventure=adventure, character=character)
+        quest_instructions = QuestInstructions.objects.create(quest=quest, name=f"Bench {n}", instructions="Benchmark")
+        Assistant(
+            quest=quest,
+            quest_instructions=quest_instructions,
+            general_instructions=general_instructions,
+            name=f"Bench assistant {n}",
+        ).save()
+
+
+def run(client, concurrency, rate_limit):
+    from apps.assistants.models import Assistant, AssistantSyncJob
+    from apps.assistants.sync import drain, throughput
+
+    # Start every round from assistants that were never pushed
+    Assistant.objects.update(openai_assistant_id=None, synced_instructions_hash='')
+    AssistantSyncJob.objects.all().delete()
+    AssistantSyncJob.objects.enqueue(Assistant.objects.values_list('pk', flat=True))
+    stats = drain(client=client, concurrency=concurrency, rate_limit=rate_limit)
+    return stats, throughput(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--assistants', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds the stub waits before each answer.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--rate-limit', type=float, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    import openai
+    from django.test.utils import override_settings
+    from services.openai_stub import AssistantsStubServer
+
+    with benchmark_database(), override_settings(ASSISTANT_SYNC_DEBOUNCE_SECONDS=0), \
+            AssistantsStubServer(latency=args.latency) as stub:
+        create_assistants(args.assistants)
+        client = openai.Client(base_url=stub.base_url, api_key='stub', max_retries=0)
+        print(f"{args.assistants} assistants, {args.latency * 1000:.0f}ms per OpenAI call")
+        print(f"{'concurrency':<12}{'seconds':>10}{'calls/s':>10}{'failed':>8}")
+        for concurrency in args.concurrency:
+            stats, rate = run(client, concurrency, args.rate_limit)
+            print(f"{concurrency:<12}{stats['seconds']:>10.2f}{rate:>10.1f}{stats['failed'] + stats['retry']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Per-request latency with and without database connection reuse, against the
+PostgreSQL database configured in DJANGO_SETTINGS_MODULE (point it at a local server).
+
+    python -m benchmarks.db_connections --requests 500
+
+Each simulated request runs one query between the request_started/request_finished
+connection housekeeping Django does, so a new connection's TCP, TLS and auth round
+trips show up in the numbers.
+"""
+import argparse
+import time
+
+from benchmarks.utils import percentile, setup_django
+
+
+def make_wrapper(engine, **overrides):
+    from django.db import connections
+    from django.db.utils import load_backend
+
+    settings_dict = dict(connections['default'].settings_dict, ENGINE=engine, **overrides)
+    return load_backend(engine).DatabaseWrapper(settings_dict, alias='benchmark')
+
+
+def measure(wrapper, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        # What close_old_connections() does on request_started and request_finished
+        wrapper.close_if_unusable_or_obsolete()
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        wrapper.close_if_unusable_or_obsolete()
+        samples.append((time.perf_counter() - start) * 1000)
+    wrapper.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+
+    if connection.vendor != 'postgresql':
+        raise SystemExit("This benchmark needs a PostgreSQL database")
+
+    modes = {
+        'new connection': make_wrapper('django.db.backends.postgresql', CONN_MAX_AGE=0),
+        'persistent': make_wrapper('django.db.backends.postgresql', CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True),
+        'pooled': make_wrapper('config.db_backends.pooled_postgresql', CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=True),
+    }
+    print(f"{args.requests} requests of one query each")
+    print(f"{'connections':<16}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, wrapper in modes.items():
+        samples = measure(wrapper, args.requests)
+        print(f"{name:<16}{percentile(samples, 0.5):>10.3f}{percentile(samples, 0.99):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
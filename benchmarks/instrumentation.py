@@ -0,0 +1,154 @@
+"""
+Overhead of the performance instrumentation (config/performance.py) per request,
+against a budget.
+
+    python -m benchmarks.instrumentation --requests 2000 --budget-us 100
+
+Requests go through the full Django handler (the test client) with and without
+PerformanceMiddleware, in alternating rounds so that both see the same machine
+state. Without it the serializer and query hooks are removed too. The endpoints are
+a view without queries and a DRF list that runs queries and a serializer. The first
+rows are the middleware alone around a view returning an empty response, sync and
+async (as under ASGI), which shows its fixed cost without the handler's noise. Exits
+with status 1 when any p50 overhead is over budget.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks.utils import benchmark_database, percentile, setup_django
+
+ROUNDS = 10
+
+
+def uninstrument():
+    from django.db import connections
+    from config.performance import record_query, uninstrument_serializers
+
+    uninstrument_serializers()
+    for connection in connections.all(initialized_only=True):
+        if record_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(record_query)
+
+
+def instrument():
+    from django.db import connections
+    from config.performance import instrument_connection, instrument_serializers
+
+    instrument_serializers()
+    for connection in connections.all(initialized_only=True):
+        instrument_connection(connection)
+
+
+def client(middleware, headers):
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    # The handler loads the middleware on its first request
+    test_client = Client(**headers)
+    with override_settings(MIDDLEWARE=middleware):
+        test_client.get('/api/v1/auth/routes/')
+    return test_client
+
+
+def measure_alone(count):
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from config.performance import PerformanceMiddleware
+
+    request = RequestFactory().get('/api/v1/auth/routes/')
+    views = {'off': lambda request: HttpResponse(), 'on': PerformanceMiddleware(lambda request: HttpResponse())}
+    samples = {'off': [], 'on': []}
+    for mode in ('off', 'on') * ROUNDS:
+        view = views[mode]
+        for _ in range(count):
+            start = time.perf_counter()
+            view(request)
+            samples[mode].append((time.perf_counter() - start) * 1_000_000)
+    return samples
+
+
+def measure_alone_async(count):
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from config.performance import PerformanceMiddleware
+
+    async def view(request):
+        return HttpResponse()
+
+    async def run(view):
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            await view(request)
+            samples.append((time.perf_counter() - start) * 1_000_000)
+        return samples
+
+    request = RequestFactory().get('/api/v1/auth/routes/')
+    views = {'off': view, 'on': PerformanceMiddleware(view)}
+    samples = {'off': [], 'on': []}
+    for mode in ('off', 'on') * ROUNDS:
+        samples[mode] += asyncio.run(run(views[mode]))
+    return samples
+
+
+def measure(test_client, path, count):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = test_client.get(path)
+        samples.append((time.perf_counter() - start) * 1_000_000)
+        assert response.status_code == 200, response.status_code
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help="Requests per endpoint and mode.")
+    parser.add_argument('--budget-us', type=float, default=100, help="Allowed p50 overhead per request.")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.test.utils import override_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+    from apps.accounts.models import Personalization
+
+    performance = 'config.performance.PerformanceMiddleware'
+    without = [path for path in settings.MIDDLEWARE if path != performance]
+    # One client sends every request
+    unthrottled = override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}})
+    with benchmark_database(), unthrottled:
+        user = get_user_model().objects.create_user('bench', 'bench@example.com', 'password', is_active=True)
+        Personalization.objects.create(user=user, difficulty=2, personal_details='Benchmarks')
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+        uninstrument()
+        clients = {'off': client(without, headers), 'on': client(settings.MIDDLEWARE, headers)}
+
+        print(f"{args.requests} requests per endpoint and mode, budget {args.budget_us:.0f} µs")
+        print(f"{'endpoint':<20}{'off p50':>10}{'on p50':>10}{'overhead':>10}")
+        per_round = max(args.requests // ROUNDS, 1)
+        results = [('middleware alone', measure_alone(per_round)), ('async alone', measure_alone_async(per_round))]
+        for name, path in (('routes', '/api/v1/auth/routes/'), ('personalizations', '/api/v1/personalizations/')):
+            samples = {'off': [], 'on': []}
+            for _ in range(ROUNDS):
+                uninstrument()
+                samples['off'] += measure(clients['off'], path, per_round)
+                instrument()
+                samples['on'] += measure(clients['on'], path, per_round)
+            results.append((name, samples))
+
+        over_budget = False
+        for name, samples in results:
+            off, on = percentile(samples['off'], 0.5), percentile(samples['on'], 0.5)
+            over_budget |= on - off > args.budget_us
+            print(f"{name:<20}{off:>10.1f}{on:>10.1f}{on - off:>10.1f}")
+    if over_budget:
+        print("Over budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
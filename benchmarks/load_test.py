@@ -0,0 +1,144 @@
+"""
+Requests per second and latency percentiles of the web server in sync (WSGI) and
+ASGI modes at high concurrency.
+
+Starts `gunicorn -c gunicorn.conf.py` once per mode against the configured database,
+with the fake chat backend so OpenAI is never called, and fires requests at it (set
+DATABASE_POOL=true as production does, or ASGI runs out of database connections):
+
+    python -m benchmarks.load_test --user player --quest 1 --concurrency 200 --requests 2000
+
+Use --url to load an already running server instead. Latency includes reading the
+whole (streamed) response.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.utils import percentile, setup_django
+
+
+def access_token(username):
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    return str(AccessToken.for_user(get_user_model().objects.get(username=username)))
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server didn't start listening on port {port}")
+
+
+def start_server(mode, port, workers, fake_delay):
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        ASSISTANT_CHAT_BACKEND='apps.assistants.chat.FakeChatBackend',
+        ASSISTANT_CHAT_FAKE_DELAY=str(fake_delay),
+        # One client sends every request
+        THROTTLE_RATE_USER='',
+        THROTTLE_RATE_IP='',
+        THROTTLE_RATE_CHAT_USER='',
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null'],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+    except RuntimeError:
+        server.kill()
+        raise
+    return server
+
+
+async def load(url, method, body, headers, concurrency, total):
+    import httpx
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def user():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    async with client.stream(method, url, content=body, headers=headers) as response:
+                        async for _chunk in response.aiter_bytes():
+                            pass
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return total / elapsed, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', nargs='+', default=['wsgi', 'asgi'], choices=['wsgi', 'asgi'])
+    parser.add_argument('--url', help="Load this running server instead of starting gunicorn.")
+    parser.add_argument('--path', default='/api/v1/quest/{quest}/chat/')
+    parser.add_argument('--quest', type=int, default=1)
+    parser.add_argument('--method', default='POST')
+    parser.add_argument('--body', default=json.dumps({'message': "Ni hao, wo xiang mai cha"}))
+    parser.add_argument('--user', help="Send a JWT for this username.")
+    parser.add_argument('--token', help="Send this JWT access token.")
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=2, help="Gunicorn workers per mode.")
+    parser.add_argument('--fake-delay', type=float, default=0.05, help="Seconds between fake chat chunks.")
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    headers = {'Content-Type': 'application/json'}
+    token = args.token or (access_token(args.user) if args.user else None)
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    path = args.path.format(quest=args.quest)
+    body = args.body.encode() if args.method != 'GET' else None
+
+    targets = [('external', args.url)] if args.url else [(mode, f"http://127.0.0.1:{args.port}") for mode in args.mode]
+    print(f"{args.requests} x {args.method} {path}, {args.concurrency} concurrent")
+    print(f"{'mode':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for mode, base_url in targets:
+        server = None if args.url else start_server(mode, args.port, args.workers, args.fake_delay)
+        try:
+            rps, latencies, errors = asyncio.run(
+                load(base_url + path, args.method, body, headers, args.concurrency, args.requests)
+            )
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+        print(
+            f"{mode:<10}{rps:>10.1f}{percentile(latencies, 0.5) * 1000:>10.1f}"
+            f"{percentile(latencies, 0.99) * 1000:>10.1f}{errors:>8}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Per-call latency of OpenAI requests with and without connection reuse, against the
+local stub server.
+
+    python -m benchmarks.openai_client --calls 200
+"""
+import argparse
+import time
+
+from benchmarks.utils import percentile, setup_django
+
+
+def measure(calls, make_client):
+    samples = []
+    for n in range(calls):
+        start = time.perf_counter()
+        make_client().beta.assistants.update("asst_bench", instructions=f"Benchmark {n}")
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the stub waits before each answer.")
+    args = parser.parse_args()
+
+    setup_django()
+    import httpx
+    import openai
+    from django.test.utils import override_settings
+    from services.openai_service import client_options, get_client
+    from services.openai_stub import AssistantsStubServer
+
+    with AssistantsStubServer(latency=args.latency) as stub:
+        stub.assistants["asst_bench"] = {'id': "asst_bench", 'object': 'assistant', 'instructions': ''}
+        with override_settings(OPENAI_BASE_URL=stub.base_url, OPENAI_API_KEY='stub'):
+            no_keepalive = openai.Client(
+                http_client=openai.DefaultHttpxClient(limits=httpx.Limits(max_keepalive_connections=0)),
+                **client_options(),
+            )
+            modes = {
+                # What building a client per call (or per short-lived process) costs
+                'new client': lambda: openai.Client(**client_options()),
+                'shared, no keep-alive': lambda: no_keepalive,
+                'shared, pooled': get_client,
+            }
+            print(f"{args.calls} assistant updates, {args.latency * 1000:.0f}ms stub latency")
+            print(f"{'client':<24}{'p50 ms':>10}{'p95 ms':>10}{'connections':>13}")
+            for name, make_client in modes.items():
+                before = stub.connections
+                samples = measure(args.calls, make_client)
+                print(
+                    f"{name:<24}{percentile(samples, 0.5):>10.2f}{percentile(samples, 0.95):>10.2f}"
+                    f"{stub.connections - before:>13}"
+                )
+
+
+if __name__ == '__main__':
+    main()
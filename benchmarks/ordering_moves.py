@@ -0,0 +1,63 @@
+"""
+Rows written per quest move in the dense and sparse ordering modes.
+
+    python -m benchmarks.ordering_moves --quests 500 --moves 200
+"""
+import argparse
+import random
+
+from benchmarks.utils import RowCounter, benchmark_database, setup_django, timer
+
+
+def run(mode, quest_count, moves, seed):
+    from django.db import connection, transaction
+    from django.test.utils import override_settings
+    from apps.storyline.models import ORDER_KEY_GAP, Story, Adventure, Quest, Character
+
+    with override_settings(STORYLINE_ORDERING_MODE=mode), transaction.atomic():
+        character = Character.objects.create(name=f"Bench {mode}", description="Benchmark")
+        story = Story.objects.create(title=f"Bench story {mode}", description="Benchmark")
+        adventure = Adventure.objects.create(title=f"Bench adventure {mode}", description="Benchmark", story=story)
+        Quest.objects.bulk_create([
+            Quest(
+                title=f"Bench quest {mode} {n}",
+                description="Benchmark",
+                adventure=adventure,
+                character=character,
+                quest_num=n,
+                order_key=n * ORDER_KEY_GAP,
+            )
+            for n in range(1, quest_count + 1)
+        ])
+        quests = list(Quest.objects.filter(adventure=adventure))
+
+        rng = random.Random(seed)
+        counter = RowCounter()
+        with connection.execute_wrapper(counter), timer() as elapsed:
+            for _ in range(moves):
+                quest = rng.choice(quests)
+                quest.quest_num = rng.randint(1, quest_count)
+                quest.save()
+        transaction.set_rollback(True)
+
+    return counter.rows / moves, elapsed['seconds'] * 1000 / moves
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quests', type=int, default=500)
+    parser.add_argument('--moves', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        print(f"{args.moves} random moves in an adventure of {args.quests} quests")
+        print(f"{'mode':<8}{'rows/move':>12}{'ms/move':>12}")
+        for mode in ('dense', 'sparse'):
+            rows, ms = run(mode, args.quests, args.moves, args.seed)
+            print(f"{mode:<8}{rows:>12.1f}{ms:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Logins and registrations per second per core under each password hashing policy.
+
+    python -m benchmarks.password_hashing --logins 50
+    python -m benchmarks.password_hashing --argon2-memory-cost 65536 --pbkdf2-iterations 1000000
+
+Everything runs on one thread, and hashing is CPU bound, so the rates are per core.
+A login is django.contrib.auth.authenticate() as djoser's JWT create view calls it,
+a registration is CustomUserManager.create_user(). The rehash column is the first
+login of a user whose password was hashed under the other policy, which verifies
+the old hash and stores a new one.
+"""
+import argparse
+import itertools
+
+from benchmarks.utils import benchmark_database, setup_django, timer
+
+PASSWORD = 'correct horse battery staple'
+
+
+def policy_hashers(policy):
+    from django.conf import settings
+
+    preferred = settings.PASSWORD_HASHER_POLICIES[policy]
+    return [preferred] + [path for path in settings.PASSWORD_HASHERS if path != preferred]
+
+
+def run(policy, other, logins, serial):
+    from django.contrib.auth import authenticate, get_user_model
+    from django.db import transaction
+    from django.test.utils import override_settings
+
+    User = get_user_model()
+    with transaction.atomic():
+        # Users whose passwords were set under the other policy, for the rehash column
+        with override_settings(PASSWORD_HASHERS=policy_hashers(other)):
+            legacy = [
+                User.objects.create_user(f'legacy-{policy}-{n}', None, PASSWORD, is_active=True)
+                for n in range(logins)
+            ]
+
+        with override_settings(PASSWORD_HASHERS=policy_hashers(policy)):
+            with timer() as registering:
+                users = [
+                    User.objects.create_user(f'bench-{policy}-{next(serial)}', None, PASSWORD, is_active=True)
+                    for _ in range(logins)
+                ]
+            with timer() as logging_in:
+                for user in users:
+                    assert authenticate(username=user.username, password=PASSWORD) is not None
+            with timer() as rehashing:
+                for user in legacy:
+                    assert authenticate(username=user.username, password=PASSWORD) is not None
+            algorithm = User.objects.get(pk=legacy[0].pk).password.split('$', 1)[0]
+        transaction.set_rollback(True)
+
+    return {
+        'logins': logins / logging_in['seconds'],
+        'registrations': logins / registering['seconds'],
+        'rehash_ms': rehashing['seconds'] * 1000 / logins,
+        'rehashed_to': algorithm,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--argon2-time-cost', type=int)
+    parser.add_argument('--argon2-memory-cost', type=int, help="KiB")
+    parser.add_argument('--argon2-parallelism', type=int)
+    parser.add_argument('--pbkdf2-iterations', type=int)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    argon2 = dict(settings.PASSWORD_ARGON2)
+    for key, value in (
+        ('TIME_COST', args.argon2_time_cost),
+        ('MEMORY_COST', args.argon2_memory_cost),
+        ('PARALLELISM', args.argon2_parallelism),
+    ):
+        if value is not None:
+            argon2[key] = value
+    iterations = args.pbkdf2_iterations or settings.PASSWORD_PBKDF2_ITERATIONS
+
+    serial = itertools.count()
+    with benchmark_database(), override_settings(PASSWORD_ARGON2=argon2, PASSWORD_PBKDF2_ITERATIONS=iterations):
+        print(
+            f"argon2: time cost {argon2['TIME_COST']}, memory {argon2['MEMORY_COST']} KiB, "
+            f"parallelism {argon2['PARALLELISM']}; pbkdf2: {iterations} iterations"
+        )
+        print(f"{'policy':<8}{'logins/s':>12}{'signups/s':>12}{'rehash ms':>12}")
+        for policy, other in (('pbkdf2', 'argon2'), ('argon2', 'pbkdf2')):
+            result = run(policy, other, args.logins, serial)
+            assert result['rehashed_to'].startswith(policy)
+            print(f"{policy:<8}{result['logins']:>12.1f}{result['registrations']:>12.1f}{result['rehash_ms']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Registration latency with the activation email sent inline over SMTP and with it
+queued, against a local SMTP server answering with the given latency, then the
+queued emails' delivery rate over one connection.
+
+    python -m benchmarks.registration_email --registrations 50 --smtp-latency 0.2
+"""
+import argparse
+import itertools
+import time
+
+from benchmarks.utils import benchmark_database, percentile, setup_django, timer
+from services.smtp_stub import SMTPStubServer
+
+
+def register(count, serial):
+    from django.test import Client
+
+    client = Client()
+    samples = []
+    for _ in range(count):
+        n = next(serial)
+        start = time.perf_counter()
+        response = client.post('/api/v1/auth/users/', {
+            'username': f'bench{n}',
+            'email': f'bench{n}@example.com',
+            'password': 'a long benchmark password',
+            're_password': 'a long benchmark password',
+        })
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 201, response.content
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registrations', type=int, default=50)
+    parser.add_argument('--smtp-latency', type=float, default=0.2, help="Seconds per SMTP greeting and per message.")
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.test.utils import override_settings
+    from apps.accounts.mail import deliver
+
+    serial = itertools.count()
+    with benchmark_database(), SMTPStubServer(latency=args.smtp_latency) as stub:
+        smtp = override_settings(
+            # Every registration comes from the same address
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}},
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=stub.port, EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='',
+            EMAIL_DELIVERY_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        )
+        with smtp:
+            print(f"{args.registrations} registrations, SMTP latency {args.smtp_latency * 1000:.0f} ms")
+            print(f"{'email':<8}{'p50 ms':>10}{'p99 ms':>10}")
+            for name, backend in (
+                ('inline', 'django.core.mail.backends.smtp.EmailBackend'),
+                ('queued', 'apps.accounts.mail.QueuedEmailBackend'),
+            ):
+                with override_settings(EMAIL_BACKEND=backend):
+                    samples = register(args.registrations, serial)
+                print(f"{name:<8}{percentile(samples, 0.5):>10.1f}{percentile(samples, 0.99):>10.1f}")
+
+            connections = stub.connections
+            with timer() as elapsed:
+                stats = deliver()
+            print(
+                f"Worker sent {stats['sent']} queued emails in {elapsed['seconds']:.1f}s "
+                f"({stats['sent'] / elapsed['seconds']:.1f}/s) over {stub.connections - connections} connection(s)"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Cost of one rate limit check, for DRF's SimpleRateThrottle and for the token buckets
+of config/throttling.py, at rates allowing more and more requests per window.
+
+    python -m benchmarks.throttling --checks 20000 --rates 60/min 1000/min 10000/hour
+
+SimpleRateThrottle keeps a list of every request's time in the window, so each check
+reads and writes a list as long as the rate allows; a bucket is one timestamp. Both
+use the THROTTLE_CACHE_ALIAS cache (Redis when REDIS_URL is set). Clients are spread
+over 100 keys and kept under the rate so that every check is a full, allowed one.
+"""
+import argparse
+import time
+
+from benchmarks.utils import percentile, setup_django
+
+CLIENTS = 100
+
+
+def measure(check, checks, reset=None):
+    samples = []
+    for n in range(checks):
+        client = n % CLIENTS
+        start = time.perf_counter()
+        check(client)
+        samples.append((time.perf_counter() - start) * 1_000_000)
+        if reset:
+            reset(client)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--rates', nargs='+', default=['60/min', '1000/min', '10000/hour'])
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.cache import caches
+    from rest_framework.throttling import SimpleRateThrottle
+    from config.throttling import get_bucket, parse_rate
+
+    cache = caches[settings.THROTTLE_CACHE_ALIAS]
+    bucket = get_bucket()
+
+    class Throttle(SimpleRateThrottle):
+        rate = '1/s'
+
+        def get_cache_key(self, request, view):
+            return f'simple:{request}'
+
+    print(f"{args.checks} checks against the {type(cache).__name__} '{settings.THROTTLE_CACHE_ALIAS}' cache, µs per check")
+    print(f"{'rate':<12}{'throttle':<20}{'p50':>8}{'p99':>8}")
+    for rate in args.rates:
+        capacity, period = parse_rate(rate)
+        throttle = Throttle()
+        throttle.cache = cache
+        # One below the limit, so every check is allowed and stores a full window
+        throttle.num_requests, throttle.duration = capacity, period
+        history = [time.time()] * (capacity - 1)
+
+        def reset(client):
+            cache.set(f'simple:{client}', history, period)
+
+        cache.clear()
+        for client in range(CLIENTS):
+            reset(client)
+        simple = measure(lambda client: throttle.allow_request(client, None), args.checks, reset)
+        cache.clear()
+        # Sized so that no check is refused; a bucket's cost doesn't depend on its size
+        buckets = measure(lambda client: bucket.take(f'bucket:{client}', capacity + args.checks, period), args.checks)
+        for name, samples in (('SimpleRateThrottle', simple), ('token bucket', buckets)):
+            print(f"{rate:<12}{name:<20}{percentile(samples, 0.5):>8.1f}{percentile(samples, 0.99):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Refresh latency with millions of tokens already recorded, for simplejwt's token_blacklist
+tables and for the RevokedToken store. Needs DJANGO_SETTINGS_MODULE pointing at a
+PostgreSQL database.
+
+    python -m benchmarks.token_refresh --tokens 10000000 --refreshes 500
+
+Both stores are filled with --tokens rows, as after that many rotations: simplejwt keeps
+an outstanding row holding the token text plus a blacklisted row for each, RevokedToken
+one jti. Each refresh then runs the rotating TokenRefreshSerializer, including its
+claims queries, against one store. The legacy side also records each issued token as
+outstanding, as its login does.
+"""
+import argparse
+import time
+
+from benchmarks.utils import benchmark_database, percentile, setup_django
+
+# Length of the text of a refresh token of ours
+TOKEN_TEXT_LENGTH = 330
+
+
+def fill(tokens):
+    from django.db import connection
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+    from apps.accounts.models import RevokedToken
+
+    outstanding = OutstandingToken._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {outstanding} (jti, token, created_at, expires_at)
+            SELECT md5(n::text), repeat('x', %s), now(), now() + interval '90 days'
+            FROM generate_series(1, %s) AS n
+            """,
+            [TOKEN_TEXT_LENGTH, tokens],
+        )
+        cursor.execute(
+            f"INSERT INTO {BlacklistedToken._meta.db_table} (token_id, blacklisted_at) SELECT id, now() FROM {outstanding}"
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {RevokedToken._meta.db_table} (jti, expires_at)
+            SELECT md5(n::text)::uuid, now() + interval '90 days'
+            FROM generate_series(1, %s) AS n
+            """,
+            [tokens],
+        )
+        for model in (OutstandingToken, BlacklistedToken, RevokedToken):
+            cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+
+def table_sizes():
+    from django.db import connection
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+    from apps.accounts.models import RevokedToken
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_total_relation_size(%s) + pg_total_relation_size(%s), pg_total_relation_size(%s)",
+            [OutstandingToken._meta.db_table, BlacklistedToken._meta.db_table, RevokedToken._meta.db_table],
+        )
+        return cursor.fetchone()
+
+
+def measure(token_class, user, refreshes):
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from apps.accounts.tokens import TokenRefreshSerializer
+
+    class Serializer(TokenRefreshSerializer):
+        pass
+
+    Serializer.token_class = token_class
+    refresh = str(token_class.for_user(user))
+    samples = []
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(refreshes):
+            # A refresh token is checked once before it's rotated, so the cache never has it
+            cache.clear()
+            start = time.perf_counter()
+            serializer = Serializer(data={'refresh': refresh})
+            serializer.is_valid(raise_exception=True)
+            refresh = serializer.validated_data['refresh']
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples, len(queries) / refreshes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=10_000_000)
+    parser.add_argument('--refreshes', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from rest_framework_simplejwt.tokens import BlacklistMixin
+    from apps.accounts.tokens import RefreshToken
+
+    if connection.vendor != 'postgresql':
+        raise SystemExit("This benchmark needs a PostgreSQL database")
+
+    class LegacyRefreshToken(RefreshToken):
+        # simplejwt's own bookkeeping on top of the same claims
+        check_blacklist = BlacklistMixin.check_blacklist
+        blacklist = BlacklistMixin.blacklist
+
+        @classmethod
+        def for_user(cls, user):
+            token = BlacklistMixin.for_user.__func__(cls, user)
+            token.user = user
+            return token
+
+    with benchmark_database():
+        user = get_user_model().objects.create_user('bench', 'bench@example.com', 'password', is_active=True)
+        start = time.perf_counter()
+        fill(args.tokens)
+        legacy_bytes, revoked_bytes = table_sizes()
+        print(f"Recorded {args.tokens} tokens in {time.perf_counter() - start:.0f}s")
+        print(f"token_blacklist tables {legacy_bytes / 2**20:.0f} MiB, RevokedToken {revoked_bytes / 2**20:.0f} MiB")
+        print(f"{'store':<16}{'queries':>9}{'p50 ms':>10}{'p99 ms':>10}")
+        for name, token_class in (('token_blacklist', LegacyRefreshToken), ('RevokedToken', RefreshToken)):
+            samples, queries = measure(token_class, user, args.refreshes)
+            print(f"{name:<16}{queries:>9.1f}{percentile(samples, 0.5):>10.2f}{percentile(samples, 0.99):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
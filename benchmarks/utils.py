@@ -0,0 +1,62 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks run against a throwaway test database created from DJANGO_SETTINGS_MODULE
+(config.settings by default), so they never touch the development or production data.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def benchmark_database():
+    from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+class RowCounter:
+    """
+    connection.execute_wrapper() hook summing the rows written by INSERT, UPDATE and DELETE.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.statements = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if sql.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            self.statements += 1
+            self.rows += max(context['cursor'].rowcount, 0)
+        return result
+
+
+@contextmanager
+def timer():
+    elapsed = {}
+    start = time.perf_counter()
+    try:
+        yield elapsed
+    finally:
+        elapsed['seconds'] = time.perf_counter() - start
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
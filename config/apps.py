@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class PerformanceConfig(AppConfig):
+    name = 'config'
+    label = 'performance'
+
+    def ready(self):
+        from config.performance import instrument_serializers
+        if settings.SERIALIZER_TIMING:
+            instrument_serializers()
@@ -0,0 +1,113 @@
+"""
+PostgreSQL backend that hands connections back to a process-wide pool instead of
+closing them, for ASGI where requests don't keep a thread (and its persistent
+connection) of their own. Django 4.2 has no built-in pooling.
+
+Configured from the database's POOL entry:
+
+    'ENGINE': 'config.db_backends.pooled_postgresql',
+    'CONN_MAX_AGE': 0,  # return the connection to the pool at the end of each request
+    'POOL': {'MAX_SIZE': 10, 'TIMEOUT': 10, 'MAX_IDLE': 60},
+"""
+import queue
+import threading
+import time
+from django.db.backends.postgresql import base
+
+# Idle connections older than this are pinged before reuse when CONN_HEALTH_CHECKS is on
+HEALTH_CHECK_AFTER = 5
+
+
+class ConnectionPool:
+    """
+    At most max_size open connections, the most recently returned reused first. Callers
+    wait up to timeout seconds for a free slot, and idle connections older than
+    max_idle seconds are closed rather than reused.
+    """
+    def __init__(self, max_size, timeout, max_idle, health_checks):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.health_checks = health_checks
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle = queue.LifoQueue()
+
+    def acquire(self, connect):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise base.Database.OperationalError(f"No database connection free after {self.timeout}s")
+        try:
+            while True:
+                try:
+                    connection, returned_at = self.idle.get_nowait()
+                except queue.Empty:
+                    return connect()
+                idle_for = time.monotonic() - returned_at
+                if idle_for > self.max_idle or not self.usable(connection, idle_for):
+                    self.discard(connection)
+                    continue
+                return connection
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def usable(self, connection, idle_for):
+        if connection.closed:
+            return False
+        if not self.health_checks or idle_for < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except base.Database.Error:
+            return False
+        return True
+
+    def release(self, connection, discard=False):
+        try:
+            # Only connections outside any transaction go back; anything else is closed
+            if discard or connection.closed or connection.info.transaction_status != 0:
+                self.discard(connection)
+            else:
+                self.idle.put((connection, time.monotonic()))
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except base.Database.Error:
+            pass
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pools = {}
+    pools_lock = threading.Lock()
+
+    def get_pool(self, conn_params):
+        # Keyed by the connection parameters too: the test runner connects to the
+        # 'postgres' database through the same alias to create the test database
+        key = (self.alias, repr(sorted(conn_params.items())))
+        with self.pools_lock:
+            if key not in self.pools:
+                options = self.settings_dict.get('POOL', {})
+                self.pools[key] = ConnectionPool(
+                    max_size=options.get('MAX_SIZE', 10),
+                    timeout=options.get('TIMEOUT', 10),
+                    max_idle=options.get('MAX_IDLE', 60),
+                    health_checks=self.settings_dict['CONN_HEALTH_CHECKS'],
+                )
+            return self.pools[key]
+
+    def get_new_connection(self, conn_params):
+        self._pool = self.get_pool(conn_params)
+        connection = self._pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        # The parent sets this while connecting; a reused connection already has the level applied
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = (
+            base.IsolationLevel(isolation_level) if isolation_level is not None else base.IsolationLevel.READ_COMMITTED
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self._pool.release(self.connection, discard=self.errors_occurred)
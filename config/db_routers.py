@@ -0,0 +1,134 @@
+"""
+Read-replica routing.
+
+ReplicaRoutingMiddleware marks API requests made with safe methods; during those,
+reads of the storyline and accounts models go to a random DATABASE_REPLICAS alias.
+Everything else (writes, unsafe requests, the admin, management commands and
+workers, atomic blocks) uses the primary. A request that writes sends its own later
+reads to the primary, and its user is pinned to the primary for
+DATABASE_REPLICA_STICKY_SECONDS so that they read their own writes despite replica lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+REPLICA_APPS = {'storyline', 'accounts'}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PINNED_KEY = 'db:pinned:{user_id}'
+
+_request = ContextVar('replica_request', default=None)
+_primary = ContextVar('replica_primary', default=False)
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary inside the block, e.g. when building something that gets
+    cached for everyone and must not capture a lagging replica's data.
+    """
+    token = _primary.set(True)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+def known_user(request):
+    # DRF assigns the authenticated user to the Django request. Don't resolve the session's
+    # lazy user here: that runs queries which would come back through the router.
+    user = request.__dict__.get('user')
+    if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+        return None
+    return user if user.is_authenticated else None
+
+
+def is_pinned(request):
+    user = known_user(request)
+    if user is None:
+        return False
+    if getattr(request, '_replica_pinned_user', None) != user.pk:
+        request._replica_pinned = cache.get(PINNED_KEY.format(user_id=user.pk), False)
+        request._replica_pinned_user = user.pk
+    return request._replica_pinned
+
+
+def pin_to_primary(user):
+    cache.set(PINNED_KEY.format(user_id=user.pk), True, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+async def apin_to_primary(user):
+    await cache.aset(PINNED_KEY.format(user_id=user.pk), True, timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        request = _request.get()
+        if (
+            request is None
+            or not settings.DATABASE_REPLICAS
+            or model._meta.app_label not in REPLICA_APPS
+            or _primary.get()
+            or request.method not in SAFE_METHODS
+            or getattr(request, '_replica_wrote', False)
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+            or is_pinned(request)
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        request = _request.get()
+        if request is not None:
+            request._replica_wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI, stay in the event loop rather than making Django adapt us to a thread
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not request.path.startswith(settings.DATABASE_REPLICA_PATH_PREFIX):
+            return self.get_response(request)
+        token = _request.set(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        if getattr(request, '_replica_wrote', False):
+            user = known_user(request)
+            if user is not None:
+                pin_to_primary(user)
+        return response
+
+    async def __acall__(self, request):
+        if not request.path.startswith(settings.DATABASE_REPLICA_PATH_PREFIX):
+            return await self.get_response(request)
+        # Views run by sync_to_async get a copy of this context, so the router sees the request
+        token = _request.set(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        if getattr(request, '_replica_wrote', False):
+            user = known_user(request)
+            if user is not None:
+                await apin_to_primary(user)
+        return response
@@ -0,0 +1,38 @@
+"""
+Password hashers with their cost taken from settings.
+
+PASSWORD_HASHER picks the policy new passwords are hashed with (settings put its
+hasher first in PASSWORD_HASHERS); the others stay listed so existing hashes still
+verify. Django rehashes a password on the next successful login whenever it was made
+by a non-preferred hasher or with other cost parameters, so switching policy or
+retuning the cost upgrades users as they log in, without a migration.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2id with the time cost (passes), memory cost (KiB) and parallelism (lanes)
+    of PASSWORD_ARGON2.
+    """
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2['TIME_COST']
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2['MEMORY_COST']
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2['PARALLELISM']
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with PASSWORD_PBKDF2_ITERATIONS iterations.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
@@ -0,0 +1,442 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware times each request and, through hooks that read the current
+request's Timings from a context variable, the database queries it runs, the DRF
+serializers it validates and renders and the OpenAI calls it makes. It reports them
+in a Server-Timing header and adds them to per-view histograms, which metrics()
+serves in the Prometheus text format.
+
+- Database: an execute wrapper installed on every connection.
+- Serializers: the outermost BaseSerializer.is_valid() and .data of the request,
+  wrapped once at start-up (PerformanceConfig) while SERIALIZER_TIMING is on.
+- OpenAI: event hooks on the shared httpx clients (services/openai_service.py),
+  from sending a request to receiving the response headers, retries included.
+
+The histograms are summed across workers in the METRICS_CACHE_ALIAS cache (Redis
+outside development). A request only updates its process's pending counts; a
+background thread adds them to the shared totals every METRICS_FLUSH_SECONDS, and a
+scrape flushes the answering worker first. The work per request is fixed (a few
+clock reads, one locked update of five histograms), and benchmarks.instrumentation
+checks it stays within budget. A streamed response is observed when its stream
+ends; its Server-Timing header only covers the time until the response started.
+"""
+import hmac
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+_timings = ContextVar('request_timings', default=None)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Name, help text, buckets, and the Timings attribute observed
+METRICS = (
+    ('http_request_duration_seconds', "Wall time of requests.", SECONDS_BUCKETS, 'wall'),
+    ('http_request_db_queries', "Database queries per request.", QUERY_BUCKETS, 'db_queries'),
+    ('http_request_db_duration_seconds', "Time per request spent in database queries.", SECONDS_BUCKETS, 'db'),
+    ('http_request_serializer_duration_seconds', "Time per request spent in DRF serializers.", SECONDS_BUCKETS, 'serializer'),
+    ('http_request_openai_duration_seconds', "Time per request spent in OpenAI calls.", SECONDS_BUCKETS, 'openai'),
+)
+
+
+class Timings:
+    __slots__ = ('start', 'wall', 'db_queries', 'db', 'serializer', 'serializer_depth', 'openai', 'openai_calls')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.wall = 0.0
+        self.db_queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.serializer_depth = 0
+        self.openai = 0.0
+        self.openai_calls = 0
+
+    def stop(self):
+        self.wall = time.perf_counter() - self.start
+
+    def server_timing(self):
+        return (
+            f'app;dur={self.wall * 1000:.1f}, '
+            f'db;dur={self.db * 1000:.1f};desc="{self.db_queries} queries", '
+            f'serializer;dur={self.serializer * 1000:.1f}, '
+            f'openai;dur={self.openai * 1000:.1f};desc="{self.openai_calls} calls"'
+        )
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bound, plus +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class CacheStore:
+    """
+    Histogram totals in a cache, as {view: [(counts, sum, count) per METRICS entry]}.
+    On Redis they are one hash, added to with a pipeline of HINCRBY(FLOAT)s; other
+    backends get a locked read, merge and write, exact for the per-process local
+    memory cache.
+    """
+    key = 'metrics:histograms'
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+        self.lock = threading.Lock()
+
+    def redis_client(self):
+        key = self.cache.make_and_validate_key(self.key)
+        return key, self.cache._cache.get_client(key, write=True)
+
+    def add(self, pending):
+        if isinstance(self.cache, RedisCache):
+            key, client = self.redis_client()
+            pipeline = client.pipeline(transaction=False)
+            for view, histograms in pending.items():
+                for index, histogram in enumerate(histograms):
+                    for bucket, count in enumerate(histogram.counts):
+                        if count:
+                            pipeline.hincrby(key, f'{view}\t{index}\t{bucket}', count)
+                    pipeline.hincrbyfloat(key, f'{view}\t{index}\tsum', histogram.sum)
+                    pipeline.hincrby(key, f'{view}\t{index}\tcount', histogram.count)
+            pipeline.execute()
+            return
+        with self.lock:
+            totals = self.cache.get(self.key) or {}
+            for view, histograms in pending.items():
+                current = totals.setdefault(view, [([0] * len(h.counts), 0.0, 0) for h in histograms])
+                for index, histogram in enumerate(histograms):
+                    counts, total, count = current[index]
+                    current[index] = (
+                        [a + b for a, b in zip(counts, histogram.counts)],
+                        total + histogram.sum,
+                        count + histogram.count,
+                    )
+            self.cache.set(self.key, totals, timeout=None)
+
+    def totals(self):
+        if not isinstance(self.cache, RedisCache):
+            return self.cache.get(self.key) or {}
+        key, client = self.redis_client()
+        totals = {}
+        for field, value in client.hgetall(key).items():
+            view, index, bucket = field.decode().split('\t')
+            histograms = totals.setdefault(view, [([0] * (len(buckets) + 1), 0.0, 0) for _, _, buckets, _ in METRICS])
+            counts, total, count = histograms[int(index)]
+            if bucket == 'sum':
+                total = float(value)
+            elif bucket == 'count':
+                count = int(value)
+            else:
+                counts[int(bucket)] = int(value)
+            histograms[int(index)] = (counts, total, count)
+        return totals
+
+    def clear(self):
+        self.cache.delete(self.key)
+
+
+_stores = {}
+
+
+def get_store(alias=None):
+    # One per process and alias, sharing the Redis connection pool and the local lock
+    alias = alias or settings.METRICS_CACHE_ALIAS
+    if alias not in _stores:
+        _stores[alias] = CacheStore(alias)
+    return _stores[alias]
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # view name -> one Histogram per METRICS entry, observed since the last flush
+        self.views = {}
+        # Serializes flushes with clear(), so a flush in progress can't bring back cleared counts
+        self.flush_lock = threading.Lock()
+        self.flusher_pid = None
+
+    def observe(self, view, timings):
+        with self.lock:
+            histograms = self.views.get(view)
+            if histograms is None:
+                histograms = self.views[view] = [Histogram(buckets) for _, _, buckets, _ in METRICS]
+            for histogram, (_, _, _, attribute) in zip(histograms, METRICS):
+                histogram.observe(getattr(timings, attribute))
+        if self.flusher_pid != os.getpid():
+            self.start_flusher()
+
+    def start_flusher(self):
+        # Once per process: a thread doesn't survive a fork, so a worker starts its own
+        with self.lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(target=self.run_flusher, name='metrics-flusher', daemon=True).start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't flush request metrics")
+
+    def flush(self):
+        # Add the pending counts to the shared totals
+        with self.flush_lock:
+            with self.lock:
+                pending, self.views = self.views, {}
+            if pending:
+                get_store().add(pending)
+
+    def collect(self):
+        """
+        The totals of every worker, after flushing this one, as {view: [Histogram per METRICS entry]}.
+        """
+        self.flush()
+        views = {}
+        for view, totals in get_store().totals().items():
+            histograms = views[view] = [Histogram(buckets) for _, _, buckets, _ in METRICS]
+            for histogram, (counts, total, count) in zip(histograms, totals):
+                histogram.counts, histogram.sum, histogram.count = list(counts), total, count
+        return views
+
+    def clear(self):
+        with self.flush_lock:
+            with self.lock:
+                self.views.clear()
+            get_store().clear()
+
+    def render(self):
+        views = self.collect()
+        lines = []
+        for index, (name, help_text, buckets, _) in enumerate(METRICS):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for view, histograms in sorted(views.items()):
+                histogram = histograms[index]
+                label = view.replace('\\', '\\\\').replace('"', '\\"')
+                cumulative = 0
+                for bound, bucket_count in zip((*buckets, '+Inf'), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{label}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{view="{label}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.db_queries += 1
+
+
+def instrument_connection(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def instrument_new_connection(sender, connection, **kwargs):
+    instrument_connection(connection)
+
+
+@contextmanager
+def serializer_span():
+    # Only the outermost serializer call counts: nested ones are part of its time
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    timings.serializer_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer_depth -= 1
+        if not timings.serializer_depth:
+            timings.serializer += time.perf_counter() - start
+
+
+def timed_serializer_method(method):
+    def wrapper(*args, **kwargs):
+        with serializer_span():
+            return method(*args, **kwargs)
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def instrument_serializers():
+    """
+    Time DRF serializers. DRF has no hook around validation and rendering, so this wraps
+    where every serializer goes through, for the whole process: PerformanceConfig.ready()
+    calls it once when SERIALIZER_TIMING is on. uninstrument_serializers() undoes it.
+    """
+    for cls in (serializers.BaseSerializer, serializers.ListSerializer):
+        if not hasattr(cls.is_valid, '__wrapped__'):
+            cls.is_valid = timed_serializer_method(cls.is_valid)
+    data = serializers.BaseSerializer.data
+    if not hasattr(data.fget, '__wrapped__'):
+        serializers.BaseSerializer.data = property(timed_serializer_method(data.fget))
+
+
+def uninstrument_serializers():
+    for cls in (serializers.BaseSerializer, serializers.ListSerializer):
+        if hasattr(cls.is_valid, '__wrapped__'):
+            cls.is_valid = cls.is_valid.__wrapped__
+    data = serializers.BaseSerializer.data
+    if hasattr(data.fget, '__wrapped__'):
+        serializers.BaseSerializer.data = property(data.fget.__wrapped__)
+
+
+def openai_call_started(request):
+    request.extensions['performance_started'] = time.perf_counter()
+
+
+def openai_call_finished(response):
+    timings = _timings.get()
+    started = response.request.extensions.get('performance_started')
+    if timings is not None and started is not None:
+        timings.openai += time.perf_counter() - started
+        timings.openai_calls += 1
+
+
+async def async_openai_call_started(request):
+    openai_call_started(request)
+
+
+async def async_openai_call_finished(response):
+    openai_call_finished(response)
+
+
+def httpx_event_hooks():
+    return {'request': [openai_call_started], 'response': [openai_call_finished]}
+
+
+def async_httpx_event_hooks():
+    return {'request': [async_openai_call_started], 'response': [async_openai_call_finished]}
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI, time the request in the event loop rather than in a thread Django adapts us to
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        # Connections opened before this was imported don't get connection_created again
+        for connection in connections.all(initialized_only=True):
+            instrument_connection(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = Timings()
+        token = _timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        # Views run by sync_to_async get a copy of this context, so they add to these timings
+        timings = Timings()
+        token = _timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        timings.stop()
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timings.server_timing()
+        view = view_name(request)
+        if response.streaming:
+            response.streaming_content = self.observe_stream(response, timings, view)
+        else:
+            registry.observe(view, timings)
+        return response
+
+    def observe_stream(self, response, timings, view):
+        # OpenAI calls and queries made while streaming are the request's too
+        content = response.streaming_content
+        if response.is_async:
+            async def stream():
+                # Not reset with a token: the server may close the stream from another context
+                _timings.set(timings)
+                try:
+                    async for chunk in content:
+                        yield chunk
+                finally:
+                    _timings.set(None)
+                    timings.stop()
+                    registry.observe(view, timings)
+        else:
+            def stream():
+                _timings.set(timings)
+                try:
+                    yield from content
+                finally:
+                    _timings.set(None)
+                    timings.stop()
+                    registry.observe(view, timings)
+        return stream()
+
+
+def metrics(request):
+    """
+    The histograms in the Prometheus text format, for a scraper sending
+    'Authorization: Bearer <METRICS_TOKEN>'. Not found while METRICS_TOKEN is unset.
+    """
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+        return HttpResponse(status=401)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -59,23 +59,48 @@ INSTALLED_APPS = [
     'corsheaders',
     'apps.accounts',
     'apps.storyline',
-    'apps.assistants'
-
+    'apps.assistants',
+    # Request instrumentation, see config/performance.py
+    'config.apps.PerformanceConfig',
 ]
 
 # REST Framework settings
 REST_FRAMEWORK = {
+    # Builds request.user from the access token's claims without a query; views that
+    # need the CustomUser row set authentication_classes = [JWTAuthentication]
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.accounts.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.URLPathVersioning',
     'DEFAULT_VERSION': 'v1',
     'ALLOWED_VERSIONS': ['v1', 'v2'],
     'VERSION_PARAM': 'version',
+    # Token buckets per endpoint class, see config/throttling.py. Rates are
+    # '<scope>.<kind>' or a '<kind>' default; a view's scope is its throttle_scope or class name
+    'DEFAULT_THROTTLE_CLASSES': (
+        'config.throttling.UserThrottle',
+        'config.throttling.IPThrottle',
+        'config.throttling.GlobalThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'user': os.getenv('THROTTLE_RATE_USER', '120/min'),
+        'ip': os.getenv('THROTTLE_RATE_IP', '600/min'),
+        # Each message runs the quest's OpenAI assistant
+        'chat.user': os.getenv('THROTTLE_RATE_CHAT_USER', '20/min'),
+        'chat.global': os.getenv('THROTTLE_RATE_CHAT_GLOBAL'),
+        # Password checks are deliberately slow
+        'TokenObtainPairView.ip': os.getenv('THROTTLE_RATE_LOGIN_IP', '20/min'),
+        'UserViewSet.ip': os.getenv('THROTTLE_RATE_USERS_IP', '60/min'),
+    },
+    # Proxies in front of the app: the client address is the X-Forwarded-For entry the last
+    # of them added, since clients can send any value. Heroku's router is one hop
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '1' if ENVIRONMENT == 'production' else '0')),
 }
 
 
 MIDDLEWARE = [
+    # First, so that its wall time covers the other middleware
+    'config.performance.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -83,12 +108,24 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'config.db_routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = "config.urls"
 
+# Add a Server-Timing header (app, db, serializer and openai durations) to every response.
+# On by default only in development: it tells any client how the server spends its time.
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true' if DEBUG else 'false').lower() in ('1', 'true', 'yes')
+
+# Time DRF serializers for Server-Timing and the metrics. This wraps BaseSerializer.is_valid()
+# and .data for the whole process at start-up; off, DRF is left alone and reports no serializer time
+SERIALIZER_TIMING = os.getenv('SERIALIZER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+
+# Bearer token a Prometheus scraper sends to /internal/metrics; the endpoint is off while unset
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -117,6 +154,23 @@ WSGI_APPLICATION = 'config.wsgi.application'
 #         'NAME': BASE_DIR / 'db.sqlite3',
 #     }
 
+# Database connection reuse. Under ASGI (the production web server) requests don't own
+# a thread, so connections go back to a per-process pool after each request
+# (DATABASE_POOL, on by default in production). With DATABASE_POOL=false, each thread
+# keeps a persistent connection for DATABASE_CONN_MAX_AGE seconds, which suits sync
+# workers (off by default in development, where runserver starts a thread per request).
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'true' if ENVIRONMENT == 'production' else 'false').lower() == 'true'
+DATABASE_CONNECTION = {
+    'ENGINE': 'config.db_backends.pooled_postgresql' if DATABASE_POOL else 'django.db.backends.postgresql',
+    'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.getenv('DATABASE_CONN_MAX_AGE', 60 if ENVIRONMENT == 'production' else 0)),
+    'CONN_HEALTH_CHECKS': os.getenv('DATABASE_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+    'POOL': {
+        'MAX_SIZE': int(os.getenv('DATABASE_POOL_MAX_SIZE', 10)),
+        'TIMEOUT': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+        'MAX_IDLE': float(os.getenv('DATABASE_POOL_MAX_IDLE', 60)),
+    },
+}
+
 if ENVIRONMENT == 'development':
     # DATABASES = {
     #     'default': {
@@ -130,7 +184,7 @@ if ENVIRONMENT == 'development':
     # }
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            **DATABASE_CONNECTION,
             'NAME': 'huispeak-dev-db',
             'USER': 'postgres',
             'PASSWORD': os.getenv('DATABASE_DEV_PASSWORD'),
@@ -142,7 +196,7 @@ if ENVIRONMENT == 'development':
 elif ENVIRONMENT == 'production':
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            **DATABASE_CONNECTION,
             'NAME': 'huispeak_prod_db',
             'USER': 'postgres',
             'PASSWORD': os.getenv('DATABASE_PROD_PASSWORD'),
@@ -153,6 +207,96 @@ elif ENVIRONMENT == 'production':
 else:
     raise ValueError('Invalid DJANGO_ENV value')
 
+# Read replicas of the primary, e.g. DATABASE_REPLICA_HOSTS=replica-1.example.com,replica-2.example.com.
+# Safe API reads of the storyline and accounts apps go to them (see config/db_routers.py).
+DATABASE_REPLICA_HOSTS = [host for host in os.getenv('DATABASE_REPLICA_HOSTS', '').split(',') if host]
+DATABASE_REPLICAS = []
+for n, host in enumerate(DATABASE_REPLICA_HOSTS):
+    DATABASES[f'replica_{n}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{n}')
+DATABASE_ROUTERS = ['config.db_routers.ReplicaRouter']
+DATABASE_REPLICA_PATH_PREFIX = '/api/'
+# After a write, the user's reads stay on the primary this long to cover replication lag
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', 10))
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Redis, shared by every worker. Catalog version bumps, replica pins, session invalidation
+# and throttle buckets all rely on that, so the per-process local memory fallback is only
+# for development and tests.
+REDIS_URL = os.getenv('REDIS_URL')
+
+if not REDIS_URL and not DEBUG:
+    raise ValueError('REDIS_URL must be set when DEBUG is off')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'throttle',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'throttle',
+        },
+    }
+
+# Cache holding the rate limiting token buckets
+THROTTLE_CACHE_ALIAS = os.getenv('THROTTLE_CACHE_ALIAS', 'throttle')
+
+# Cache summing the request metrics histograms of every worker, and the seconds between
+# a worker's updates of it
+METRICS_CACHE_ALIAS = os.getenv('METRICS_CACHE_ALIAS', 'default')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 10))
+
+# Seconds a serialized storyline catalog stays cached; edits invalidate it through a version bump
+STORYLINE_CATALOG_CACHE_TIMEOUT = int(os.getenv('STORYLINE_CATALOG_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Seconds a user's /auth/session/ payload stays cached; saving the user or their personalization invalidates it
+ACCOUNTS_SESSION_CACHE_TIMEOUT = int(os.getenv('ACCOUNTS_SESSION_CACHE_TIMEOUT', 60 * 60))
+
+# 'dense' renumbers siblings on every move, 'sparse' only rewrites the moved row's order key.
+# Run `manage.py rebalance_ordering` before switching from sparse back to dense.
+STORYLINE_ORDERING_MODE = os.getenv('STORYLINE_ORDERING_MODE', 'dense')
+
+# OpenAI client, built lazily once per process by services.openai_service.get_client()
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None  # e.g. a local services/openai_stub.py server
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 30))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', 5))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 2))
+# Keep at least ASSISTANT_SYNC_CONCURRENCY connections so the sync worker never waits on the pool
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', 20))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 20))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', 30))
+
+# Streams conversation turns for /api/v1/quest/<pk>/chat/; FakeChatBackend needs no OpenAI access
+ASSISTANT_CHAT_BACKEND = os.getenv('ASSISTANT_CHAT_BACKEND', 'apps.assistants.chat.OpenAIChatBackend')
+ASSISTANT_CHAT_FAKE_DELAY = float(os.getenv('ASSISTANT_CHAT_FAKE_DELAY', 0.05))
+
+# Assistant sync outbox, drained by `manage.py run_assistant_sync`
+ASSISTANT_SYNC_MAX_ATTEMPTS = int(os.getenv('ASSISTANT_SYNC_MAX_ATTEMPTS', 5))
+ASSISTANT_SYNC_BACKOFF_SECONDS = int(os.getenv('ASSISTANT_SYNC_BACKOFF_SECONDS', 30))
+ASSISTANT_SYNC_MAX_BACKOFF_SECONDS = int(os.getenv('ASSISTANT_SYNC_MAX_BACKOFF_SECONDS', 60 * 60))
+ASSISTANT_SYNC_LEASE_SECONDS = int(os.getenv('ASSISTANT_SYNC_LEASE_SECONDS', 5 * 60))
+# Changes to the same assistant within this window are collapsed into one sync
+ASSISTANT_SYNC_DEBOUNCE_SECONDS = int(os.getenv('ASSISTANT_SYNC_DEBOUNCE_SECONDS', 5))
+# OpenAI calls in flight at once, and calls per second (0 for no limit)
+ASSISTANT_SYNC_CONCURRENCY = int(os.getenv('ASSISTANT_SYNC_CONCURRENCY', 8))
+ASSISTANT_SYNC_RATE_LIMIT = float(os.getenv('ASSISTANT_SYNC_RATE_LIMIT', 0))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -171,6 +315,29 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing policy: 'argon2' or 'pbkdf2'. New passwords use it, and a password
+# hashed by the other one or with a different cost is rehashed on the user's next login.
+# python -m benchmarks.password_hashing measures logins per second per core for both.
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'argon2')
+PASSWORD_HASHER_POLICIES = {
+    'argon2': 'config.hashers.TunableArgon2PasswordHasher',
+    'pbkdf2': 'config.hashers.TunablePBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [
+    PASSWORD_HASHER_POLICIES[PASSWORD_HASHER],
+    *(path for name, path in PASSWORD_HASHER_POLICIES.items() if name != PASSWORD_HASHER),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# Argon2id cost: passes, memory in KiB and lanes
+PASSWORD_ARGON2 = {
+    'TIME_COST': int(os.getenv('PASSWORD_ARGON2_TIME_COST', 2)),
+    'MEMORY_COST': int(os.getenv('PASSWORD_ARGON2_MEMORY_COST', 19 * 1024)),
+    'PARALLELISM': int(os.getenv('PASSWORD_ARGON2_PARALLELISM', 1)),
+}
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', 600000))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -219,12 +386,33 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 
     'JTI_CLAIM': 'jti',
-}
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+    # Access tokens carry is_active, is_staff and the Personalization difficulty, and
+    # rotated or logged out refresh tokens are revoked through RevokedToken
+    'TOKEN_OBTAIN_SERIALIZER': 'apps.accounts.tokens.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'apps.accounts.tokens.TokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'apps.accounts.tokens.TokenVerifySerializer',
+    'TOKEN_BLACKLIST_SERIALIZER': 'apps.accounts.tokens.TokenBlacklistSerializer',
+}
+# Seconds a refresh token found not revoked is cached as such. Revocations are cached
+# until the token expires.
+TOKEN_REVOCATION_NEGATIVE_CACHE_SECONDS = int(os.getenv('TOKEN_REVOCATION_NEGATIVE_CACHE_SECONDS', 60))
+
+# Mail is queued in the database and sent through EMAIL_DELIVERY_BACKEND by
+# `manage.py send_queued_email`, so requests never wait on SMTP
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'apps.accounts.mail.QueuedEmailBackend')
+EMAIL_DELIVERY_BACKEND = os.getenv('EMAIL_DELIVERY_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv('EMAIL_QUEUE_MAX_ATTEMPTS', 5))
+EMAIL_QUEUE_BACKOFF_SECONDS = int(os.getenv('EMAIL_QUEUE_BACKOFF_SECONDS', 60))
+EMAIL_QUEUE_MAX_BACKOFF_SECONDS = int(os.getenv('EMAIL_QUEUE_MAX_BACKOFF_SECONDS', 60 * 60))
+EMAIL_QUEUE_LEASE_SECONDS = int(os.getenv('EMAIL_QUEUE_LEASE_SECONDS', 5 * 60))
+# Days sent and failed mail stays in the outbox before `manage.py purge_sent_email` deletes it
+EMAIL_QUEUE_RETENTION_DAYS = int(os.getenv('EMAIL_QUEUE_RETENTION_DAYS', 30))
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 30))
+# e.g. EMAIL_HOST=127.0.0.1 EMAIL_PORT=1025 EMAIL_USE_TLS=false for a local debugging server
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'true').lower() == 'true'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
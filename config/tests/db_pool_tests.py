@@ -0,0 +1,77 @@
+import threading
+import pytest
+from django.db import connection, connections
+
+pytest.importorskip("psycopg2")
+pooled = pytest.importorskip("config.db_backends.pooled_postgresql.base")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.info = type("Info", (), {"transaction_status": 0})()
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool:
+
+    def make_pool(self, **kwargs):
+        options = {"max_size": 2, "timeout": 0.1, "max_idle": 60, "health_checks": False}
+        options.update(kwargs)
+        return pooled.ConnectionPool(**options)
+
+    def test_reuses_returned_connections(self):
+        pool = self.make_pool()
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+        assert pool.acquire(FakeConnection) is first
+
+    def test_waits_for_a_free_slot(self):
+        pool = self.make_pool(max_size=1, timeout=1)
+        first = pool.acquire(FakeConnection)
+        threading.Timer(0.05, pool.release, [first]).start()
+        assert pool.acquire(FakeConnection) is first
+
+    def test_times_out_when_exhausted(self):
+        pool = self.make_pool(max_size=1)
+        pool.acquire(FakeConnection)
+        with pytest.raises(pooled.base.Database.OperationalError):
+            pool.acquire(FakeConnection)
+
+    def test_discards_connections_in_a_transaction(self):
+        pool = self.make_pool()
+        first = pool.acquire(FakeConnection)
+        first.info.transaction_status = 2
+        pool.release(first)
+        assert first.closed
+        assert pool.acquire(FakeConnection) is not first
+
+    def test_discards_stale_connections(self):
+        pool = self.make_pool(max_idle=0)
+        first = pool.acquire(FakeConnection)
+        pool.release(first)
+        assert pool.acquire(FakeConnection) is not first
+        assert first.closed
+
+
+@pytest.mark.django_db
+class TestPooledBackend:
+
+    def test_connection_returns_to_pool(self):
+        if connection.vendor != "postgresql":
+            pytest.skip("Needs PostgreSQL")
+        settings_dict = dict(connections["default"].settings_dict, ENGINE="config.db_backends.pooled_postgresql", CONN_MAX_AGE=0)
+        wrapper = pooled.DatabaseWrapper(settings_dict, alias="pooled_test")
+
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            first_pid = cursor.fetchone()[0]
+        wrapper.close()
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            second_pid = cursor.fetchone()[0]
+        wrapper.close()
+
+        assert first_pid == second_pid
@@ -0,0 +1,204 @@
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings as django_settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.utils.functional import SimpleLazyObject
+from rest_framework.test import APIClient
+from apps.accounts.models import Personalization
+from apps.assistants.models import AssistantSyncJob
+from apps.storyline.models import Story, Adventure
+from config.db_routers import ReplicaRouter, ReplicaRoutingMiddleware, use_primary
+
+User = get_user_model()
+router = ReplicaRouter()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
+def route(request, read=Story, before=None):
+    """
+    Run the middleware around a view that optionally does something, then asks where
+    a read of `read` would go.
+    """
+    routed = {}
+
+    def view(request):
+        if before:
+            before(request)
+        routed['db'] = router.db_for_read(read)
+        return HttpResponse()
+
+    ReplicaRoutingMiddleware(view)(request)
+    return routed['db']
+
+
+def aroute(request, read=Story, before=None):
+    """
+    route() with an async view, whose database work runs in a thread as it does under ASGI.
+    """
+    routed = {}
+
+    def work(request):
+        if before:
+            before(request)
+        routed['db'] = router.db_for_read(read)
+
+    async def view(request):
+        await sync_to_async(work)(request)
+        return HttpResponse()
+
+    middleware = ReplicaRoutingMiddleware(view)
+    assert iscoroutinefunction(middleware)
+    async_to_sync(middleware)(request)
+    return routed['db']
+
+
+class TestReplicaRouter:
+
+    @pytest.fixture(autouse=True)
+    def replicas(self, settings):
+        settings.DATABASE_REPLICAS = ['replica_0']
+
+    @pytest.fixture
+    def user(self):
+        return User(pk=7, username="player", is_active=True)
+
+    def test_safe_api_reads_go_to_replica(self):
+        assert route(RequestFactory().get("/api/v1/storyline/")) == 'replica_0'
+
+    def test_unsafe_requests_read_primary(self):
+        assert route(RequestFactory().post("/api/v1/personalizations/")) == 'default'
+
+    def test_only_api_requests(self):
+        assert route(RequestFactory().get("/admin/storyline/story/")) == 'default'
+
+    def test_only_replicated_apps(self):
+        assert route(RequestFactory().get("/api/v1/storyline/"), read=AssistantSyncJob) == 'default'
+
+    def test_outside_requests(self):
+        assert router.db_for_read(Story) == 'default'
+
+    def test_use_primary(self):
+        def force_primary(request):
+            with use_primary():
+                assert router.db_for_read(Story) == 'default'
+
+        # The block only applies inside it
+        assert route(RequestFactory().get("/api/v1/storyline/"), before=force_primary) == 'replica_0'
+
+    @pytest.mark.django_db
+    def test_atomic_blocks_read_primary(self):
+        def read_in_transaction(request):
+            with transaction.atomic():
+                assert router.db_for_read(Story) == 'default'
+
+        route(RequestFactory().get("/api/v1/storyline/"), before=read_in_transaction)
+
+    def test_reads_after_a_write_go_to_primary(self, user):
+        def write(request):
+            request.user = user
+            assert router.db_for_write(Personalization) == 'default'
+
+        request = RequestFactory().get("/api/v1/personalizations/")
+        assert route(request, before=write) == 'default'
+        # and the user stays on the primary for the following requests
+        request = RequestFactory().get("/api/v1/personalizations/")
+        assert route(request, before=lambda request: setattr(request, 'user', user)) == 'default'
+
+    def test_pin_expires(self, user, settings):
+        settings.DATABASE_REPLICA_STICKY_SECONDS = 0
+        route(RequestFactory().post("/api/v1/personalizations/"), before=lambda request: (
+            setattr(request, 'user', user), router.db_for_write(Personalization)
+        ))
+        request = RequestFactory().get("/api/v1/personalizations/")
+        assert route(request, before=lambda request: setattr(request, 'user', user)) == 'replica_0'
+
+    def test_pins_are_per_user(self, user):
+        route(RequestFactory().post("/api/v1/personalizations/"), before=lambda request: (
+            setattr(request, 'user', user), router.db_for_write(Personalization)
+        ))
+        other = User(pk=8, username="other", is_active=True)
+        request = RequestFactory().get("/api/v1/personalizations/")
+        assert route(request, before=lambda request: setattr(request, 'user', other)) == 'replica_0'
+
+    def test_session_user_is_not_resolved(self):
+        def lazy_user(request):
+            request.user = SimpleLazyObject(lambda: pytest.fail("resolved the session user"))
+
+        assert route(RequestFactory().get("/api/v1/storyline/"), before=lazy_user) == 'replica_0'
+
+    def test_anonymous_user(self):
+        def anonymous(request):
+            request.user = AnonymousUser()
+
+        assert route(RequestFactory().get("/api/v1/storyline/"), before=anonymous) == 'replica_0'
+
+    def test_async_views(self, user):
+        assert aroute(RequestFactory().get("/api/v1/storyline/")) == 'replica_0'
+        assert aroute(RequestFactory().get("/admin/storyline/story/")) == 'default'
+
+        def write(request):
+            request.user = user
+            router.db_for_write(Personalization)
+
+        aroute(RequestFactory().post("/api/v1/personalizations/"), before=write)
+        request = RequestFactory().get("/api/v1/personalizations/")
+        assert aroute(request, before=lambda request: setattr(request, 'user', user)) == 'default'
+
+
+has_replica = 'replica_0' in django_settings.DATABASES and not django_settings.DATABASES['replica_0'].get('TEST', {}).get('MIRROR')
+
+
+@pytest.mark.skipif(not has_replica, reason="Needs a replica_0 database separate from default")
+@pytest.mark.django_db(databases=['default', 'replica_0'], transaction=True)
+class TestReplicaRoutingWithTwoDatabases:
+    """
+    The replica is a second, empty database, standing in for one that hasn't caught up.
+    Transactional, because reads inside an atomic block always go to the primary.
+    """
+
+    @pytest.fixture(autouse=True)
+    def replicas(self, settings):
+        settings.DATABASE_REPLICAS = ['replica_0']
+
+    @pytest.fixture
+    def user(self):
+        return User.objects.create_user(username="player", email="player@example.com", password="password123", is_active=True)
+
+    @pytest.fixture
+    def api_client(self, user):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client
+
+    def test_detail_reads_come_from_replica(self, api_client):
+        story = Story.objects.create(title="Story One", description="First Story")
+        adventure = Adventure.objects.create(title="Adventure One", description="First Adventure", story=story)
+
+        assert api_client.get(f"/api/v1/adventure/{adventure.pk}/").status_code == 404
+
+    def test_catalog_is_built_from_primary(self, api_client):
+        Story.objects.create(title="Story One", description="First Story")
+
+        response = api_client.get("/api/v1/storyline/")
+
+        assert [story["title"] for story in response.json()["stories"]] == ["Story One"]
+
+    def test_read_your_writes(self, api_client, user):
+        response = api_client.post("/api/v1/personalizations/", {"difficulty": 3})
+        assert response.status_code == 201
+
+        # The replica doesn't have it yet, but this user is pinned to the primary
+        response = api_client.get("/api/v1/personalizations/")
+        assert [p["difficulty"] for p in response.json()] == [3]
+
+        cache.clear()
+        assert api_client.get("/api/v1/personalizations/").json() == []
@@ -0,0 +1,196 @@
+import re
+import pytest
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.storyline.models import Story
+from config.performance import (
+    PerformanceMiddleware, Registry, Timings, instrument_serializers, registry, uninstrument_serializers,
+)
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def empty_registry():
+    registry.clear()
+
+
+@pytest.fixture
+def api_client(db):
+    user = User.objects.create_user(username='player', email='player@example.com', password='password123', is_active=True)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    return client
+
+
+def server_timing(response):
+    # {'app': (duration, description), ...}
+    timings = {}
+    for entry in response['Server-Timing'].split(', '):
+        name, *params = entry.split(';')
+        values = dict(param.split('=', 1) for param in params)
+        timings[name] = (float(values['dur']), values.get('desc', '').strip('"'))
+    return timings
+
+
+def histograms(view):
+    return dict(zip(
+        ('wall', 'db_queries', 'db', 'serializer', 'openai'),
+        [(h.count, h.sum) for h in registry.collect()[view]],
+    ))
+
+
+@pytest.mark.django_db
+class TestPerformanceMiddleware:
+
+    def test_server_timing_header(self, api_client, settings):
+        settings.SERVER_TIMING = True
+        Story.objects.create(title='Story One', description='First Story')
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.get('/api/v1/storyline/')
+
+        timings = server_timing(response)
+        assert set(timings) == {'app', 'db', 'serializer', 'openai'}
+        assert timings['db'][1] == f'{len(queries)} queries'
+        assert timings['openai'] == (0.0, '0 calls')
+        assert timings['app'][0] >= timings['db'][0]
+
+    def test_server_timing_can_be_disabled(self, api_client, settings):
+        settings.SERVER_TIMING = False
+        assert 'Server-Timing' not in api_client.get('/api/v1/storyline/')
+
+    def test_observes_per_view(self, api_client):
+        Story.objects.create(title='Story One', description='First Story')
+        with CaptureQueriesContext(connection) as queries:
+            api_client.get('/api/v1/storyline/')
+        api_client.get('/api/v1/storyline/')
+        api_client.get('/api/v1/personalizations/')
+
+        story_list = histograms('storyline:v1:story-list')
+        assert story_list['wall'][0] == 2
+        assert story_list['db_queries'][1] >= len(queries)
+        personalizations = histograms('accounts:v1:personalization-list')
+        assert personalizations['wall'][0] == 1
+        assert personalizations['serializer'][1] > 0
+
+    def test_async_views(self, settings):
+        settings.SERVER_TIMING = True
+
+        async def view(request):
+            await sync_to_async(lambda: list(Story.objects.all()))()
+            return HttpResponse()
+
+        middleware = PerformanceMiddleware(view)
+        assert iscoroutinefunction(middleware)
+        response = async_to_sync(middleware)(RequestFactory().get('/api/v1/storyline/'))
+
+        # Queries run in a thread still count for the request
+        assert server_timing(response)['db'][1] == '1 queries'
+        assert histograms('<unresolved>')['db_queries'] == (1, 1)
+
+    def test_unresolved_requests_share_one_view(self, client):
+        client.get('/nowhere/')
+        client.get('/elsewhere/')
+        assert histograms('<unresolved>')['wall'][0] == 2
+
+    def test_nested_serializer_time_counts_once(self, api_client):
+        from rest_framework import serializers
+
+        class Inner(serializers.Serializer):
+            value = serializers.IntegerField()
+
+        class Outer(serializers.Serializer):
+            inner = serializers.SerializerMethodField()
+
+            def get_inner(self, obj):
+                return Inner({'value': 1}).data
+
+        from config.performance import Timings, _timings
+        timings = Timings()
+        token = _timings.set(timings)
+        try:
+            Outer({}).data
+        finally:
+            _timings.reset(token)
+        assert timings.serializer > 0
+        assert timings.serializer_depth == 0
+
+
+def serializers_instrumented():
+    from rest_framework import serializers
+    return [
+        hasattr(serializers.BaseSerializer.is_valid, '__wrapped__'),
+        hasattr(serializers.ListSerializer.is_valid, '__wrapped__'),
+        hasattr(serializers.BaseSerializer.data.fget, '__wrapped__'),
+    ]
+
+
+def test_serializers_are_instrumented_once_at_start_up(settings):
+    config = apps.get_app_config('performance')
+    assert serializers_instrumented() == [True, True, True]
+    uninstrument_serializers()
+    try:
+        assert serializers_instrumented() == [False, False, False]
+        # Building the middleware leaves DRF alone
+        PerformanceMiddleware(lambda request: HttpResponse())
+        assert serializers_instrumented() == [False, False, False]
+        settings.SERIALIZER_TIMING = False
+        config.ready()
+        assert serializers_instrumented() == [False, False, False]
+        settings.SERIALIZER_TIMING = True
+        config.ready()
+        assert serializers_instrumented() == [True, True, True]
+    finally:
+        instrument_serializers()
+
+
+def test_workers_share_totals():
+    # Each registry stands for a worker process; both add to the same cache
+    workers = [Registry(), Registry()]
+    timings = Timings()
+    timings.db_queries = 3
+    for worker in workers:
+        worker.observe('storyline:v1:story-list', timings)
+
+    # A worker's counts reach the totals when it flushes
+    assert workers[0].collect()['storyline:v1:story-list'][1].count == 1
+    workers[1].flush()
+    queries = workers[0].collect()['storyline:v1:story-list'][1]
+    assert (queries.count, queries.sum) == (2, 6)
+    assert queries.counts[3] == 2
+
+
+@pytest.mark.django_db
+class TestMetricsEndpoint:
+
+    def test_off_without_token(self, client, settings):
+        settings.METRICS_TOKEN = None
+        assert client.get('/internal/metrics').status_code == 404
+
+    def test_requires_token(self, client, settings):
+        settings.METRICS_TOKEN = 'scrape'
+        assert client.get('/internal/metrics').status_code == 401
+        assert client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer other').status_code == 401
+
+    def test_prometheus_text_format(self, client, api_client, settings):
+        settings.METRICS_TOKEN = 'scrape'
+        api_client.get('/api/v1/storyline/')
+
+        response = client.get('/internal/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+
+        assert response.status_code == 200
+        assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+        body = response.content.decode()
+        assert '# TYPE http_request_duration_seconds histogram' in body
+        assert 'http_request_duration_seconds_count{view="storyline:v1:story-list"} 1' in body
+        assert 'http_request_db_queries_bucket{view="storyline:v1:story-list",le="+Inf"} 1' in body
+        # Buckets are cumulative
+        counts = [int(n) for n in re.findall(r'http_request_db_queries_bucket\{view="storyline:v1:story-list",le="[^"]+"\} (\d+)', body)]
+        assert counts == sorted(counts)
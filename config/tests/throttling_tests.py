@@ -0,0 +1,108 @@
+from unittest import mock
+import pytest
+from django.conf import settings as django_settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from config.throttling import TokenBucket, parse_rate
+
+User = get_user_model()
+
+
+@pytest.fixture
+def rates(settings):
+    # Replaces DEFAULT_THROTTLE_RATES; DRF reloads its settings on the change
+    def set_rates(**rates):
+        settings.REST_FRAMEWORK = {**django_settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+    return set_rates
+
+
+def client_for(username):
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='password123', is_active=True)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    return client
+
+
+def test_parse_rate():
+    assert parse_rate('100/min') == (100, 60)
+    assert parse_rate('5/10s') == (5, 10)
+    assert parse_rate('1000/day') == (1000, 86400)
+    assert parse_rate(None) is None
+    assert parse_rate('') is None
+    with pytest.raises(ImproperlyConfigured):
+        parse_rate('100 per minute')
+
+
+def test_bucket_allows_a_burst_then_refills():
+    bucket = TokenBucket()
+    with mock.patch('config.throttling.time.time', return_value=1000.0) as clock:
+        assert [bucket.take('burst', 4, 60) for _ in range(4)] == [0, 0, 0, 0]
+        assert bucket.take('burst', 4, 60) == pytest.approx(15)
+        # One token refills every 15 seconds
+        clock.return_value = 1015.0
+        assert bucket.take('burst', 4, 60) == 0
+        assert bucket.take('burst', 4, 60) == pytest.approx(15)
+        # A full period refills the whole bucket, and no more
+        clock.return_value = 2000.0
+        assert [bucket.take('burst', 4, 60) for _ in range(5)][-2:] == [0, pytest.approx(15)]
+
+
+def test_buckets_are_separate():
+    bucket = TokenBucket()
+    assert bucket.take('one', 1, 60) == 0
+    assert bucket.take('one', 1, 60) > 0
+    assert bucket.take('two', 1, 60) == 0
+
+
+@pytest.mark.django_db
+class TestThrottling:
+
+    def test_user_throttle_per_endpoint_class(self, rates):
+        rates(**{'SessionView.user': '2/min'})
+        client = client_for('first')
+        assert [client.get('/api/v1/auth/session/').status_code for _ in range(2)] == [200, 200]
+
+        response = client.get('/api/v1/auth/session/')
+
+        assert response.status_code == 429
+        assert response['Retry-After'] == '30'
+        # Other endpoints and other users have their own buckets
+        assert client.get('/api/v1/storyline/').status_code == 200
+        assert client_for('second').get('/api/v1/auth/session/').status_code == 200
+
+    def test_ip_throttle_covers_anonymous_requests(self, rates):
+        rates(**{'TokenObtainPairView.ip': '1/min'})
+        User.objects.create_user(username='player', email='player@example.com', password='password123', is_active=True)
+        credentials = {'username': 'player', 'password': 'password123'}
+        client = APIClient()
+        assert client.post('/api/v1/auth/jwt/create/', credentials).status_code == 200
+
+        assert client.post('/api/v1/auth/jwt/create/', credentials).status_code == 429
+        assert client.post('/api/v1/auth/jwt/create/', credentials, REMOTE_ADDR='10.0.0.2').status_code == 200
+
+    @pytest.mark.parametrize('num_proxies', [0, 1])
+    def test_forwarded_for_cannot_reset_the_bucket(self, rates, settings, num_proxies):
+        rates(**{'TokenObtainPairView.ip': '1/min'})
+        settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, 'NUM_PROXIES': num_proxies}
+        client = APIClient()
+
+        def login(forwarded_for):
+            # Behind the router, the client's own header comes first and the router appends the address
+            if num_proxies:
+                forwarded_for = f'{forwarded_for}, 203.0.113.5'
+            return client.post('/api/v1/auth/jwt/create/', {}, HTTP_X_FORWARDED_FOR=forwarded_for).status_code
+
+        assert login('10.1.0.1') == 400
+        assert [login(f'10.1.0.{n}') for n in range(2, 5)] == [429, 429, 429]
+
+    def test_global_throttle_is_shared(self, rates):
+        rates(**{'SessionView.global': '1/min'})
+        assert client_for('first').get('/api/v1/auth/session/').status_code == 200
+        assert client_for('second').get('/api/v1/auth/session/').status_code == 429
+
+    def test_missing_rate_disables(self, rates):
+        rates()
+        client = client_for('first')
+        assert {client.get('/api/v1/auth/session/').status_code for _ in range(50)} == {200}
@@ -0,0 +1,157 @@
+"""
+Token-bucket rate limiting.
+
+Each bucket holds `n` tokens for a rate of 'n/period' and refills at n per period, so a
+client can burst up to n requests and then sustains the rate. A bucket is stored as a
+single timestamp, the moment it will be full again (GCRA), in the THROTTLE_CACHE_ALIAS
+cache: one Lua script round trip on Redis, a locked get and set on the local memory
+fallback, and never a database write.
+
+Buckets are per endpoint class: a view's throttle_scope, or its class name. The rate
+for a scope and throttle kind is looked up in DEFAULT_THROTTLE_RATES as
+'<scope>.<kind>', falling back to '<kind>'; a missing or empty rate disables it.
+"""
+import math
+import re
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+RATE = re.compile(r'(\d+)/(\d*)([smhd])[a-z]*')
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+# KEYS[1] holds the time the bucket is full again; ARGV[1] is the seconds one token
+# takes to refill, ARGV[2] the seconds the whole bucket takes. Returns 0 when a token
+# was taken, otherwise the seconds until one is available.
+TAKE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local full_at = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), now) + interval
+local wait = full_at - tonumber(ARGV[2]) - now
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('SET', KEYS[1], tostring(full_at), 'PX', math.ceil((full_at - now) * 1000))
+return '0'
+"""
+
+
+def parse_rate(rate):
+    """
+    'n/period' as (n, seconds), where period is an optional count and a unit:
+    '100/min', '5/10s'. None for no (or an empty) rate.
+    """
+    if not rate:
+        return None
+    match = RATE.fullmatch(rate)
+    if match is None:
+        raise ImproperlyConfigured(f"Invalid throttle rate {rate!r}")
+    count, periods, unit = match.groups()
+    return int(count), int(periods or 1) * DURATIONS[unit]
+
+
+class TokenBucket:
+    def __init__(self, alias=None):
+        self.cache = caches[alias or settings.THROTTLE_CACHE_ALIAS]
+        self.lock = threading.Lock()
+        self.script = None
+
+    def take(self, key, capacity, period):
+        """
+        Take a token from the bucket at key. Returns 0 if there was one, otherwise the
+        seconds until there is.
+        """
+        interval = period / capacity
+        if isinstance(self.cache, RedisCache):
+            return self.take_redis(key, interval, period)
+        # The local memory cache is per process, so a process lock makes this exact;
+        # on other shared backends concurrent requests may both get the last token
+        with self.lock:
+            now = time.time()
+            full_at = max(self.cache.get(key) or 0, now) + interval
+            wait = full_at - period - now
+            if wait > 0:
+                return wait
+            self.cache.set(key, full_at, timeout=math.ceil(full_at - now))
+            return 0
+
+    def take_redis(self, key, interval, period):
+        key = self.cache.make_and_validate_key(key)
+        client = self.cache._cache.get_client(key, write=True)
+        if self.script is None:
+            self.script = client.register_script(TAKE_SCRIPT)
+        return float(self.script(keys=[key], args=[interval, period], client=client))
+
+
+_buckets = {}
+
+
+def get_bucket(alias=None):
+    # One per process and alias, sharing the Redis connection pool and script
+    alias = alias or settings.THROTTLE_CACHE_ALIAS
+    if alias not in _buckets:
+        _buckets[alias] = TokenBucket(alias)
+    return _buckets[alias]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Base class: subclasses set kind and return the client's identity from
+    get_ident(), or None to leave the request alone. Only uses request.META and
+    request.user, so it also works on the plain Django requests of async views.
+    """
+    kind = None
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_scope(self, view):
+        return getattr(view, 'throttle_scope', None) or type(view).__name__
+
+    def get_rate(self, scope):
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        return parse_rate(rates.get(f'{scope}.{self.kind}', rates.get(self.kind)))
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(view)
+        rate = self.get_rate(scope)
+        if rate is None:
+            return True
+        ident = self.get_ident(request)
+        if ident is None:
+            return True
+        self.wait_seconds = get_bucket().take(f'{self.kind}:{scope}:{ident}', *rate)
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserThrottle(TokenBucketThrottle):
+    """A bucket per authenticated user; anonymous requests are left to IPThrottle."""
+    kind = 'user'
+
+    def get_ident(self, request):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return user.pk
+
+
+class IPThrottle(TokenBucketThrottle):
+    """A bucket per client address, for every request (NUM_PROXIES sets how it's read)."""
+    kind = 'ip'
+
+
+class GlobalThrottle(TokenBucketThrottle):
+    """One bucket shared by all clients, e.g. to keep an endpoint within an upstream quota."""
+    kind = 'global'
+
+    def get_ident(self, request):
+        return 'all'
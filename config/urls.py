@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from config.performance import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('internal/metrics', metrics, name='metrics'),
     path('api/', include([
         path('', include('apps.accounts.urls')),
         path('', include('apps.storyline.urls')),
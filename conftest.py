@@ -0,0 +1,9 @@
+import pytest
+from django.conf import settings
+from django.core.cache import caches
+
+
+@pytest.fixture(autouse=True)
+def empty_throttle_buckets():
+    # Every test client comes from the same address, so buckets would carry over between tests
+    caches[settings.THROTTLE_CACHE_ALIAS].clear()
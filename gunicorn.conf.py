@@ -0,0 +1,26 @@
+"""
+Gunicorn settings, read by the Procfile's `gunicorn -c gunicorn.conf.py`.
+
+SERVER_MODE=asgi (the default) serves config.asgi with uvicorn workers, so the async
+views (chat streams, sync triggers) hold many concurrent requests per worker while
+sync views run in its thread pool. SERVER_MODE=wsgi serves config.wsgi with sync
+workers, threaded when GUNICORN_THREADS is above 1. Chat replies don't stream under
+WSGI: Django consumes an async streaming response in full before sending it.
+"""
+import os
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'asgi')
+if SERVER_MODE not in ('wsgi', 'asgi'):
+    raise ValueError(f"Invalid SERVER_MODE {SERVER_MODE!r}, expected 'wsgi' or 'asgi'")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+accesslog = '-'
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'config.wsgi:application'
+    threads = int(os.getenv('GUNICORN_THREADS', 1))
@@ -1,6 +1,102 @@
+"""
+Process-wide OpenAI clients, built on first use.
+
+Nothing is constructed at import time, so importing the models needs no API key.
+Connection pooling, keep-alive, timeouts, retries and the base URL come from the
+OPENAI_* settings; point OPENAI_BASE_URL at services/openai_stub.py to run without OpenAI.
+Their event hooks add each call's time to the current request's performance timings.
+"""
+import asyncio
+import threading
+import weakref
+import httpx
 import openai
-from os import environ
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from config.performance import async_httpx_event_hooks, httpx_event_hooks
+
+_lock = threading.Lock()
+_client = None
+# httpx async pools belong to the event loop that opened them, so there is one client per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def client_options():
+    return {
+        'api_key': settings.OPENAI_API_KEY,
+        'base_url': settings.OPENAI_BASE_URL,
+        'max_retries': settings.OPENAI_MAX_RETRIES,
+        'timeout': httpx.Timeout(settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT),
+    }
+
+
+def pool_limits():
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = openai.Client(
+                    http_client=openai.DefaultHttpxClient(limits=pool_limits(), event_hooks=httpx_event_hooks()),
+                    **client_options(),
+                )
+    return _client
+
+
+def get_async_client():
+    """
+    The AsyncOpenAI client for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = openai.AsyncClient(
+            http_client=openai.DefaultAsyncHttpxClient(limits=pool_limits(), event_hooks=async_httpx_event_hooks()),
+            **client_options(),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def reset_clients():
+    """
+    Drop the shared clients so the next call builds new ones from the current settings.
+    """
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        # Async clients are closed with their loop; just stop handing them out
+        _async_clients.clear()
+
+
+@receiver(setting_changed)
+def reset_clients_on_setting_change(sender, setting, **kwargs):
+    if setting.startswith('OPENAI_'):
+        reset_clients()
+
+
+class SharedClient:
+    """
+    Stands in for the shared client, looking it up on every attribute access so that
+    it follows reset_clients().
+    """
+    def __getattr__(self, name):
+        # Introspection (mock.patch, copy, pickle) probes dunders; answering those
+        # must not build the client, which needs an API key
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(get_client(), name)
+
 
-# Set the OpenAI API key from the environment variable
-openai.api_key = environ.get('OPENAI_API_KEY')
-client = openai.Client()
\ No newline at end of file
+# Kept for `from services.openai_service import client`
+client = SharedClient()
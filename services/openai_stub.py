@@ -0,0 +1,188 @@
+"""
+Local stand-in for the OpenAI assistants API, for tests and benchmarks.
+
+    with AssistantsStubServer(latency=0.2) as stub:
+        client = openai.Client(base_url=stub.base_url, api_key='stub')
+
+or run the app against it by setting OPENAI_BASE_URL to stub.base_url.
+
+Every request sleeps for `latency` seconds before answering. Streamed runs
+(threads/runs and threads/<id>/runs) echo the user's message back word by word,
+`stream_delay` seconds apart. The server counts requests, TCP connections and the
+peak number of requests in flight at once.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ASSISTANT_PATH = re.compile(r'^/v1/assistants/(?P<assistant_id>[\w-]+)$')
+RUNS_PATH = re.compile(r'^/v1/threads/(?P<thread_id>[\w-]+)/runs$')
+
+
+class AssistantsStubServer:
+    def __init__(self, latency=0.0, stream_delay=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.stream_delay = stream_delay
+        self.assistants = {}
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def enter(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def create(self, body):
+        assistant = {
+            'id': f"asst_{uuid.uuid4().hex[:24]}",
+            'object': 'assistant',
+            'created_at': int(time.time()),
+            'name': body.get('name'),
+            'description': None,
+            'model': body.get('model'),
+            'instructions': body.get('instructions'),
+            'tools': body.get('tools', []),
+            'metadata': {},
+        }
+        with self.lock:
+            self.assistants[assistant['id']] = assistant
+        return 200, assistant
+
+    def update(self, assistant_id, body):
+        with self.lock:
+            assistant = self.assistants.get(assistant_id)
+            if assistant is None:
+                return 404, {'error': {'message': f"No assistant found with id '{assistant_id}'.", 'type': 'invalid_request_error'}}
+            assistant.update({key: value for key, value in body.items() if key in assistant})
+        return 200, assistant
+
+    def run_events(self, thread_id, assistant_id, message):
+        """
+        Assistant stream events for a run answering `message` by echoing it word by word.
+        """
+        run_id = f"run_{uuid.uuid4().hex[:24]}"
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+        run = {
+            'id': run_id, 'object': 'thread.run', 'thread_id': thread_id, 'assistant_id': assistant_id,
+            'status': 'queued', 'created_at': int(time.time()),
+        }
+        yield 'thread.run.created', run
+        for index, word in enumerate(f"You said: {message}".split(' ')):
+            yield 'thread.message.delta', {
+                'id': message_id,
+                'object': 'thread.message.delta',
+                'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': word + ' '}}]},
+            }
+        yield 'thread.run.completed', dict(run, status='completed')
+
+    def delete(self, assistant_id):
+        with self.lock:
+            deleted = self.assistants.pop(assistant_id, None) is not None
+        return 200, {'id': assistant_id, 'object': 'assistant.deleted', 'deleted': deleted}
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def respond(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def stream(self, events):
+                # No Content-Length: the body ends when the connection closes
+                self.close_connection = True
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for event, data in events:
+                    self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(stub.stream_delay)
+                self.wfile.write(b"event: done\ndata: [DONE]\n\n")
+
+            def run(self, thread_id, body):
+                messages = body.get('additional_messages') or body.get('thread', {}).get('messages') or [{}]
+                return self.stream(stub.run_events(thread_id, body.get('assistant_id'), messages[-1].get('content', '')))
+
+            def handle_request(self, method):
+                stub.enter()
+                try:
+                    time.sleep(stub.latency)
+                    match = ASSISTANT_PATH.match(self.path)
+                    if method == 'POST' and self.path == '/v1/assistants':
+                        return self.respond(*stub.create(self.read_body()))
+                    if method == 'POST' and match:
+                        return self.respond(*stub.update(match['assistant_id'], self.read_body()))
+                    runs = RUNS_PATH.match(self.path)
+                    if method == 'POST' and runs:
+                        return self.run(runs['thread_id'], self.read_body())
+                    if method == 'POST' and self.path == '/v1/threads/runs':
+                        return self.run(f"thread_{uuid.uuid4().hex[:24]}", self.read_body())
+                    if method == 'DELETE' and match:
+                        return self.respond(*stub.delete(match['assistant_id']))
+                    self.respond(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+                finally:
+                    stub.leave()
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+        return Handler
@@ -0,0 +1,128 @@
+"""
+Local SMTP server that accepts and keeps messages, for tests, benchmarks and as a
+debugging server in development.
+
+    with SMTPStubServer(latency=0.2) as stub:
+        # EMAIL_HOST='127.0.0.1', EMAIL_PORT=stub.port, EMAIL_USE_TLS=False
+        ...
+
+    python -m services.smtp_stub --port 1025
+
+`latency` seconds are spent on the greeting of each connection and on each message,
+like the handshake and round trips of a remote server. The server counts TCP
+connections and keeps every message as (sender, recipients, data). Set
+`reject_next` to answer the next messages with a temporary failure.
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class SMTPStubServer:
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0, verbose=False):
+        self.latency = latency
+        self.verbose = verbose
+        self.messages = []
+        self.connections = 0
+        self.reject_next = 0
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def accept(self, sender, recipients, data):
+        # Returns the reply to the end of DATA
+        with self.lock:
+            if self.reject_next:
+                self.reject_next -= 1
+                return '451 Try again later'
+            self.messages.append((sender, recipients, data))
+        if self.verbose:
+            print(f"From {sender} to {', '.join(recipients)}\n{data.decode(errors='replace')}\n")
+        return '250 OK'
+
+    def handler_class(self):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode() + b'\r\n')
+
+            def handle(self):
+                with stub.lock:
+                    stub.connections += 1
+                time.sleep(stub.latency)
+                self.reply('220 smtp-stub ESMTP')
+                sender, recipients = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors='replace').strip()
+                    verb = command[:4].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-smtp-stub')
+                        self.reply('250 8BITMIME')
+                    elif verb == 'HELO':
+                        self.reply('250 smtp-stub')
+                    elif verb == 'MAIL':
+                        sender, recipients = command.split(':', 1)[1].strip(' <>'), []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipients.append(command.split(':', 1)[1].strip(' <>'))
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        lines = []
+                        while True:
+                            data_line = self.rfile.readline()
+                            if not data_line or data_line in (b'.\r\n', b'.\n'):
+                                break
+                            lines.append(data_line[1:] if data_line.startswith(b'.') else data_line)
+                        time.sleep(stub.latency)
+                        self.reply(stub.accept(sender, recipients, b''.join(lines)))
+                    elif verb in ('RSET', 'NOOP'):
+                        if verb == 'RSET':
+                            sender, recipients = None, []
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print every message sent to a local SMTP server.")
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    stub = SMTPStubServer(latency=args.latency, port=args.port, verbose=True)
+    print(f"Listening on 127.0.0.1:{stub.port}")
+    stub.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()